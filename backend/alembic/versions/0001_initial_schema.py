@@ -0,0 +1,88 @@
+"""Initial schema: projects, documents, chunks, chat sessions, messages, preferences
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 00:00:00
+
+Databases created before migrations were tracked already have these tables:
+run `alembic stamp 0001` on them once, then `alembic upgrade head`.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0001'
+down_revision: Union[str, Sequence[str], None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'projects',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('description', sa.String(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+    )
+    op.create_index('ix_projects_id', 'projects', ['id'])
+    op.create_table(
+        'documents',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('project_id', sa.Integer(), sa.ForeignKey('projects.id'), nullable=False),
+        sa.Column('filename', sa.String(), nullable=False),
+        sa.Column('filetype', sa.String(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('status', sa.String(), nullable=True),
+    )
+    op.create_index('ix_documents_id', 'documents', ['id'])
+    op.create_table(
+        'chunks',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('document_id', sa.Integer(), sa.ForeignKey('documents.id'), nullable=False),
+        sa.Column('text', sa.Text(), nullable=False),
+        sa.Column('chunk_metadata', sa.JSON(), nullable=True),
+        sa.Column('vector_id', sa.String(), nullable=True),
+    )
+    op.create_index('ix_chunks_id', 'chunks', ['id'])
+    op.create_table(
+        'chat_sessions',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('project_id', sa.Integer(), sa.ForeignKey('projects.id'), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('history', sa.JSON(), nullable=True),
+        sa.Column('language', sa.String(), nullable=True),
+    )
+    op.create_index('ix_chat_sessions_id', 'chat_sessions', ['id'])
+    op.create_table(
+        'messages',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('session_id', sa.Integer(), sa.ForeignKey('chat_sessions.id'), nullable=False),
+        sa.Column('sender', sa.String(), nullable=False),
+        sa.Column('text', sa.Text(), nullable=False),
+        sa.Column('timestamp', sa.DateTime(), nullable=True),
+        sa.Column('embedding_ref', sa.String(), nullable=True),
+        sa.Column('language', sa.String(), nullable=True),
+        sa.Column('image_url', sa.String(), nullable=True),
+        sa.Column('ocr_text', sa.Text(), nullable=True),
+    )
+    op.create_index('ix_messages_id', 'messages', ['id'])
+    op.create_table(
+        'user_preferences',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('language', sa.String(), nullable=True),
+        sa.Column('preferred_prompt_template', sa.Text(), nullable=True),
+        sa.Column('voice_enabled', sa.String(), nullable=True),
+    )
+    op.create_index('ix_user_preferences_id', 'user_preferences', ['id'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table in ('user_preferences', 'messages', 'chat_sessions', 'chunks', 'documents', 'projects'):
+        op.drop_index(f'ix_{table}_id', table_name=table)
+        op.drop_table(table)
@@ -0,0 +1,147 @@
+"""Incremental ingestion, batches, crawling, append-only chat and background deletion
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 00:00:00
+
+Adds the ingestion_batches and deletion_jobs tables, the per-document
+ingestion, dedup and crawl columns, chunk hashes and the embedded flag, the
+project and session columns, and the indexes the new queries rely on. Chat
+history kept only in chat_sessions.history is copied into messages, which
+chat now reads.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, Sequence[str], None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'ingestion_batches',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('project_id', sa.Integer(), sa.ForeignKey('projects.id'), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.Column('status', sa.String(), nullable=True),
+        sa.Column('total_documents', sa.Integer(), nullable=True),
+        sa.Column('skipped', sa.Integer(), nullable=True),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('crawl', sa.JSON(), nullable=True),
+    )
+    op.create_index('ix_ingestion_batches_id', 'ingestion_batches', ['id'])
+    op.create_table(
+        'deletion_jobs',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('project_id', sa.Integer(), nullable=False),
+        sa.Column('document_ids', sa.JSON(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.Column('status', sa.String(), nullable=True),
+        sa.Column('stage', sa.String(), nullable=True),
+        sa.Column('total_chunks', sa.Integer(), nullable=True),
+        sa.Column('deleted_chunks', sa.Integer(), nullable=True),
+        sa.Column('deleted_vectors', sa.Integer(), nullable=True),
+        sa.Column('total_documents', sa.Integer(), nullable=True),
+        sa.Column('deleted_files', sa.Integer(), nullable=True),
+        sa.Column('error', sa.Text(), nullable=True),
+    )
+    op.create_index('ix_deletion_jobs_id', 'deletion_jobs', ['id'])
+    op.create_index('ix_deletion_jobs_project_id', 'deletion_jobs', ['project_id'])
+
+    with op.batch_alter_table('projects') as batch:
+        batch.add_column(sa.Column('status', sa.String(), nullable=True, server_default='active'))
+
+    with op.batch_alter_table('documents') as batch:
+        batch.add_column(sa.Column('content_hash', sa.String(64), nullable=True))
+        batch.add_column(sa.Column('batch_id', sa.Integer(), nullable=True))
+        batch.add_column(sa.Column('progress', sa.Float(), nullable=True, server_default='0'))
+        batch.add_column(sa.Column('ingestion_stats', sa.JSON(), nullable=True))
+        batch.add_column(sa.Column('http_etag', sa.String(), nullable=True))
+        batch.add_column(sa.Column('http_last_modified', sa.String(), nullable=True))
+        batch.add_column(sa.Column('fetched_at', sa.DateTime(), nullable=True))
+        batch.create_foreign_key('fk_documents_batch_id_ingestion_batches', 'ingestion_batches', ['batch_id'], ['id'])
+        batch.create_index('ix_documents_content_hash', ['content_hash'])
+        batch.create_index('ix_documents_batch_id', ['batch_id'])
+        batch.create_index('ix_documents_project_status', ['project_id', 'status'])
+
+    with op.batch_alter_table('chunks') as batch:
+        batch.add_column(sa.Column('content_hash', sa.String(64), nullable=True))
+        # NULL marks rows from before the flag, which are treated as embedded
+        batch.add_column(sa.Column('embedded', sa.Boolean(), nullable=True))
+        batch.create_index('ix_chunks_document_id', ['document_id'])
+        batch.create_index('ix_chunks_vector_id', ['vector_id'])
+
+    with op.batch_alter_table('chat_sessions') as batch:
+        batch.add_column(sa.Column('summary', sa.Text(), nullable=True))
+        batch.add_column(sa.Column('summarized_through', sa.Integer(), nullable=True, server_default='0'))
+
+    op.create_index('ix_messages_session_timestamp', 'messages', ['session_id', 'timestamp', 'id'])
+    _copy_session_history()
+
+
+def _copy_session_history():
+    """Turn the history JSON of sessions without messages into message rows, oldest first."""
+    connection = op.get_bind()
+    sessions = sa.table(
+        'chat_sessions',
+        sa.column('id', sa.Integer()), sa.column('created_at', sa.DateTime()),
+        sa.column('history', sa.JSON()), sa.column('language', sa.String()),
+    )
+    messages = sa.table(
+        'messages',
+        sa.column('session_id', sa.Integer()), sa.column('sender', sa.String()), sa.column('text', sa.Text()),
+        sa.column('timestamp', sa.DateTime()), sa.column('language', sa.String()),
+    )
+    with_messages = sa.select(messages.c.session_id).distinct()
+    rows = connection.execute(
+        sa.select(sessions).where(sessions.c.id.notin_(with_messages)).order_by(sessions.c.id)
+    ).all()
+    for row in rows:
+        turns = [
+            {
+                'session_id': row.id,
+                'sender': 'user' if (turn.get('sender') or turn.get('role')) == 'user' else 'ai',
+                'text': turn.get('text') or turn.get('content') or '',
+                'timestamp': row.created_at,
+                'language': row.language or 'en',
+            }
+            for turn in (row.history or []) if isinstance(turn, dict)
+        ]
+        if turns:
+            connection.execute(messages.insert(), turns)
+
+
+def downgrade() -> None:
+    """Downgrade schema. Messages copied from session history are kept."""
+    op.drop_index('ix_messages_session_timestamp', table_name='messages')
+    with op.batch_alter_table('chat_sessions') as batch:
+        batch.drop_column('summarized_through')
+        batch.drop_column('summary')
+    with op.batch_alter_table('chunks') as batch:
+        batch.drop_index('ix_chunks_vector_id')
+        batch.drop_index('ix_chunks_document_id')
+        batch.drop_column('embedded')
+        batch.drop_column('content_hash')
+    with op.batch_alter_table('documents') as batch:
+        batch.drop_index('ix_documents_project_status')
+        batch.drop_index('ix_documents_batch_id')
+        batch.drop_index('ix_documents_content_hash')
+        batch.drop_constraint('fk_documents_batch_id_ingestion_batches', type_='foreignkey')
+        for column in ('fetched_at', 'http_last_modified', 'http_etag', 'ingestion_stats', 'progress', 'batch_id', 'content_hash'):
+            batch.drop_column(column)
+    with op.batch_alter_table('projects') as batch:
+        batch.drop_column('status')
+    op.drop_index('ix_deletion_jobs_project_id', table_name='deletion_jobs')
+    op.drop_index('ix_deletion_jobs_id', table_name='deletion_jobs')
+    op.drop_table('deletion_jobs')
+    op.drop_index('ix_ingestion_batches_id', table_name='ingestion_batches')
+    op.drop_table('ingestion_batches')
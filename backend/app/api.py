@@ -1,10 +1,16 @@
 """
 Frontend Integration Instructions:
 - To start a chat session: POST /api/sessions { project_id }
-- To send a chat message: POST /api/chat { project_id, question, history, ... }
-- To get chat session history: GET /api/sessions/{session_id}
-- To update chat session history: PATCH /api/sessions/{session_id} { history }
+- To send a chat message: POST /api/chat { project_id, question, history, session_id, ... }
+  (with a session_id the history is read from the session and the new turn is stored in it)
+- To fetch deferred follow-ups (chat sent with followups='deferred'): GET /api/chat/followups/{followups_id}
+- To get a chat session: GET /api/sessions/{session_id}
+- To read chat session messages, newest page first: GET /api/sessions/{session_id}/messages?limit=&before=
+  (poll for new ones with ?after=<the page's `after` cursor>)
+- To append messages to a session: POST /api/sessions/{session_id}/messages [{ sender, text }, ...]
 - To get/set user preferences: GET/PATCH /api/preferences/{pref_id}
+- To delete a document or project: DELETE /api/documents/{document_id} or /api/projects/{project_id},
+  then poll GET /api/deletions/{job_id} for the background job's progress
 """
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, BackgroundTasks, Body, Request
 from sqlalchemy.orm import Session
@@ -13,14 +19,26 @@ from . import crud, schemas, models, deps
 import uuid
 import os
 from .config import settings
-from .tasks import ingest_document
-import pdfplumber
-import docx
-import csv
+from .tasks import start_ingestion, suggest_followups_task, expand_archive, crawl_site
 from .services import rag
 from .services import ingestion
+from .services import embeddings
+from .services import http
+from .services import registry
+from .services import answer_cache
+from .services import uploads
+from .services import bulk
+from .services import status
+from .services import metrics
+from .services import ocr
+from .services import crawler
+from .services import prompt_packer
+from .services import deletion
 import requests
-from fastapi.responses import FileResponse, JSONResponse
+import json
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+import anyio
 
 UPLOAD_DIR = os.path.join(os.path.dirname(__file__), '..', 'uploads')
 os.makedirs(UPLOAD_DIR, exist_ok=True)
@@ -30,40 +48,53 @@ from .config import settings
 DEEPGRAM_API_KEY = settings.DEEPGRAM_API_KEY
 ELEVENLABS_API_KEY = settings.ELEVENLABS_API_KEY
 
-def save_upload_file(upload_file: UploadFile, destination: str):
-    with open(destination, "wb") as buffer:
-        buffer.write(upload_file.file.read())
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
-def extract_text_from_pdf(file_path):
-    text = ""
+async def stream_events(events):
+    """Serialize (event, data) pairs as Server-Sent Events, reporting failures as an 'error' event."""
     try:
-        with pdfplumber.open(file_path) as pdf:
-            for page in pdf.pages:
-                text += page.extract_text() or ""
+        async for event, data in events:
+            yield sse_event(event, data)
     except Exception as e:
-        text = ""
-    return text
+        import traceback
+        print(traceback.format_exc())
+        yield sse_event('error', {'error': str(e)})
 
-def extract_text_from_docx(file_path):
-    text = ""
+def save_upload_file(upload_file: UploadFile, destination: str) -> str:
+    """Stream an upload to disk in fixed-size pieces and return the sha256 of its bytes."""
     try:
-        doc = docx.Document(file_path)
-        for para in doc.paragraphs:
-            text += para.text + "\n"
-    except Exception as e:
-        text = ""
-    return text
+        _, content_hash = uploads.save_stream(upload_file.file.read, destination)
+    except uploads.UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    return content_hash
 
-def extract_text_from_csv(file_path):
-    text = ""
-    try:
-        with open(file_path, newline='', encoding='utf-8', errors='ignore') as csvfile:
-            reader = csv.reader(csvfile)
-            for row in reader:
-                text += ', '.join(row) + "\n"
-    except Exception as e:
-        text = ""
-    return text
+def require_active_project(db: Session, project_id: int):
+    """404 for an unknown project, 409 for one being deleted: its deletion job would miss new documents and sessions."""
+    project = crud.get_project(db, project_id)
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+    if project.status == crud.DELETING:
+        raise HTTPException(status_code=409, detail="Project is being deleted")
+    return project
+
+def register_upload(db: Session, project_id: int, filename: str, filetype: str, content_hash: str):
+    """Create the Document for a saved upload and queue its ingestion, unless identical bytes are already in the project."""
+    existing = crud.get_document_by_hash(db, project_id, content_hash)
+    if existing is not None and existing.status != 'error':
+        os.remove(os.path.join(UPLOAD_DIR, filename))
+        return existing
+    doc = schemas.DocumentCreate(
+        project_id=project_id,
+        filename=filename,
+        filetype=filetype,
+        content_hash=content_hash
+    )
+    db_doc = crud.create_document(db, doc)
+    answer_cache.invalidate_project(project_id)
+    # Text extraction happens once, in the worker
+    start_ingestion(db_doc.id)
+    return db_doc
 
 router = APIRouter()
 
@@ -83,12 +114,13 @@ def get_project(project_id: int, db: Session = Depends(deps.get_db)):
         raise HTTPException(status_code=404, detail="Project not found")
     return project
 
-@router.delete("/projects/{project_id}")
+@router.delete("/projects/{project_id}", status_code=202)
 def delete_project(project_id: int, db: Session = Depends(deps.get_db)):
-    project = crud.delete_project(db, project_id)
-    if not project:
+    """Mark the project deleting and remove it in the background; poll GET /api/deletions/{job_id}."""
+    if not crud.get_project(db, project_id):
         raise HTTPException(status_code=404, detail="Project not found")
-    return {"ok": True}
+    job = deletion.delete_project(db, project_id)
+    return {"ok": True, "job_id": job.id}
 
 # Document Endpoints
 @router.get("/projects/{project_id}/documents", response_model=List[schemas.Document])
@@ -97,6 +129,7 @@ def list_documents(project_id: int, db: Session = Depends(deps.get_db)):
 
 @router.post("/documents", response_model=schemas.Document)
 def create_document(document: schemas.DocumentCreate, db: Session = Depends(deps.get_db)):
+    require_active_project(db, document.project_id)
     return crud.create_document(db, document)
 
 @router.get("/documents/{document_id}", response_model=schemas.Document)
@@ -106,12 +139,21 @@ def get_document(document_id: int, db: Session = Depends(deps.get_db)):
         raise HTTPException(status_code=404, detail="Document not found")
     return doc
 
-@router.delete("/documents/{document_id}")
+@router.delete("/documents/{document_id}", status_code=202)
 def delete_document(document_id: int, db: Session = Depends(deps.get_db)):
-    doc = crud.delete_document(db, document_id)
+    """Mark the document deleting (no longer retrieved) and remove it in the background."""
+    doc = crud.get_document(db, document_id)
     if not doc:
         raise HTTPException(status_code=404, detail="Document not found")
-    return {"ok": True}
+    job = deletion.delete_document(db, doc)
+    return {"ok": True, "job_id": job.id}
+
+@router.get("/deletions/{job_id}", response_model=schemas.DeletionJob)
+def get_deletion(job_id: int, db: Session = Depends(deps.get_db)):
+    job = crud.get_deletion_job(db, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Deletion job not found")
+    return job
 
 # Document Upload Endpoint
 @router.post("/documents/upload", response_model=schemas.Document)
@@ -122,33 +164,13 @@ def upload_document(
     db: Session = Depends(deps.get_db),
     background_tasks: BackgroundTasks = None
 ):
+    require_active_project(db, project_id)
     try:
         if file:
             filename = f"{uuid.uuid4()}_{file.filename}"
             file_path = os.path.join(UPLOAD_DIR, filename)
-            save_upload_file(file, file_path)
-            filetype = file.content_type or 'application/octet-stream'
-            # Expand file type handling
-            if filetype == 'application/pdf' or filename.lower().endswith('.pdf'):
-                text = extract_text_from_pdf(file_path)
-            elif filetype in ['application/vnd.openxmlformats-officedocument.wordprocessingml.document', 'application/msword'] or filename.lower().endswith('.docx'):
-                text = extract_text_from_docx(file_path)
-            elif filetype == 'text/csv' or filename.lower().endswith('.csv'):
-                text = extract_text_from_csv(file_path)
-            elif filetype == 'text/plain' or filename.lower().endswith('.txt'):
-                with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                    text = f.read()
-            else:
-                text = None  # Let background task handle images/other types
-            doc = schemas.DocumentCreate(
-                project_id=project_id,
-                filename=filename,
-                filetype=filetype
-            )
-            db_doc = crud.create_document(db, doc)
-            # Trigger background ingestion task
-            ingest_document.delay(db_doc.id)
-            return db_doc
+            content_hash = save_upload_file(file, file_path)
+            return register_upload(db, project_id, filename, file.content_type or 'application/octet-stream', content_hash)
         elif url:
             doc = schemas.DocumentCreate(
                 project_id=project_id,
@@ -156,10 +178,13 @@ def upload_document(
                 filetype='url'
             )
             db_doc = crud.create_document(db, doc)
-            ingest_document.delay(db_doc.id)
+            answer_cache.invalidate_project(project_id)
+            start_ingestion(db_doc.id)
             return db_doc
         else:
             raise HTTPException(status_code=400, detail="No file or URL provided.")
+    except HTTPException:
+        raise
     except Exception as e:
         # Error handling: update document status if created
         if 'db_doc' in locals():
@@ -167,18 +192,215 @@ def upload_document(
             db.commit()
         raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
 
+@router.put("/documents/{document_id}", response_model=schemas.Document)
+def update_document(
+    document_id: int,
+    file: UploadFile = File(None),
+    db: Session = Depends(deps.get_db),
+    background_tasks: BackgroundTasks = None
+):
+    """
+    Replace a document's content and re-ingest it incrementally: only chunks
+    whose text changed are embedded, and vectors of removed chunks are deleted.
+    Without a file, URL documents are re-fetched (a no-op if the page is unchanged).
+    A document still being ingested cannot be updated until it is ready (or failed).
+    """
+    doc = crud.get_document(db, document_id)
+    if not doc:
+        raise HTTPException(status_code=404, detail="Document not found")
+    if doc.status == crud.DELETING:
+        raise HTTPException(status_code=409, detail="Document is being deleted")
+    if doc.status == 'processing':
+        raise HTTPException(status_code=409, detail="Document is still being ingested")
+    old_filename = None
+    if file:
+        filename = f"{uuid.uuid4()}_{file.filename}"
+        file_path = os.path.join(UPLOAD_DIR, filename)
+        content_hash = save_upload_file(file, file_path)
+        if content_hash == doc.content_hash and doc.status == 'ready':
+            os.remove(file_path)
+            return doc
+        if doc.filetype != 'url':
+            old_filename = doc.filename
+        doc.filename = filename
+        doc.filetype = file.content_type or doc.filetype
+        doc.content_hash = content_hash
+    elif doc.filetype != 'url':
+        raise HTTPException(status_code=400, detail="A file is required to update an uploaded document.")
+    doc.status = 'processing'
+    db.commit()
+    db.refresh(doc)
+    answer_cache.invalidate_project(doc.project_id)
+    start_ingestion(doc.id)
+    if old_filename:
+        old_path = os.path.join(UPLOAD_DIR, old_filename)
+        if os.path.exists(old_path):
+            os.remove(old_path)
+        if settings.GCS_BUCKET:
+            background_tasks.add_task(_delete_archived_copy, old_filename)
+    return doc
+
+def _delete_archived_copy(filename):
+    # The replaced file's GCS copy; the new one is archived by the ingestion it started
+    try:
+        ingestion.delete_from_gcs(settings.GCS_BUCKET, filename)
+    except Exception as e:
+        print(f"update_document: could not delete gs://{settings.GCS_BUCKET}/{filename}: {e}")
+
+# --- Bulk ingestion ---
+@router.post("/documents/bulk")
+def bulk_upload(
+    project_id: int = Form(...),
+    files: List[UploadFile] = File(None),
+    archive: UploadFile = File(None),
+    urls: str = Form(None),
+    db: Session = Depends(deps.get_db)
+):
+    """
+    Ingest many documents as one batch: any mix of `files`, one zip/tar
+    `archive` (unpacked by a worker) and `urls` (whitespace or comma separated).
+    Poll GET /api/ingestion/batches/{batch_id} for progress.
+    """
+    require_active_project(db, project_id)
+    files = files or []
+    url_list = bulk.parse_urls(urls)
+    if not (files or archive or url_list):
+        raise HTTPException(status_code=400, detail="No files, archive or URLs provided.")
+    if len(files) + len(url_list) > settings.BULK_MAX_FILES:
+        raise HTTPException(status_code=413, detail=f"At most {settings.BULK_MAX_FILES} documents per batch")
+    batch = crud.create_ingestion_batch(db, project_id, status='expanding' if archive else 'running')
+    entries = []
+    for upload in files:
+        filename = bulk.stored_name(upload.filename)
+        content_hash = save_upload_file(upload, os.path.join(UPLOAD_DIR, filename))
+        entries.append({'filename': filename, 'filetype': bulk.guess_filetype(upload.filename, upload.content_type), 'content_hash': content_hash})
+    entries.extend({'filename': url, 'filetype': 'url'} for url in url_list)
+    bulk.add_documents(db, batch, entries)
+    if archive:
+        archive_path = os.path.join(UPLOAD_DIR, bulk.stored_name(archive.filename))
+        try:
+            uploads.save_stream(archive.file.read, archive_path, settings.MAX_ARCHIVE_BYTES)
+        except uploads.UploadTooLarge as e:
+            crud.finish_ingestion_batch(db, batch, status='failed', error=str(e))
+            raise HTTPException(status_code=413, detail=str(e))
+        expand_archive.delay(batch.id, archive_path)
+    return bulk.batch_progress(db, batch)
+
+@router.post("/projects/{project_id}/crawl")
+def crawl_project_site(
+    project_id: int,
+    url: str = Body(...),
+    mode: str = Body('auto'),
+    max_pages: int = Body(None),
+    db: Session = Depends(deps.get_db)
+):
+    """
+    Ingest a page, a sitemap (or sitemap index) or every page under a URL prefix
+    as one batch. `mode` is 'page', 'sitemap', 'prefix' or 'auto' (sitemap for
+    sitemap-looking URLs). Run it again to refresh: only new and changed pages
+    are re-ingested. Poll GET /api/ingestion/batches/{batch_id} for progress.
+    """
+    if mode not in crawler.MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {', '.join(crawler.MODES)}")
+    if not url.startswith(('http://', 'https://')):
+        raise HTTPException(status_code=400, detail="url must be an http(s) URL")
+    require_active_project(db, project_id)
+    batch = crud.create_ingestion_batch(db, project_id, status='crawling')
+    crawl_site.delay(batch.id, url, mode, max_pages)
+    return bulk.batch_progress(db, batch)
+
+@router.get("/ingestion/batches/{batch_id}")
+def ingestion_batch_progress(batch_id: int, db: Session = Depends(deps.get_db)):
+    batch = crud.get_ingestion_batch(db, batch_id)
+    if not batch:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return bulk.batch_progress(db, batch)
+
+# --- Resumable uploads ---
+# POST /uploads {project_id, filename, size, content_type} -> {upload_id, offset, chunk_size}
+# PUT /uploads/{upload_id}?offset=N with raw bytes; a 409 carries the offset to resume from
+# GET /uploads/{upload_id} -> current offset, POST /uploads/{upload_id}/complete -> Document
+@router.post("/uploads")
+def create_upload(project_id: int = Body(...), filename: str = Body(...), size: int = Body(...), content_type: str = Body(None), db: Session = Depends(deps.get_db)):
+    require_active_project(db, project_id)
+    try:
+        return uploads.create_session(project_id, filename, size, content_type)
+    except uploads.UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+@router.get("/uploads/{upload_id}")
+def get_upload(upload_id: str):
+    session = _upload_call(uploads.session_status, upload_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return session
+
+@router.put("/uploads/{upload_id}")
+async def append_upload(upload_id: str, offset: int, request: Request):
+    # Pieces are written as they arrive, so memory stays flat whatever the part size
+    new_offset = await run_in_threadpool(_upload_call, uploads.append, upload_id, offset, _body_pieces(request))
+    return {"upload_id": upload_id, "offset": new_offset}
+
+def _body_pieces(request: Request):
+    """The request body, piece by piece, for code running in the threadpool."""
+    stream = request.stream().__aiter__()
+    while True:
+        try:
+            yield anyio.from_thread.run(stream.__anext__)
+        except StopAsyncIteration:
+            return
+
+@router.post("/uploads/{upload_id}/complete", response_model=schemas.Document)
+def complete_upload(upload_id: str, db: Session = Depends(deps.get_db)):
+    info = _upload_call(uploads.get_session, upload_id)
+    if info is None:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    require_active_project(db, info['project_id'])
+    filename = f"{uuid.uuid4()}_{info['filename']}"
+    info, content_hash = _upload_call(uploads.complete, upload_id, os.path.join(UPLOAD_DIR, filename))
+    return register_upload(db, info['project_id'], filename, info['content_type'], content_hash)
+
+@router.delete("/uploads/{upload_id}")
+def abort_upload(upload_id: str):
+    _upload_call(uploads.abort, upload_id)
+    return {"ok": True}
+
+def _upload_call(fn, upload_id, *args):
+    try:
+        return fn(upload_id, *args)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    except uploads.UploadNotFound:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    except uploads.UploadConflict as e:
+        raise HTTPException(status_code=409, detail={"error": str(e), "offset": e.offset})
+    except uploads.UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
 # Ingestion Status Endpoint
 @router.get("/ingestion/{document_id}/status")
 def ingestion_status(document_id: int, db: Session = Depends(deps.get_db)):
     doc = crud.get_document(db, document_id)
     if not doc:
         raise HTTPException(status_code=404, detail="Document not found")
-    # For now, just return the document status field
-    return {"status": doc.status}
+    stats = doc.ingestion_stats or {}
+    return {
+        "status": doc.status,
+        "progress": doc.progress or 0.0,
+        "stage": stats.get("stage"),
+        "stats": stats,
+    }
+
+@router.get("/projects/{project_id}/ingestion/stats")
+def project_ingestion_stats(project_id: int, db: Session = Depends(deps.get_db)):
+    """Ingestion time per stage for the project's recent documents, by file type and size."""
+    documents = crud.get_project_ingestion_stats(db, project_id)
+    return {"project_id": project_id, "groups": status.project_ingestion_stats(documents)}
 
 # Chat Session Endpoints
 @router.post("/sessions", response_model=schemas.ChatSession)
 def create_chat_session(project_id: int = Form(...), language: str = Form('en'), db: Session = Depends(deps.get_db)):
+    require_active_project(db, project_id)
     session = crud.create_chat_session(db, project_id, language=language)
     return session
 
@@ -187,8 +409,19 @@ def get_chat_session(session_id: int, db: Session = Depends(deps.get_db)):
     return crud.get_chat_session(db, session_id)
 
 @router.patch("/sessions/{session_id}", response_model=schemas.ChatSession)
-def update_chat_session(session_id: int, history: list = Body(...), language: str = Body(None), db: Session = Depends(deps.get_db)):
-    return crud.update_chat_session_history(db, session_id, history, language)
+def update_chat_session(session_id: int, history: list = Body(None), language: str = Body(None), db: Session = Depends(deps.get_db)):
+    session = crud.update_chat_session(db, session_id, language)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    if history:
+        # Older clients send the whole history each time: only messages not stored yet are appended
+        stored = crud.count_messages(db, session_id)
+        crud.append_messages(db, session_id, [_history_message(m, session.language) for m in history[stored:]])
+    return session
+
+def _history_message(message: dict, language: str) -> dict:
+    sender = message.get('sender') or message.get('role')
+    return {'sender': 'user' if sender == 'user' else 'ai', 'text': message.get('text') or message.get('content') or '', 'language': language}
 
 @router.get("/preferences/{pref_id}", response_model=schemas.UserPreference)
 def get_user_preference(pref_id: int, db: Session = Depends(deps.get_db)):
@@ -204,81 +437,157 @@ def update_user_preference(pref_id: int, language: str = Body(None), preferred_p
 def create_message(session_id: int = Form(...), sender: str = Form(...), text: str = Form(...), embedding_ref: str = Form(None), language: str = Form('en'), db: Session = Depends(deps.get_db)):
     return crud.create_message(db, session_id, sender, text, embedding_ref, language)
 
-@router.get("/sessions/{session_id}/messages", response_model=List[schemas.Message])
-def list_messages(session_id: int, db: Session = Depends(deps.get_db)):
-    return crud.get_messages(db, session_id)
+@router.post("/sessions/{session_id}/messages", response_model=List[schemas.Message])
+def append_messages(session_id: int, messages: List[schemas.MessageCreate] = Body(...), db: Session = Depends(deps.get_db)):
+    if crud.get_chat_session(db, session_id) is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return crud.append_messages(db, session_id, [m.dict() for m in messages])
+
+@router.get("/sessions/{session_id}/messages", response_model=schemas.MessagePage)
+def list_messages(session_id: int, limit: int = settings.MESSAGE_PAGE_SIZE, before: str = None, after: str = None, db: Session = Depends(deps.get_db)):
+    """A page of messages, oldest first: the newest ones, or those just before/after a cursor."""
+    if before and after:
+        raise HTTPException(status_code=400, detail="Pass either before or after, not both")
+    limit = max(1, min(limit, settings.MESSAGE_PAGE_MAX))
+    try:
+        messages, more = crud.get_message_page(db, session_id, limit, before=before, after=after)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not messages:
+        return {"messages": [], "before": after, "after": after}
+    return {
+        "messages": messages,
+        "before": crud.message_cursor(messages[0]) if (more or after) else None,
+        "after": crud.message_cursor(messages[-1]),
+    }
 
 @router.patch("/documents/{document_id}/status")
 def update_document_status(document_id: int, status: str = Body(...), db: Session = Depends(deps.get_db)):
-    ingestion.update_document_status(document_id, status)
+    ingestion.update_document_status(document_id, status, db=db)
     return {"ok": True, "status": status}
 
+@router.get("/embeddings/cache/stats")
+def embedding_cache_stats():
+    return embeddings.embedding_cache_stats()
+
+@router.get("/ocr/cache/stats")
+def ocr_cache_stats():
+    return ocr.get_ocr_cache().stats()
+
+@router.get("/chat/cache/stats")
+def answer_cache_stats():
+    cache = answer_cache.get_answer_cache()
+    return cache.stats() if cache is not None else {"enabled": False}
+
+@router.get("/registry/stats")
+def registry_stats():
+    return registry.stats()
+
 @router.post("/chat")
-def chat_endpoint(request: Request, body: dict = None):
+async def chat_endpoint(request: Request, body: dict = None):
     try:
-        data = body or (request.json() if hasattr(request, 'json') else {})
+        data = body or await request.json()
         project_id = data.get('project_id')
         question = data.get('question')
         prompt_template = data.get('prompt_template', rag.DEFAULT_PROMPT_TEMPLATE)
         language = data.get('language', 'en')
         history = data.get('history', [])
         stream = data.get('stream', False)
+        followups_mode = data.get('followups', 'concurrent')
+        session_id = data.get('session_id')
         if not project_id or not question:
             raise HTTPException(status_code=400, detail="project_id and question are required")
+        if followups_mode not in rag.FOLLOWUP_MODES:
+            raise HTTPException(status_code=400, detail=f"followups must be one of {', '.join(rag.FOLLOWUP_MODES)}")
         if stream:
-            return rag.rag_chat(project_id, question, prompt_template, language, history=history, stream=True)
-        result = rag.rag_chat(project_id, question, prompt_template, language, history=history)
+            events = await rag.arag_chat(project_id, question, prompt_template, language, history=history, stream=True, followups_mode=followups_mode, session_id=session_id)
+            if session_id:
+                events = _record_streamed_turn(events, session_id, question, language)
+            return StreamingResponse(
+                stream_events(events),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+            )
+        result = await rag.arag_chat(project_id, question, prompt_template, language, history=history, followups_mode=followups_mode, session_id=session_id)
+        if session_id:
+            await run_in_threadpool(prompt_packer.record_turn, session_id, question, result['answer'], language)
         return result
     except Exception as e:
         import traceback
         print(traceback.format_exc())  # This will print the real error to your terminal
         return JSONResponse(status_code=500, content={"error": str(e)})
 
+async def _record_streamed_turn(events, session_id, question, language):
+    """Pass chat events through, storing the turn before 'done' so the next request sees it."""
+    async for event, data in events:
+        if event == 'done':
+            await run_in_threadpool(prompt_packer.record_turn, session_id, question, data['answer'], language)
+        yield event, data
+
+@router.get("/chat/followups/{followups_id}")
+def get_followups(followups_id: str):
+    """Poll follow-ups queued by a chat request made with followups='deferred'."""
+    if not rag.followups_issued(followups_id):
+        raise HTTPException(status_code=404, detail="Unknown or expired followups_id")
+    result = suggest_followups_task.AsyncResult(followups_id)
+    if result.failed():
+        return {"status": "error", "followups": []}
+    if not result.ready():
+        return {"status": "pending", "followups": []}
+    return {"status": "ready", "followups": result.result}
+
 # --- ElevenLabs TTS Endpoint ---
 @router.post("/tts")
-def tts_endpoint(text: str = Body(...), voice_id: str = Body('EXAVITQu4vr4xnSDxMaL'), language: str = Body('en')):
+async def tts_endpoint(text: str = Body(...), voice_id: str = Body('EXAVITQu4vr4xnSDxMaL'), language: str = Body('en')):
     """
     Convert text to speech using ElevenLabs API. Returns a URL to the generated audio file.
     voice_id: You can use a default or let the frontend specify.
     """
     output_path = f"static/tts/{voice_id}_{abs(hash(text))}.mp3"
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    response = requests.post(
-        f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}",
-        headers={
-            "xi-api-key": ELEVENLABS_API_KEY,
-            "Content-Type": "application/json"
-        },
-        json={
-            "text": text,
-            "voice_settings": {"stability": 0.5, "similarity_boost": 0.5}
-        }
-    )
+    with metrics.timed('elevenlabs', 'tts'):
+        response = await http.post(
+            f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}",
+            headers={
+                "xi-api-key": ELEVENLABS_API_KEY,
+                "Content-Type": "application/json"
+            },
+            json={
+                "text": text,
+                "voice_settings": {"stability": 0.5, "similarity_boost": 0.5}
+            }
+        )
     if response.status_code != 200:
+        metrics.record_error('elevenlabs', 'tts', response.status_code)
         return JSONResponse(status_code=500, content={"error": response.text})
-    with open(output_path, "wb") as f:
-        f.write(response.content)
+    await run_in_threadpool(_write_file, output_path, response.content)
     return {"audio_url": f"/{output_path}"}
 
+def _write_file(path, content):
+    with open(path, "wb") as f:
+        f.write(content)
+
 # --- Deepgram STT Endpoint ---
 @router.post("/stt")
-def stt_endpoint(audio_url: str = Body(...)):
+async def stt_endpoint(audio_url: str = Body(...)):
     """
     Transcribe audio using Deepgram API. Accepts a public audio URL and returns the transcription.
     """
-    response = requests.post(
-        "https://api.deepgram.com/v1/listen",
-        headers={"Authorization": f"Token {DEEPGRAM_API_KEY}"},
-        json={"url": audio_url}
-    )
+    with metrics.timed('deepgram', 'stt'):
+        response = await http.post(
+            "https://api.deepgram.com/v1/listen",
+            headers={"Authorization": f"Token {DEEPGRAM_API_KEY}"},
+            json={"url": audio_url}
+        )
     if response.status_code != 200:
+        metrics.record_error('deepgram', 'stt', response.status_code)
         return JSONResponse(status_code=500, content={"error": response.text})
     result = response.json()
     transcript = result.get("results", {}).get("channels", [{}])[0].get("alternatives", [{}])[0].get("transcript", "")
     return {"text": transcript}
 
 @router.post("/chat/image")
-def chat_image_endpoint(
+async def chat_image_endpoint(
     project_id: int = Form(...),
     image: UploadFile = File(...),
     history: list = Form(None),
@@ -287,42 +596,47 @@ def chat_image_endpoint(
     session_id: int = Form(None),
     db: Session = Depends(deps.get_db)
 ):
-    import uuid, os, shutil
-    filename = f"chat_{uuid.uuid4()}_{image.filename}"
-    upload_dir = os.path.join(os.path.dirname(__file__), '..', 'uploads')
-    temp_path = os.path.join(upload_dir, filename)
-    with open(temp_path, "wb") as buffer:
-        buffer.write(image.file.read())
-    # Optionally, save a static copy for preview
+    import uuid, os, asyncio
+    filename = f"chat_{uuid.uuid4()}_{os.path.basename(image.filename or 'image')}"
+    data = await image.read()
+    try:
+        ocr_text = await run_in_threadpool(ocr.ocr_image, data)
+    except ocr.ImageDecodeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ocr.OcrError as e:
+        raise HTTPException(status_code=502, detail=str(e))
+    # Only images that OCR could read get a preview copy; it is written while the chat runs
     static_dir = os.path.join(os.path.dirname(__file__), '..', 'static', 'chat_images')
     os.makedirs(static_dir, exist_ok=True)
-    static_path = os.path.join(static_dir, filename)
-    shutil.copy(temp_path, static_path)
+    preview_path = os.path.join(static_dir, filename)
+    preview = asyncio.ensure_future(run_in_threadpool(_write_file, preview_path, data))
     image_url = f"/static/chat_images/{filename}"
-    # Run OCR/vision model
-    ocr_text = ingestion.extract_text_from_image(temp_path)
     # Use OCR text as the chat query
     from .services import rag
-    result = rag.rag_chat(
-        project_id=project_id,
-        question=ocr_text,
-        prompt_template=prompt_template or rag.DEFAULT_PROMPT_TEMPLATE,
-        language=language,
-        history=history or []
-    )
+    try:
+        result = await rag.arag_chat(
+            project_id=project_id,
+            question=ocr_text,
+            prompt_template=prompt_template or rag.DEFAULT_PROMPT_TEMPLATE,
+            language=language,
+            history=history or [],
+            session_id=session_id
+        )
+    except Exception:
+        # No message will point at the preview
+        await preview
+        os.remove(preview_path)
+        raise
     result['ocr_text'] = ocr_text
     result['image_url'] = image_url
+    await preview
     # Store messages if session_id is provided
     if session_id:
-        from . import crud
-        crud.create_message(db, session_id, 'user', '[Image uploaded]', language=language, image_url=image_url)
-        crud.create_message(db, session_id, 'ai', result['answer'], language=language, ocr_text=ocr_text)
-    # Optionally, delete temp file
-    try:
-        os.remove(temp_path)
-    except Exception:
-        pass
-    return result 
+        await run_in_threadpool(crud.append_messages, db, session_id, [
+            {'sender': 'user', 'text': '[Image uploaded]', 'language': language, 'image_url': image_url},
+            {'sender': 'ai', 'text': result['answer'], 'language': language, 'ocr_text': ocr_text},
+        ])
+    return result
 
 from fastapi import APIRouter, Body, HTTPException
 import requests
@@ -341,7 +655,7 @@ def upload_cloud_file(
     # Download file from Google Drive
     headers = {'Authorization': f'Bearer {oauth_token}'}
     download_url = f"https://www.googleapis.com/drive/v3/files/{file_id}?alt=media"
-    response = requests.get(download_url, headers=headers, stream=True)
+    response = registry.get_http_session().get(download_url, headers=headers, stream=True, timeout=60)
     if response.status_code != 200:
         raise HTTPException(status_code=400, detail="Failed to fetch file from Google Drive")
     # Save file to uploads directory
@@ -16,9 +16,18 @@ class Settings(BaseSettings):
     PINECONE_ENV: str = "us-east-1"
     PINECONE_INDEX: str = "autorag-index"
     
+    # Vector store ("pinecone" or "local")
+    VECTOR_BACKEND: str = "pinecone"
+    LOCAL_VECTOR_DIR: str = "vector_store"
+    LOCAL_VECTOR_EXACT_LIMIT: int = 20000  # shards larger than this use the IVF index
+    LOCAL_VECTOR_IVF_NPROBE: int = 8
+
     # Groq API
     GROQ_API_KEY: str = ""
     GROQ_LLAMA_API_KEY: str = ""
+    GROQ_BASE_URL: str = "https://api.groq.com"
+    FOLLOWUP_MAX_WORKERS: int = 8
+    FOLLOWUPS_TTL: int = 3600  # seconds a deferred followups_id can be polled
     
     # Google Drive Picker
     GOOGLE_CLIENT_ID: str = ""
@@ -34,8 +43,121 @@ class Settings(BaseSettings):
     QDRANT_URL: str = ""
     # Jina AI API
     JINA_API_KEY: str = ""
+    JINA_EMBEDDING_URL: str = "https://api.jina.ai/v1/embeddings"
     groq_api_key: str | None = None
 
+    # Outbound HTTP (async request path)
+    HTTP_TIMEOUT: float = 60.0
+    HTTP_MAX_CONNECTIONS: int = 200
+    HTTP_MAX_KEEPALIVE: int = 50
+    HTTP_MAX_CONNECTIONS_PER_HOST: int = 100
+
+    # Batched embedding / upsert
+    EMBED_BATCH_SIZE: int = 128
+    EMBED_MAX_CONCURRENCY: int = 4
+    UPSERT_BATCH_SIZE: int = 100
+    UPSERT_MAX_CONCURRENCY: int = 2
+    HTTP_MAX_RETRIES: int = 5
+    HTTP_BACKOFF_BASE: float = 0.5
+    HTTP_BACKOFF_MAX: float = 30.0
+
+    # Chunking (tokens are whitespace-delimited words)
+    CHUNK_MAX_TOKENS: int = 500
+    CHUNK_OVERLAP_TOKENS: int = 50
+
+    # Uploads
+    MAX_UPLOAD_BYTES: int = 512 * 1024 * 1024  # single-request uploads
+    MAX_RESUMABLE_UPLOAD_BYTES: int = 20 * 1024 * 1024 * 1024
+    UPLOAD_CHUNK_BYTES: int = 1024 * 1024  # read/write piece size when streaming to disk
+    MAX_UPLOAD_PART_BYTES: int = 64 * 1024 * 1024  # body limit for one resumable-upload append
+    UPLOAD_PARTIAL_DIR: str = "uploads/.partial"
+    UPLOAD_SESSION_TTL: int = 24 * 3600  # seconds an unfinished resumable upload is kept after its last append
+
+    # Bulk ingestion
+    BULK_MAX_FILES: int = 10000  # per batch (files, archive members and URLs together)
+    BULK_DISPATCH_SIZE: int = 200  # documents created and queued per step while unpacking an archive
+    MAX_ARCHIVE_BYTES: int = 20 * 1024 * 1024 * 1024
+
+    # URL crawling (see services/crawler.py)
+    CRAWL_CONCURRENCY: int = 16  # pages fetched at once per crawl
+    CRAWL_HOST_RATE: float = 10.0  # max requests per second to one host, per process; 0 = unlimited
+    CRAWL_MAX_PAGES: int = 5000  # per crawl
+    CRAWL_MAX_PAGE_BYTES: int = 10 * 1024 * 1024  # decompressed body; larger pages are skipped
+    CRAWL_TIMEOUT: float = 30.0  # seconds per request
+    CRAWL_USER_AGENT: str = "autorag-crawler/1.0"
+
+    # Ingestion task queues (see tasks.py)
+    INGEST_CPU_QUEUE: str = "ingest_cpu"  # extraction, OCR, chunking, NER
+    INGEST_IO_QUEUE: str = "ingest_io"  # embedding, upserts, GCS, archive unpacking
+    CELERY_PREFETCH_MULTIPLIER: int = 1
+
+    # Ingestion progress
+    STATUS_UPDATE_INTERVAL: float = 1.0  # min seconds between progress writes within a stage
+
+    # Bulk chunk inserts (rows per INSERT and per commit)
+    DB_BULK_BATCH_SIZE: int = 2000
+
+    # Chunk text cache for retrieval hydration
+    CHUNK_CACHE_ITEMS: int = 50000
+
+    # PDF extraction
+    PDF_EXTRACT_WORKERS: int = 0  # 0 = one per CPU core
+    PDF_PAGES_PER_TASK: int = 25
+    PDF_PARALLEL_MIN_PAGES: int = 50
+
+    # Embedding cache (in-memory LRU in front of a SQLite file)
+    EMBEDDING_CACHE_ENABLED: bool = True
+    EMBEDDING_CACHE_MEMORY_ITEMS: int = 10000
+    EMBEDDING_CACHE_PATH: str = "cache/embeddings.sqlite3"
+    EMBEDDING_CACHE_MAX_BYTES: int = 1024 * 1024 * 1024
+
+    # Client/model registry
+    SPACY_MODEL: str = "en_core_web_sm"
+    SPACY_DISABLED_PIPES: str = "tagger,parser,attribute_ruler,lemmatizer,senter"  # only NER is used
+    REGISTRY_WARM: str = "spacy,vision,storage,http_session"  # built in each Celery worker process at start
+
+    # Prompt budget, in tokens (see services/prompt_packer.py)
+    PROMPT_TOKENIZER: str = ""  # Hugging Face tokenizer, e.g. "Qwen/Qwen3-32B"; empty = local estimate
+    PROMPT_CANDIDATES: int = 12  # chunks retrieved for the packer to choose from
+    PROMPT_CONTEXT_TOKENS: int = 3000  # retrieved chunks
+    PROMPT_HISTORY_TOKENS: int = 1200  # recent turns kept verbatim
+    PROMPT_MAX_TURN_TOKENS: int = 400  # longer turns are truncated in the history
+    PROMPT_SUMMARY_TOKENS: int = 300  # target length of a session's rolling summary of older turns
+    PROMPT_SUMMARY_BATCH: int = 4  # aged-out turns collected before the summary is extended
+
+    # Background deletion of documents and projects (see services/deletion.py)
+    DELETE_BATCH_SIZE: int = 1000  # chunks (and their vectors) removed per step
+    DELETE_CONCURRENCY: int = 16  # uploaded files and GCS copies removed in parallel
+
+    # Chat message store
+    CHAT_HISTORY_TURNS: int = 20  # latest unsummarized messages read for a chat's history
+    MESSAGE_PAGE_SIZE: int = 50  # GET /sessions/{id}/messages default page
+    MESSAGE_PAGE_MAX: int = 200
+    SUMMARY_PAGE_MESSAGES: int = 100  # messages folded into a summary per LLM call
+
+    # Answer cache (rag_chat)
+    ANSWER_CACHE_ENABLED: bool = True
+    ANSWER_CACHE_TTL: int = 3600  # seconds
+    ANSWER_CACHE_MAX_ENTRIES: int = 5000
+    ANSWER_CACHE_SEMANTIC: bool = True  # also match reworded questions by embedding similarity
+    ANSWER_CACHE_SIMILARITY: float = 0.95
+
+    # Image OCR (Google Vision)
+    OCR_MAX_SIDE: int = 2048  # images are downscaled to this longest side before OCR
+    OCR_BINARIZE: bool = True  # blur and threshold before OCR
+    OCR_BATCH_SIZE: int = 16  # images per batch_annotate_images request (Vision allows 16)
+    OCR_CACHE_ITEMS: int = 10000
+    OCR_CACHE_TTL: int = 7 * 24 * 3600  # seconds, for the shared Redis copy
+    OCR_PERCEPTUAL_MATCH: bool = False  # also reuse the text of near-identical images; can confuse screenshots that differ only in text
+    OCR_HASH_SIZE: int = 32  # perceptual hash is OCR_HASH_SIZE^2 bits
+    OCR_HASH_DISTANCE: int = 0  # with OCR_PERCEPTUAL_MATCH: max differing hash bits; 0 = same hash only
+
+    # Named entity recognition (ingestion)
+    NER_BATCH_SIZE: int = 64  # chunks per nlp.pipe batch
+    NER_PROCESSES: int = 1  # nlp.pipe n_process; forced to 1 inside daemonic workers
+    NER_MAX_CHARS: int = 2000000  # 0 = no limit
+    NER_SKIP_POLICY: str = "truncate"  # over NER_MAX_CHARS: "truncate" (leading chunks only) or "skip"
+
     class Config:
         env_file = ".env"
         extra = "allow"
@@ -1,7 +1,11 @@
+from datetime import datetime
+from sqlalchemy import insert, update, delete, select, func, tuple_
 from sqlalchemy.orm import Session
 from . import models, schemas
 from typing import List
 
+DELETING = 'deleting'  # status of documents and projects a DeletionJob is removing
+
 def get_projects(db: Session) -> List[models.Project]:
     return db.query(models.Project).all()
 
@@ -15,13 +19,6 @@ def create_project(db: Session, project: schemas.ProjectCreate):
     db.refresh(db_project)
     return db_project
 
-def delete_project(db: Session, project_id: int):
-    db_project = get_project(db, project_id)
-    if db_project:
-        db.delete(db_project)
-        db.commit()
-    return db_project
-
 # Document CRUD
 
 def get_documents(db: Session, project_id: int):
@@ -37,12 +34,273 @@ def create_document(db: Session, document: schemas.DocumentCreate):
 def get_document(db: Session, document_id: int):
     return db.query(models.Document).filter(models.Document.id == document_id).first()
 
-def delete_document(db: Session, document_id: int):
-    db_document = get_document(db, document_id)
-    if db_document:
-        db.delete(db_document)
+def get_document_by_hash(db: Session, project_id: int, content_hash: str):
+    return (
+        db.query(models.Document)
+        .filter(
+            models.Document.project_id == project_id,
+            models.Document.content_hash == content_hash,
+            models.Document.status != DELETING,
+        )
+        .first()
+    )
+
+def get_url_documents(db: Session, project_id: int):
+    return (
+        db.query(models.Document)
+        .filter(models.Document.project_id == project_id, models.Document.filetype == 'url', models.Document.status != DELETING)
+        .order_by(models.Document.id)
+        .all()
+    )
+
+def touch_documents(db: Session, document_ids: List[int]):
+    """Record a fetch of pages that came back unchanged."""
+    if document_ids:
+        db.execute(update(models.Document).where(models.Document.id.in_(document_ids)).values(fetched_at=datetime.utcnow()))
         db.commit()
-    return db_document
+
+def _not_deleting(document_id: int):
+    # A document being deleted keeps that status whatever its ingestion still reports
+    return (models.Document.id == document_id) & (func.coalesce(models.Document.status, '') != DELETING)
+
+def update_document_status(db: Session, document_id: int, status: str):
+    db.execute(update(models.Document).where(_not_deleting(document_id)).values(status=status))
+    db.commit()
+
+def update_document_progress(db: Session, document_id: int, progress: float, stats: dict, status: str = None):
+    values = {'progress': progress, 'ingestion_stats': stats}
+    if status is not None:
+        values['status'] = status
+    db.execute(update(models.Document).where(_not_deleting(document_id)).values(**values))
+    db.commit()
+
+def get_project_ingestion_stats(db: Session, project_id: int, limit: int = 1000):
+    return db.query(models.Document).filter(
+        models.Document.project_id == project_id,
+        models.Document.ingestion_stats.isnot(None),
+    ).order_by(models.Document.id.desc()).limit(limit).all()
+
+# Ingestion batch CRUD
+
+def create_ingestion_batch(db: Session, project_id: int, status: str = 'running'):
+    batch = models.IngestionBatch(project_id=project_id, status=status)
+    db.add(batch)
+    db.commit()
+    db.refresh(batch)
+    return batch
+
+def get_ingestion_batch(db: Session, batch_id: int):
+    return db.query(models.IngestionBatch).filter(models.IngestionBatch.id == batch_id).first()
+
+def bulk_create_documents(db: Session, rows) -> List[int]:
+    """Insert Document rows (dicts of columns) in one statement and return their ids in order."""
+    if not rows:
+        return []
+    result = db.execute(insert(models.Document).returning(models.Document.id, sort_by_parameter_order=True), rows)
+    ids = [row[0] for row in result]
+    db.commit()
+    return ids
+
+def add_batch_documents(db: Session, batch_id: int, added: int, skipped: int = 0):
+    db.execute(
+        update(models.IngestionBatch)
+        .where(models.IngestionBatch.id == batch_id)
+        .values(
+            total_documents=models.IngestionBatch.total_documents + added,
+            skipped=models.IngestionBatch.skipped + skipped,
+        )
+    )
+    db.commit()
+
+def get_existing_hashes(db: Session, project_id: int, hashes: List[str]):
+    """The subset of `hashes` already held by non-failed documents in the project."""
+    if not hashes:
+        return set()
+    rows = db.query(models.Document.content_hash).filter(
+        models.Document.project_id == project_id,
+        models.Document.content_hash.in_(hashes),
+        models.Document.status.notin_(('error', DELETING)),
+    )
+    return {row[0] for row in rows}
+
+def get_batch_progress(db: Session, batch: models.IngestionBatch):
+    counts = dict(
+        db.query(models.Document.status, func.count(models.Document.id))
+        .filter(models.Document.batch_id == batch.id)
+        .group_by(models.Document.status)
+        .all()
+    )
+    chunks = (
+        db.query(func.count(models.Chunk.id))
+        .join(models.Document, models.Chunk.document_id == models.Document.id)
+        .filter(models.Document.batch_id == batch.id)
+        .scalar()
+    )
+    failures = (
+        db.query(models.Document.id, models.Document.filename)
+        .filter(models.Document.batch_id == batch.id, models.Document.status == 'error')
+        .limit(50)
+        .all()
+    )
+    return counts, chunks, [{"document_id": f.id, "filename": f.filename} for f in failures]
+
+def finish_ingestion_batch(db: Session, batch: models.IngestionBatch, status: str = 'done', error: str = None):
+    batch.status = status
+    batch.finished_at = datetime.utcnow()
+    if error:
+        batch.error = error
+    db.commit()
+
+# Chunk CRUD
+
+def bulk_insert_chunks(db: Session, rows, batch_size: int = 2000) -> int:
+    """
+    Insert chunk rows (dicts of Chunk columns) with one multi-row INSERT per
+    batch, committing each batch so large documents never build one huge transaction.
+    """
+    count = 0
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            db.execute(insert(models.Chunk), batch)
+            db.commit()
+            count += len(batch)
+            batch = []
+    if batch:
+        db.execute(insert(models.Chunk), batch)
+        db.commit()
+        count += len(batch)
+    return count
+
+def get_chunk_refs(db: Session, document_id: int):
+    """A document's chunks without their text: id, vector_id, content_hash, chunk_metadata, embedded."""
+    return (
+        db.query(models.Chunk.id, models.Chunk.vector_id, models.Chunk.content_hash, models.Chunk.chunk_metadata, models.Chunk.embedded)
+        .filter(models.Chunk.document_id == document_id)
+        .all()
+    )
+
+def get_chunk_texts(db: Session, chunk_ids: List[int]):
+    return dict(db.query(models.Chunk.id, models.Chunk.text).filter(models.Chunk.id.in_(chunk_ids)).all()) if chunk_ids else {}
+
+def bulk_update_chunks(db: Session, rows, batch_size: int = 2000):
+    """Update chunks by primary key from dicts that include "id"."""
+    rows = list(rows)
+    for start in range(0, len(rows), batch_size):
+        db.execute(update(models.Chunk), rows[start:start + batch_size])
+        db.commit()
+
+def mark_chunks_embedded(db: Session, vector_ids: List[str], batch_size: int = 2000):
+    for start in range(0, len(vector_ids), batch_size):
+        db.execute(update(models.Chunk).where(models.Chunk.vector_id.in_(vector_ids[start:start + batch_size])).values(embedded=True))
+        db.commit()
+
+def delete_chunks(db: Session, chunk_ids: List[int], batch_size: int = 2000):
+    for start in range(0, len(chunk_ids), batch_size):
+        db.execute(delete(models.Chunk).where(models.Chunk.id.in_(chunk_ids[start:start + batch_size])))
+        db.commit()
+
+def get_chunks_by_vector_ids(db: Session, vector_ids: List[str]):
+    """Chunks for a batch of vector ids in one round trip (no relationships loaded)."""
+    if not vector_ids:
+        return []
+    return (
+        db.query(models.Chunk.vector_id, models.Chunk.text, models.Chunk.document_id, models.Chunk.chunk_metadata)
+        .filter(models.Chunk.vector_id.in_(vector_ids))
+        .all()
+    )
+
+# Deletion CRUD (see services/deletion.py)
+
+def mark_documents_deleting(db: Session, document_ids: List[int]):
+    db.execute(update(models.Document).where(models.Document.id.in_(document_ids)).values(status=DELETING))
+    db.commit()
+
+def mark_project_deleting(db: Session, project_id: int):
+    db.execute(update(models.Project).where(models.Project.id == project_id).values(status=DELETING))
+    db.execute(update(models.Document).where(models.Document.project_id == project_id).values(status=DELETING))
+    db.commit()
+
+def document_deleting(db: Session, document_id: int) -> bool:
+    """Whether a document is being deleted or already gone; read fresh, for tasks that ran alongside the deletion."""
+    row = db.query(models.Document.status).filter(models.Document.id == document_id).first()
+    return row is None or row[0] == DELETING
+
+def project_deleting(db: Session, project_id: int) -> bool:
+    row = db.query(models.Project.status).filter(models.Project.id == project_id).first()
+    return row is None or row[0] == DELETING
+
+def get_deleting_document_ids(db: Session, project_id: int):
+    """(whole project deleting, ids of its documents being deleted)."""
+    project_status = db.query(models.Project.status).filter(models.Project.id == project_id).scalar()
+    if project_status == DELETING:
+        return True, set()
+    rows = db.query(models.Document.id).filter(models.Document.project_id == project_id, models.Document.status == DELETING)
+    return False, {row[0] for row in rows}
+
+def create_deletion_job(db: Session, project_id: int, document_ids: List[int] = None):
+    job = models.DeletionJob(project_id=project_id, document_ids=document_ids)
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    return job
+
+def get_deletion_job(db: Session, job_id: int):
+    return db.query(models.DeletionJob).filter(models.DeletionJob.id == job_id).first()
+
+def finish_deletion_job(db: Session, job: models.DeletionJob, status: str = 'done', error: str = None):
+    job.status = status
+    job.finished_at = datetime.utcnow()
+    if error:
+        job.error = error
+    db.commit()
+
+def _job_chunks(db: Session, job: models.DeletionJob, *columns):
+    query = db.query(*columns)
+    if job.document_ids is not None:
+        return query.filter(models.Chunk.document_id.in_(job.document_ids))
+    return query.join(models.Document, models.Document.id == models.Chunk.document_id).filter(models.Document.project_id == job.project_id)
+
+def count_job_chunks(db: Session, job: models.DeletionJob) -> int:
+    return _job_chunks(db, job, func.count(models.Chunk.id)).scalar()
+
+def get_job_chunk_batch(db: Session, job: models.DeletionJob, limit: int):
+    """Up to `limit` of the job's remaining chunks: id and vector_id only."""
+    return _job_chunks(db, job, models.Chunk.id, models.Chunk.vector_id).order_by(models.Chunk.id).limit(limit).all()
+
+def get_job_documents(db: Session, job: models.DeletionJob):
+    """The job's documents without their relationships: id, filename, filetype."""
+    query = db.query(models.Document.id, models.Document.filename, models.Document.filetype)
+    if job.document_ids is not None:
+        query = query.filter(models.Document.id.in_(job.document_ids))
+    else:
+        query = query.filter(models.Document.project_id == job.project_id)
+    return query.order_by(models.Document.id).all()
+
+def get_project_image_urls(db: Session, project_id: int):
+    """Images attached to the messages of a project's chat sessions."""
+    rows = (
+        db.query(models.Message.image_url)
+        .join(models.ChatSession, models.ChatSession.id == models.Message.session_id)
+        .filter(models.ChatSession.project_id == project_id, models.Message.image_url.isnot(None))
+    )
+    return [row[0] for row in rows]
+
+def delete_document_rows(db: Session, document_ids: List[int], batch_size: int = 2000):
+    """Delete documents whose chunks are already gone."""
+    for start in range(0, len(document_ids), batch_size):
+        db.execute(delete(models.Document).where(models.Document.id.in_(document_ids[start:start + batch_size])))
+        db.commit()
+
+def delete_project_rows(db: Session, project_id: int):
+    """Delete a project whose documents are already gone, with its chat sessions, messages and ingestion batches."""
+    sessions = select(models.ChatSession.id).where(models.ChatSession.project_id == project_id)
+    db.execute(delete(models.Message).where(models.Message.session_id.in_(sessions)))
+    db.execute(delete(models.ChatSession).where(models.ChatSession.project_id == project_id))
+    db.execute(delete(models.IngestionBatch).where(models.IngestionBatch.project_id == project_id))
+    db.execute(delete(models.Project).where(models.Project.id == project_id))
+    db.commit()
 
 # ChatSession CRUD
 
@@ -73,8 +331,71 @@ def create_message(db: Session, session_id: int, sender: str, text: str, embeddi
     db.refresh(message)
     return message
 
-def get_messages(db: Session, session_id: int):
-    return db.query(models.Message).filter(models.Message.session_id == session_id).all()
+def append_messages(db: Session, session_id: int, messages: List[dict]) -> List[models.Message]:
+    """Append messages (dicts of Message columns) to a session in one INSERT; returns the stored rows."""
+    if not messages:
+        return []
+    now = datetime.utcnow()
+    rows = [{'timestamp': now, **message, 'session_id': session_id} for message in messages]
+    stored = list(db.scalars(insert(models.Message).returning(models.Message, sort_by_parameter_order=True), rows))
+    db.commit()
+    return stored
+
+def message_cursor(message: models.Message) -> str:
+    """Opaque keyset position of a message: its (timestamp, id)."""
+    return f"{message.timestamp.isoformat()}~{message.id}"
+
+def _parse_cursor(cursor: str):
+    timestamp, _, message_id = cursor.rpartition('~')
+    return datetime.fromisoformat(timestamp), int(message_id)
+
+def get_message_page(db: Session, session_id: int, limit: int, before: str = None, after: str = None):
+    """
+    (messages oldest first, more): a page of at most `limit` messages of a
+    session, the newest ones, those just before cursor `before` or those just
+    after cursor `after`. `more` is whether further messages exist in the
+    direction of paging. Raises ValueError for a malformed cursor.
+    """
+    position = tuple_(models.Message.timestamp, models.Message.id)
+    query = db.query(models.Message).filter(models.Message.session_id == session_id)
+    if after:
+        query = query.filter(position > tuple_(*_parse_cursor(after)))
+        order = (models.Message.timestamp, models.Message.id)
+    else:
+        if before:
+            query = query.filter(position < tuple_(*_parse_cursor(before)))
+        order = (models.Message.timestamp.desc(), models.Message.id.desc())
+    messages = query.order_by(*order).limit(limit + 1).all()
+    more = len(messages) > limit
+    messages = messages[:limit]
+    if not after:
+        messages.reverse()
+    return messages, more
+
+def get_recent_messages(db: Session, session_id: int, limit: int, after_id: int = 0) -> List[models.Message]:
+    """The last `limit` messages of a session with id > `after_id`, oldest first."""
+    messages = (
+        db.query(models.Message)
+        .filter(models.Message.session_id == session_id, models.Message.id > after_id)
+        .order_by(models.Message.timestamp.desc(), models.Message.id.desc())
+        .limit(limit)
+        .all()
+    )
+    messages.reverse()
+    return messages
+
+def get_messages_between(db: Session, session_id: int, after_id: int, through_id: int, limit: int) -> List[models.Message]:
+    """Up to `limit` messages of a session with after_id < id <= through_id, oldest first."""
+    return (
+        db.query(models.Message)
+        .filter(models.Message.session_id == session_id, models.Message.id > after_id, models.Message.id <= through_id)
+        .order_by(models.Message.timestamp, models.Message.id)
+        .limit(limit)
+        .all()
+    )
+
+def count_messages(db: Session, session_id: int) -> int:
+    return db.query(func.count(models.Message.id)).filter(models.Message.session_id == session_id).scalar()
 
 def create_chat_session(db: Session, project_id: int, history=None, language='en'):
     session = models.ChatSession(project_id=project_id, history=history or [], language=language)
@@ -86,15 +407,23 @@ def create_chat_session(db: Session, project_id: int, history=None, language='en
 def get_chat_session(db: Session, session_id: int):
     return db.query(models.ChatSession).filter(models.ChatSession.id == session_id).first()
 
-def update_chat_session_history(db: Session, session_id: int, history, language=None):
+def update_chat_session(db: Session, session_id: int, language=None):
     session = get_chat_session(db, session_id)
-    if session:
-        session.history = history
-        if language:
-            session.language = language
+    if session and language:
+        session.language = language
         db.commit()
     return session
 
+def update_session_summary(db: Session, session_id: int, start: int, summary: str, summarized_through: int) -> bool:
+    """Store an extended summary unless another summarization moved the session past message `start` first."""
+    result = db.execute(
+        update(models.ChatSession)
+        .where(models.ChatSession.id == session_id, func.coalesce(models.ChatSession.summarized_through, 0) == start)
+        .values(summary=summary, summarized_through=summarized_through)
+    )
+    db.commit()
+    return result.rowcount > 0
+
 def create_user_preference(db: Session, language="en", preferred_prompt_template=None, voice_enabled="false"):
     pref = models.UserPreference(language=language, preferred_prompt_template=preferred_prompt_template, voice_enabled=voice_enabled)
     db.add(pref)
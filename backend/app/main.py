@@ -1,6 +1,9 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
 from . import api
+from .database import engine
+from .services import http
+from .services import metrics
 
 app = FastAPI()
 
@@ -13,8 +16,22 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Per-route latency and in-flight requests
+app.add_middleware(metrics.MetricsMiddleware, routers=[("/api", api.router), ("", app.router)])
+
 app.include_router(api.router, prefix="/api")
 
+metrics.register_engine(engine)
+
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    body, content_type = metrics.render()
+    return Response(body, media_type=content_type)
+
+@app.on_event("shutdown")
+async def close_http_client():
+    await http.aclose()
+
 @app.get("/")
 def read_root():
     return {"message": "AutoRAG backend is running"} 
\ No newline at end of file
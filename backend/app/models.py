@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Text, JSON
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Text, JSON, Float, Boolean, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from .database import Base
@@ -9,27 +9,68 @@ class Project(Base):
     name = Column(String, nullable=False)
     description = Column(String, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
+    status = Column(String, default="active")  # 'deleting' while a DeletionJob removes it
     documents = relationship("Document", back_populates="project")
     sessions = relationship("ChatSession", back_populates="project")
 
 class Document(Base):
     __tablename__ = "documents"
+    # Retrieval reads a project's deleting documents on every query (see services/deletion.py)
+    __table_args__ = (Index("ix_documents_project_status", "project_id", "status"),)
     id = Column(Integer, primary_key=True, index=True)
     project_id = Column(Integer, ForeignKey("projects.id"), nullable=False)
     filename = Column(String, nullable=False)
     filetype = Column(String, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
-    status = Column(String, default="processing")
+    status = Column(String, default="processing")  # 'deleting' once a DeletionJob owns it: never retrieved again
+    content_hash = Column(String(64), nullable=True, index=True)  # sha256 of the uploaded bytes (or fetched text for URLs)
+    batch_id = Column(Integer, ForeignKey("ingestion_batches.id"), nullable=True, index=True)
+    progress = Column(Float, default=0.0)  # 0..1 while ingesting
+    ingestion_stats = Column(JSON, nullable=True)  # per-stage seconds and counts of the last ingestion
+    # URL documents: validators for conditional re-fetches, and when the page was last fetched
+    http_etag = Column(String, nullable=True)
+    http_last_modified = Column(String, nullable=True)
+    fetched_at = Column(DateTime, nullable=True)
     project = relationship("Project", back_populates="documents")
     chunks = relationship("Chunk", back_populates="document")
 
+class IngestionBatch(Base):
+    __tablename__ = "ingestion_batches"
+    id = Column(Integer, primary_key=True, index=True)
+    project_id = Column(Integer, ForeignKey("projects.id"), nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+    status = Column(String, default="running")  # 'expanding' (archive being unpacked), 'crawling', 'running', 'done'
+    total_documents = Column(Integer, default=0)
+    skipped = Column(Integer, default=0)  # duplicates of documents already in the project
+    error = Column(Text, nullable=True)
+    crawl = Column(JSON, nullable=True)  # page counts of a crawl batch (see services/crawler.py)
+
+class DeletionJob(Base):
+    __tablename__ = "deletion_jobs"
+    id = Column(Integer, primary_key=True, index=True)
+    project_id = Column(Integer, nullable=False, index=True)  # no foreign key: the job outlives a deleted project
+    document_ids = Column(JSON, nullable=True)  # None when the whole project is deleted
+    created_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+    status = Column(String, default="running")  # 'running', 'done', 'failed'
+    stage = Column(String, default="queued")  # 'queued', 'chunks', 'files', 'rows' (see services/deletion.py)
+    total_chunks = Column(Integer, default=0)
+    deleted_chunks = Column(Integer, default=0)
+    deleted_vectors = Column(Integer, default=0)
+    total_documents = Column(Integer, default=0)
+    deleted_files = Column(Integer, default=0)
+    error = Column(Text, nullable=True)
+
 class Chunk(Base):
     __tablename__ = "chunks"
     id = Column(Integer, primary_key=True, index=True)
-    document_id = Column(Integer, ForeignKey("documents.id"), nullable=False)
+    document_id = Column(Integer, ForeignKey("documents.id"), nullable=False, index=True)
     text = Column(Text, nullable=False)
     chunk_metadata = Column(JSON, nullable=True)
-    vector_id = Column(String, nullable=True)
+    vector_id = Column(String, nullable=True, index=True)
+    content_hash = Column(String(64), nullable=True)  # sha256 of text; unchanged chunks keep their vectors on re-ingestion
+    embedded = Column(Boolean, nullable=True)  # False until embed_document has upserted the vector; NULL for rows from before the flag
     document = relationship("Document", back_populates="chunks")
 
 class ChatSession(Base):
@@ -37,13 +78,17 @@ class ChatSession(Base):
     id = Column(Integer, primary_key=True, index=True)
     project_id = Column(Integer, ForeignKey("projects.id"), nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
-    history = Column(JSON, default=list)  # Store chat history as a list of messages
+    history = Column(JSON, default=list)  # legacy; turns are stored as Message rows
+    summary = Column(Text, nullable=True)  # rolling summary of messages up to `summarized_through` (see services/prompt_packer.py)
+    summarized_through = Column(Integer, default=0)  # id of the last message folded into `summary`
     language = Column(String, default="en")
     project = relationship("Project", back_populates="sessions")
     messages = relationship("Message", back_populates="session")
 
 class Message(Base):
     __tablename__ = "messages"
+    # Append-only; read newest-first or by (timestamp, id) cursor, never a whole session at once
+    __table_args__ = (Index("ix_messages_session_timestamp", "session_id", "timestamp", "id"),)
     id = Column(Integer, primary_key=True, index=True)
     session_id = Column(Integer, ForeignKey("chat_sessions.id"), nullable=False)
     sender = Column(String, nullable=False)  # 'user' or 'ai'
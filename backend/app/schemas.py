@@ -12,12 +12,14 @@ class ProjectCreate(ProjectBase):
 class Project(ProjectBase):
     id: int
     created_at: datetime
+    status: Optional[str] = 'active'
     class Config:
         from_attributes = True
 
 class DocumentBase(BaseModel):
     filename: str
     filetype: str
+    content_hash: Optional[str] = None
 
 class DocumentCreate(DocumentBase):
     project_id: int
@@ -27,6 +29,26 @@ class Document(DocumentBase):
     project_id: int
     created_at: datetime
     status: str
+    batch_id: Optional[int] = None
+    progress: Optional[float] = None
+    fetched_at: Optional[datetime] = None  # URL documents: last fetch of the page
+    class Config:
+        from_attributes = True
+
+class DeletionJob(BaseModel):
+    id: int
+    project_id: int
+    document_ids: Optional[List[int]] = None
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+    status: str
+    stage: str
+    total_chunks: int = 0
+    deleted_chunks: int = 0
+    deleted_vectors: int = 0
+    total_documents: int = 0
+    deleted_files: int = 0
+    error: Optional[str] = None
     class Config:
         from_attributes = True
 
@@ -47,6 +69,8 @@ class ChatSessionBase(BaseModel):
 class ChatSession(ChatSessionBase):
     id: int
     created_at: datetime
+    summary: Optional[str] = None
+    summarized_through: Optional[int] = 0
     class Config:
         from_attributes = True
 
@@ -58,6 +82,9 @@ class MessageBase(BaseModel):
     image_url: Optional[str] = None
     ocr_text: Optional[str] = None
 
+class MessageCreate(MessageBase):
+    pass
+
 class Message(MessageBase):
     id: int
     session_id: int
@@ -65,6 +92,11 @@ class Message(MessageBase):
     class Config:
         from_attributes = True
 
+class MessagePage(BaseModel):
+    messages: List[Message]
+    before: Optional[str] = None  # cursor of the previous (older) page; None at the start of the session
+    after: Optional[str] = None  # cursor for messages newer than this page
+
 class UserPreferenceBase(BaseModel):
     language: Optional[str] = 'en'
     preferred_prompt_template: Optional[str] = None
@@ -0,0 +1,205 @@
+"""
+Answer cache for rag_chat.
+
+Entries are keyed by (project_id, prompt template, language, normalized
+question) and live in a bounded in-process LRU with a TTL. A request that
+misses the exact key can still be served by an earlier answer whose question
+embedding is at least ANSWER_CACHE_SIMILARITY (cosine) to its own.
+
+Every project has a generation counter in Redis. Each entry records the
+generation it was computed under, and bumping the counter (on upload, delete
+or ingestion) invalidates the whole project for every API process at once.
+When Redis is unreachable the counter falls back to this process only.
+"""
+import re
+import time
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass
+import numpy as np
+from ..config import settings
+from . import registry
+
+GENERATION_KEY = "autorag:answer_cache:generation:{}"
+REDIS_RETRY_SECONDS = 30  # after a Redis error, use local generations for this long
+_NON_CACHED_FIELDS = ('history', 'followups_id', 'cache')
+
+
+@dataclass(frozen=True)
+class AnswerKey:
+    project_id: int
+    template_hash: str
+    language: str
+    question: str
+    generation: int
+
+    @property
+    def bucket(self):
+        return (self.project_id, self.template_hash, self.language)
+
+    @property
+    def exact(self):
+        return self.bucket + (self.question,)
+
+
+def normalize_question(question):
+    question = unicodedata.normalize('NFKC', question).casefold()
+    question = re.sub(r'\s+', ' ', question).strip()
+    return question.rstrip('?!.。 ')
+
+
+class AnswerCache:
+    def __init__(self, max_entries=5000, ttl=3600, similarity=0.95):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity = similarity
+        self._entries = OrderedDict()  # exact key -> entry
+        self._buckets = {}  # bucket -> {exact key: normalized question embedding}
+        self._lock = threading.Lock()
+        self._local_generations = {}
+        self._redis_down_until = 0.0
+        self.counters = {'hits_exact': 0, 'hits_semantic': 0, 'misses': 0, 'invalidations': 0}
+
+    # --- Generations ---
+    def generation(self, project_id):
+        project_id = int(project_id)
+        if time.monotonic() >= self._redis_down_until:
+            try:
+                value = registry.get_redis().get(GENERATION_KEY.format(project_id))
+                return int(value or 0)
+            except Exception as e:
+                print(f"answer cache: Redis unavailable, using local generations: {e}")
+                self._redis_down_until = time.monotonic() + REDIS_RETRY_SECONDS
+        return self._local_generations.get(project_id, 0)
+
+    def invalidate_project(self, project_id):
+        # Chat requests may carry the id as a string; generations and keys always use the int
+        project_id = int(project_id)
+        with self._lock:
+            self._local_generations[project_id] = self._local_generations.get(project_id, 0) + 1
+            self.counters['invalidations'] += 1
+            for exact in [k for k in self._entries if k[0] == project_id]:
+                self._drop(exact)
+        try:
+            registry.get_redis().incr(GENERATION_KEY.format(project_id))
+        except Exception as e:
+            print(f"answer cache: could not bump generation for project {project_id}: {e}")
+
+    # --- Lookup / store ---
+    def make_key(self, project_id, prompt_template, language, question):
+        project_id = int(project_id)
+        template_hash = hashlib.sha256(prompt_template.encode('utf-8')).hexdigest()[:16]
+        return AnswerKey(project_id, template_hash, language or '', normalize_question(question), self.generation(project_id))
+
+    def get(self, key):
+        with self._lock:
+            entry = self._live(key.exact, key.generation)
+            if entry is None:
+                return None
+            self.counters['hits_exact'] += 1
+            return self._hit(entry, 'exact', 1.0)
+
+    def get_similar(self, key, embedding):
+        """Best live entry in the key's bucket with cosine similarity >= the threshold, else None."""
+        vector = _unit(embedding)
+        with self._lock:
+            bucket = self._buckets.get(key.bucket)
+            candidates = list(bucket.items()) if bucket else []
+            if candidates:
+                scores = np.stack([v for _, v in candidates]) @ vector
+                for i in np.argsort(-scores):
+                    if scores[i] < self.similarity:
+                        break
+                    entry = self._live(candidates[i][0], key.generation)
+                    if entry is not None:
+                        self.counters['hits_semantic'] += 1
+                        return self._hit(entry, 'semantic', float(scores[i]))
+            return None
+
+    def record_miss(self):
+        with self._lock:
+            self.counters['misses'] += 1
+
+    def put(self, key, result, embedding=None):
+        value = {k: v for k, v in result.items() if k not in _NON_CACHED_FIELDS}
+        entry = {'result': value, 'generation': key.generation, 'created': time.time()}
+        with self._lock:
+            self._entries[key.exact] = entry
+            self._entries.move_to_end(key.exact)
+            if embedding is not None:
+                self._buckets.setdefault(key.bucket, {})[key.exact] = _unit(embedding)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats['entries'] = len(self._entries)
+        lookups = stats['hits_exact'] + stats['hits_semantic'] + stats['misses']
+        stats['hit_rate'] = (stats['hits_exact'] + stats['hits_semantic']) / lookups if lookups else 0.0
+        return stats
+
+    def _live(self, exact, generation):
+        entry = self._entries.get(exact)
+        if entry is None:
+            return None
+        if entry['generation'] != generation or time.time() - entry['created'] > self.ttl:
+            self._drop(exact)
+            return None
+        self._entries.move_to_end(exact)
+        return entry
+
+    def _hit(self, entry, match, similarity):
+        result = dict(entry['result'])
+        result['cache'] = {
+            'hit': True,
+            'match': match,
+            'similarity': round(similarity, 4),
+            'age_seconds': round(time.time() - entry['created'], 1),
+        }
+        return result
+
+    def _drop(self, exact):
+        self._entries.pop(exact, None)
+        bucket = self._buckets.get(exact[:3])
+        if bucket is not None:
+            bucket.pop(exact, None)
+            if not bucket:
+                del self._buckets[exact[:3]]
+
+
+def _unit(embedding):
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_answer_cache():
+    """Process-wide answer cache, or None when ANSWER_CACHE_ENABLED is off."""
+    global _cache
+    if not settings.ANSWER_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = AnswerCache(settings.ANSWER_CACHE_MAX_ENTRIES, settings.ANSWER_CACHE_TTL, settings.ANSWER_CACHE_SIMILARITY)
+    return _cache
+
+
+def invalidate_project(project_id):
+    """Drop every cached answer for a project whose corpus changed, in all API processes."""
+    project_id = int(project_id)
+    cache = get_answer_cache()
+    if cache is not None:
+        cache.invalidate_project(project_id)
+    else:
+        try:
+            registry.get_redis().incr(GENERATION_KEY.format(project_id))
+        except Exception:
+            pass
@@ -0,0 +1,132 @@
+"""
+Bulk ingestion: many files, an archive or a URL list as one IngestionBatch.
+Site crawls fill batches too (see crawler.py).
+
+Documents are created with one INSERT per step and their ingestion is queued
+as a Celery group, so the whole worker fleet picks them up at once. Archives
+are unpacked by a worker (`expand_archive`) a member at a time, queueing
+every BULK_DISPATCH_SIZE documents so ingestion starts while unpacking is
+still going. Progress is aggregated from the batch's Document rows.
+"""
+import os
+import re
+import uuid
+import mimetypes
+from datetime import datetime
+from ..config import settings
+from .. import crud
+from . import uploads
+from . import answer_cache
+
+UPLOAD_DIR = os.path.join(os.path.dirname(__file__), '..', '..', 'uploads')
+
+
+class TooManyFiles(Exception):
+    pass
+
+
+def guess_filetype(name, content_type=None):
+    if content_type and content_type != 'application/octet-stream':
+        return content_type
+    return mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+
+def parse_urls(text):
+    return [u for u in re.split(r'[\s,]+', text or '') if u]
+
+
+def stored_name(name):
+    """Unique name under uploads/ that keeps the member's base name (archive paths are flattened)."""
+    base = os.path.basename(name.replace('\\', '/'))
+    return f"{uuid.uuid4()}_{base}"
+
+
+def add_documents(db, batch, entries):
+    """
+    Create Documents for `entries` (dicts with filename, filetype and, for
+    files, content_hash) and queue their ingestion. Files whose bytes are
+    already in the project are dropped and counted as skipped.
+    """
+    existing = crud.get_existing_hashes(db, batch.project_id, [e['content_hash'] for e in entries if e.get('content_hash')])
+    rows, seen, skipped = [], set(), 0
+    for entry in entries:
+        content_hash = entry.get('content_hash')
+        if content_hash and (content_hash in existing or content_hash in seen):
+            skipped += 1
+            os.remove(os.path.join(UPLOAD_DIR, entry['filename']))
+            continue
+        if content_hash:
+            seen.add(content_hash)
+        rows.append({'project_id': batch.project_id, 'batch_id': batch.id, 'status': 'processing', **entry})
+    ids = crud.bulk_create_documents(db, rows)
+    crud.add_batch_documents(db, batch.id, len(ids), skipped)
+    if ids:
+        answer_cache.invalidate_project(batch.project_id)
+        dispatch(ids, [i for i, row in zip(ids, rows) if row['filetype'].startswith('image/')])
+    return ids
+
+
+def dispatch(document_ids, image_ids=()):
+    from ..tasks import start_bulk_ingestion
+    start_bulk_ingestion(document_ids, image_ids)
+
+
+def expand_archive(db, batch, archive_path):
+    """Unpack an archive into uploads/, creating and queueing documents as members arrive."""
+    # Files and URLs sent with the archive count against the same BULK_MAX_FILES
+    entries, count = [], (batch.total_documents or 0) + (batch.skipped or 0)
+    try:
+        for name, member in uploads.iter_archive(archive_path):
+            count += 1
+            if count > settings.BULK_MAX_FILES:
+                raise TooManyFiles(f"batch has more than {settings.BULK_MAX_FILES} files, archive members and URLs")
+            filename = stored_name(name)
+            _, content_hash = uploads.save_stream(member.read, os.path.join(UPLOAD_DIR, filename))
+            entries.append({'filename': filename, 'filetype': guess_filetype(name), 'content_hash': content_hash})
+            if len(entries) >= settings.BULK_DISPATCH_SIZE:
+                add_documents(db, batch, entries)
+                entries = []
+        add_documents(db, batch, entries)
+        batch.status = 'running'
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        # Documents queued so far keep going; members not yet registered are dropped
+        for entry in entries:
+            path = os.path.join(UPLOAD_DIR, entry['filename'])
+            if os.path.exists(path):
+                os.remove(path)
+        crud.finish_ingestion_batch(db, batch, status='failed', error=str(e))
+        raise
+    finally:
+        if os.path.exists(archive_path):
+            os.remove(archive_path)
+
+
+def batch_progress(db, batch):
+    counts, chunks, failures = crud.get_batch_progress(db, batch)
+    done = counts.get('ready', 0)
+    failed = counts.get('error', 0)
+    pending = sum(counts.values()) - done - failed
+    if batch.status == 'running' and pending == 0:
+        crud.finish_ingestion_batch(db, batch)
+    elapsed = max(((batch.finished_at or datetime.utcnow()) - batch.created_at).total_seconds(), 1e-6)
+    return {
+        'batch_id': batch.id,
+        'project_id': batch.project_id,
+        'status': batch.status,
+        'error': batch.error,
+        'documents': {
+            'total': batch.total_documents,
+            'done': done,
+            'failed': failed,
+            'pending': pending,
+            'skipped_duplicates': batch.skipped,
+        },
+        'chunks': chunks,
+        'elapsed_seconds': round(elapsed, 1),
+        'documents_per_second': round((done + failed) / elapsed, 3),
+        'chunks_per_second': round(chunks / elapsed, 2),
+        'failures': failures,
+        'crawl': batch.crawl,
+    }
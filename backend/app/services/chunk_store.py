@@ -0,0 +1,83 @@
+"""
+Chunk text for retrieval results, looked up by vector id.
+
+The vector store returns only ids and scores; the text lives in the `chunks`
+table. `get_chunks` serves ids from a bounded in-process LRU and loads the
+rest with one batched `vector_id IN (...)` query. Vector ids are never
+reused, so entries only go stale when a chunk is deleted (`forget`).
+"""
+import threading
+from collections import OrderedDict
+from ..config import settings
+from ..database import SessionLocal
+from .. import crud
+
+
+class ChunkStore:
+    def __init__(self, max_items=50000):
+        self.max_items = max_items
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0}
+
+    def get_chunks(self, vector_ids):
+        """Return {vector_id: {'text', 'document_id', 'chunk_index'}} for the ids that exist."""
+        found, missing = {}, []
+        with self._lock:
+            for vector_id in vector_ids:
+                record = self._items.get(vector_id)
+                if record is not None:
+                    self._items.move_to_end(vector_id)
+                    found[vector_id] = record
+                else:
+                    missing.append(vector_id)
+            self.counters['hits'] += len(found)
+            self.counters['misses'] += len(missing)
+        if missing:
+            loaded = self._load(missing)
+            with self._lock:
+                for vector_id, record in loaded.items():
+                    self._items[vector_id] = record
+                    self._items.move_to_end(vector_id)
+                while len(self._items) > self.max_items:
+                    self._items.popitem(last=False)
+            found.update(loaded)
+        return found
+
+    def _load(self, vector_ids):
+        db = SessionLocal()
+        try:
+            return {
+                row.vector_id: {
+                    'text': row.text,
+                    'document_id': row.document_id,
+                    'chunk_index': (row.chunk_metadata or {}).get('chunk_index', -1),
+                }
+                for row in crud.get_chunks_by_vector_ids(db, vector_ids)
+            }
+        finally:
+            db.close()
+
+    def forget(self, vector_ids):
+        with self._lock:
+            for vector_id in vector_ids:
+                self._items.pop(vector_id, None)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats['items'] = len(self._items)
+        return stats
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_chunk_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ChunkStore(settings.CHUNK_CACHE_ITEMS)
+    return _store
@@ -0,0 +1,120 @@
+"""
+Streaming, sentence-aware text chunker.
+
+`iter_chunks` reads an iterable of text segments (pages, paragraphs, a whole
+document) in a single pass and yields `TextChunk`s whose `start`/`end` are
+character offsets into the segments joined by `separator`. Chunks are filled
+up to `max_tokens`, end on sentence or paragraph boundaries, and repeat the
+trailing `overlap_tokens` of the previous chunk. Only the current window and
+the unfinished sentence are held in memory.
+"""
+import re
+from collections import deque
+from dataclasses import dataclass
+from ..config import settings
+
+_BOUNDARY = re.compile(r'(?<=[.!?])["\')\]]*\s+|\n[ \t]*\n\s*')
+_TOKEN = re.compile(r'\S+')
+PARAGRAPH_MIN_FILL = 0.5  # close a chunk at a paragraph break once it is this full
+
+
+@dataclass
+class TextChunk:
+    index: int
+    text: str
+    start: int
+    end: int
+    tokens: int
+
+
+@dataclass
+class _Unit:
+    raw: str  # sentence text plus its trailing whitespace
+    start: int  # offset of the first non-space character
+    end: int  # offset just past the last non-space character
+    tokens: int
+    paragraph_end: bool
+
+
+def _make_unit(raw, offset, paragraph_end=False):
+    stripped = raw.strip()
+    if not stripped:
+        return None
+    start = offset + (len(raw) - len(raw.lstrip()))
+    return _Unit(raw, start, start + len(stripped), len(_TOKEN.findall(raw)), paragraph_end)
+
+
+def _split_oversized(unit, max_tokens):
+    """Split a unit longer than the budget at token boundaries."""
+    tokens = list(_TOKEN.finditer(unit.raw))
+    base = unit.start - (len(unit.raw) - len(unit.raw.lstrip()))
+    for i in range(0, len(tokens), max_tokens):
+        piece_start = tokens[i].start() if i else 0
+        piece_end = tokens[i + max_tokens].start() if i + max_tokens < len(tokens) else len(unit.raw)
+        last = i + max_tokens >= len(tokens)
+        yield _make_unit(unit.raw[piece_start:piece_end], base + piece_start, unit.paragraph_end and last)
+
+
+def _iter_units(segments, separator, max_pending):
+    pending, pending_start, first = "", 0, True
+    for segment in segments:
+        pending += segment if first else separator + segment
+        first = False
+        cut = 0
+        for match in _BOUNDARY.finditer(pending):
+            unit = _make_unit(pending[cut:match.end()], pending_start + cut, match.group().count('\n') > 1)
+            if unit:
+                yield unit
+            cut = match.end()
+        # A run of text without sentence punctuation must not grow without bound
+        if len(pending) - cut > max_pending:
+            space = pending.rfind(' ', cut, len(pending) - 1)
+            if space > cut:
+                unit = _make_unit(pending[cut:space + 1], pending_start + cut)
+                if unit:
+                    yield unit
+                cut = space + 1
+        pending_start += cut
+        pending = pending[cut:]
+    unit = _make_unit(pending, pending_start, True)
+    if unit:
+        yield unit
+
+
+def iter_chunks(segments, max_tokens=None, overlap_tokens=None, separator="\n"):
+    """Yield TextChunks for an iterable of text segments (a plain string is one segment)."""
+    max_tokens = max_tokens or settings.CHUNK_MAX_TOKENS
+    overlap_tokens = settings.CHUNK_OVERLAP_TOKENS if overlap_tokens is None else overlap_tokens
+    overlap_tokens = min(overlap_tokens, max_tokens // 2)
+    if isinstance(segments, str):
+        segments = [segments]
+    window = deque()
+    window_tokens = 0
+    fresh = 0  # units in the window not yet emitted in any chunk
+    index = 0
+
+    def emit():
+        nonlocal index, window_tokens, fresh
+        text = "".join(u.raw for u in window).strip()
+        chunk = TextChunk(index, text, window[0].start, window[-1].end, window_tokens)
+        index += 1
+        fresh = 0
+        while window and window_tokens > overlap_tokens:
+            window_tokens -= window.popleft().tokens
+        return chunk
+
+    for unit in _iter_units(segments, separator, max_tokens * 20):
+        pieces = _split_oversized(unit, max_tokens) if unit.tokens > max_tokens else (unit,)
+        for piece in pieces:
+            if window_tokens + piece.tokens > max_tokens:
+                if fresh:
+                    yield emit()
+                while window and window_tokens + piece.tokens > max_tokens:
+                    window_tokens -= window.popleft().tokens
+            window.append(piece)
+            window_tokens += piece.tokens
+            fresh += 1
+            if piece.paragraph_end and window_tokens >= max_tokens * PARAGRAPH_MIN_FILL:
+                yield emit()
+    if fresh:
+        yield emit()
@@ -0,0 +1,453 @@
+"""
+URL ingestion: a single page, a sitemap, or every page under a URL prefix.
+
+Pages are fetched through the registry's pooled HTTP session by at most
+CRAWL_CONCURRENCY threads per crawl, with requests to one host spaced to
+CRAWL_HOST_RATE per second (per process). Bodies are streamed and abandoned
+once they pass CRAWL_MAX_PAGE_BYTES.
+
+Re-crawls are incremental. Pages fetched before are requested with the ETag
+and Last-Modified of their last fetch, sitemap entries whose <lastmod> is older
+than the last fetch are not requested at all, and a page whose extracted text
+hashes the same as before is not re-ingested. `ingest_site` turns a crawl into
+an IngestionBatch of new and changed pages only.
+
+Main content is extracted with lxml: scripts, styles and page chrome (nav,
+aside, forms, and header/footer outside <main>/<article>) are dropped, and
+<main>, then <article>, is preferred over the whole body.
+"""
+import re
+import time
+import zlib
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from urllib.parse import urldefrag, urljoin, urlsplit
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import lxml.html
+from lxml import etree
+from ..config import settings
+from .. import crud
+from . import registry
+from . import metrics
+
+MODES = ('auto', 'page', 'sitemap', 'prefix')
+HTML_TYPES = ('', 'text/html', 'application/xhtml+xml')
+READ_PIECE_BYTES = 64 * 1024
+BOILERPLATE_TAGS = ('script', 'style', 'noscript', 'template', 'svg', 'iframe', 'nav', 'aside', 'form', 'button')
+CHROME_XPATH = '//header[not(ancestor::main or ancestor::article)] | //footer[not(ancestor::main or ancestor::article)]'
+BLOCK_TAGS = (
+    'p', 'div', 'section', 'article', 'main', 'li', 'dt', 'dd', 'tr', 'pre', 'blockquote',
+    'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'table', 'ul', 'ol', 'dl', 'figure', 'header', 'footer',
+)
+_META_CHARSET = re.compile(rb'<meta[^>]+charset=["\']?([\w-]+)', re.I)
+_HEADER_CHARSET = re.compile(r'charset=["\']?([\w-]+)', re.I)
+_XML_DECLARATION = re.compile(r'^\ufeff?\s*<\?xml[^>]*\?>')
+_SPACES = re.compile(r'[ \t\r\f\v\xa0]+')
+_BLANK_LINES = re.compile(r'\n\s*\n\s*')
+
+
+class FetchError(Exception):
+    pass
+
+
+class PageTooLarge(FetchError):
+    pass
+
+
+class CrawlAborted(Exception):
+    """The crawl's project is being deleted."""
+
+
+@dataclass
+class FetchResult:
+    url: str  # after redirects
+    status: int
+    content: bytes = b""
+    content_type: str = ""
+    charset: str = None  # from the Content-Type header only
+    etag: str = None
+    last_modified: str = None
+
+    @property
+    def not_modified(self):
+        return self.status == 304
+
+
+@dataclass
+class CrawledPage:
+    url: str
+    status: str  # 'fetched', 'not_modified', 'fresh' (sitemap lastmod predates the last fetch), 'skipped' or 'failed'
+    text: str = None
+    etag: str = None
+    last_modified: str = None
+    seconds: float = 0.0
+    error: str = None
+    links: list = field(default_factory=list)
+
+
+# --- Fetching ---
+class HostRateLimiter:
+    """Spaces requests to each host at least 1/rate seconds apart; rate 0 disables it."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next = {}  # host -> earliest start of its next request
+        self._lock = threading.Lock()
+
+    def wait(self, host):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next.get(host, 0.0))
+            self._next[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = HostRateLimiter(settings.CRAWL_HOST_RATE)
+    return _limiter
+
+
+def fetch(url, etag=None, last_modified=None, max_bytes=None):
+    """
+    GET a page, conditionally when the validators of its last fetch are given
+    (a 304 comes back as a FetchResult without content). Raises PageTooLarge
+    past `max_bytes` and requests' errors for failed requests; 429/5xx and
+    connection errors are retried with backoff.
+    """
+    from .embeddings import with_retry
+    headers = {'User-Agent': settings.CRAWL_USER_AGENT, 'Accept-Encoding': 'gzip, deflate'}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    with metrics.timed('web', 'fetch'):
+        return with_retry(_get, url, headers, max_bytes or settings.CRAWL_MAX_PAGE_BYTES)
+
+
+def _get(url, headers, max_bytes):
+    get_rate_limiter().wait(urlsplit(url).netloc)
+    response = registry.get_http_session().get(url, headers=headers, timeout=settings.CRAWL_TIMEOUT, stream=True)
+    with response:
+        response.raise_for_status()
+        content_type = response.headers.get('Content-Type', '')
+        charset = _HEADER_CHARSET.search(content_type)
+        result = FetchResult(
+            url=response.url,
+            status=response.status_code,
+            content_type=content_type.split(';')[0].strip().lower(),
+            charset=charset.group(1) if charset else None,
+            etag=response.headers.get('ETag'),
+            last_modified=response.headers.get('Last-Modified'),
+        )
+        if result.not_modified:
+            return result
+        declared = response.headers.get('Content-Length', '')
+        # Content-Length is the compressed size; the streamed check below covers decompressed bodies
+        if declared.isdigit() and int(declared) > max_bytes:
+            raise PageTooLarge(f"{url}: {declared} bytes (limit {max_bytes})")
+        body = bytearray()
+        for piece in response.iter_content(READ_PIECE_BYTES):
+            body += piece
+            if len(body) > max_bytes:
+                raise PageTooLarge(f"{url}: over {max_bytes} bytes")
+        result.content = bytes(body)
+    return result
+
+
+def decode(content, charset=None):
+    """Text of an HTML or text body: the header charset, else a <meta charset>, else UTF-8."""
+    if not charset:
+        match = _META_CHARSET.search(content[:4096])
+        charset = match.group(1).decode('ascii') if match else 'utf-8'
+    try:
+        return content.decode(charset, errors='replace')
+    except LookupError:
+        return content.decode('utf-8', errors='replace')
+
+
+# --- Extraction ---
+def parse_html(html, base_url=None):
+    """(main-content text, absolute http(s) links) of an HTML page."""
+    # lxml refuses text that declares its own encoding (XHTML's <?xml ... encoding=...?>); the text is already decoded
+    html = _XML_DECLARATION.sub('', html, count=1)
+    if not html.strip():
+        return "", []
+    tree = lxml.html.document_fromstring(html)
+    links = _links(tree, base_url) if base_url else []
+    etree.strip_elements(tree, etree.Comment, *BOILERPLATE_TAGS, with_tail=False)
+    for element in tree.xpath(CHROME_XPATH):
+        element.drop_tree()
+    body = tree.find('body')
+    roots = (
+        tree.xpath('//main[not(ancestor::main)]') or tree.xpath('//*[@role="main"]')
+        or tree.xpath('//article[not(ancestor::article)]') or [body if body is not None else tree]
+    )
+    for element in tree.iter('br'):
+        element.tail = '\n' + (element.tail or '')
+    for element in tree.iter(*BLOCK_TAGS):
+        element.tail = '\n\n' + (element.tail or '')
+    parts = []
+    title = tree.findtext('.//title')
+    if title and title.strip():
+        parts.append(title.strip())
+    parts.extend(''.join(root.itertext()) for root in roots)
+    text = '\n\n'.join(parts)
+    lines = (_SPACES.sub(' ', line).strip() for line in text.split('\n'))
+    return _BLANK_LINES.sub('\n\n', '\n'.join(lines)).strip(), links
+
+
+def _links(tree, base_url):
+    links = []
+    for href in tree.xpath('//a/@href'):
+        url = urldefrag(urljoin(base_url, href.strip()))[0]
+        if url.startswith(('http://', 'https://')):
+            links.append(url)
+    return links
+
+
+def html_to_text(html):
+    return parse_html(html)[0]
+
+
+def page_text(result):
+    """Ingestible text of a fetched page; raises FetchError for non-text content such as PDFs."""
+    return _page_text_and_links(result)[0]
+
+
+def _page_text_and_links(result, with_links=False):
+    if result.content_type in HTML_TYPES:
+        return parse_html(decode(result.content, result.charset), result.url if with_links else None)
+    if result.content_type.startswith('text/'):
+        return decode(result.content, result.charset), []
+    raise FetchError(f"{result.url}: unsupported content type {result.content_type}")
+
+
+# --- Sitemaps ---
+def parse_sitemap(content):
+    """([(page url, lastmod or None)], [child sitemap urls]) of a sitemap or sitemap index, gzipped or not."""
+    if content[:2] == b'\x1f\x8b':
+        inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        content = inflater.decompress(content, settings.CRAWL_MAX_PAGE_BYTES)
+        if inflater.unconsumed_tail:
+            raise PageTooLarge(f"sitemap over {settings.CRAWL_MAX_PAGE_BYTES} bytes uncompressed")
+    parser = etree.XMLParser(recover=True, resolve_entities=False, no_network=True)
+    root = etree.fromstring(content, parser)
+    if root is None:
+        return [], []
+    pages = [
+        (entry.findtext('{*}loc').strip(), _parse_lastmod(entry.findtext('{*}lastmod')))
+        for entry in root.iterfind('{*}url') if entry.findtext('{*}loc')
+    ]
+    children = [entry.findtext('{*}loc').strip() for entry in root.iterfind('{*}sitemap') if entry.findtext('{*}loc')]
+    return pages, children
+
+
+def _parse_lastmod(value):
+    """A sitemap <lastmod> (W3C datetime) as naive UTC, like the DateTime columns."""
+    if not value:
+        return None
+    try:
+        moment = datetime.fromisoformat(value.strip().replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if moment.tzinfo:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+
+def discover_sitemap(url, limit):
+    """{page url: lastmod} of a sitemap, following sitemap indexes, up to `limit` pages."""
+    pages, queue, seen = {}, deque([url]), set()
+    while queue and len(pages) < limit:
+        sitemap_url = queue.popleft()
+        if sitemap_url in seen:
+            continue
+        seen.add(sitemap_url)
+        try:
+            entries, children = parse_sitemap(fetch(sitemap_url).content)
+        except Exception as e:
+            # Only the root sitemap is essential
+            if sitemap_url == url:
+                raise
+            print(f"crawler: skipping sitemap {sitemap_url}: {e}")
+            continue
+        for page_url, lastmod in entries[:limit - len(pages)]:
+            pages.setdefault(page_url, lastmod)
+        queue.extend(children)
+    return pages
+
+
+# --- Crawling ---
+def resolve_mode(url, mode='auto'):
+    if mode != 'auto':
+        return mode
+    path = urlsplit(url).path.lower()
+    return 'sitemap' if path.endswith(('.xml', '.xml.gz')) or 'sitemap' in path.rsplit('/', 1)[-1] else 'page'
+
+
+def site_prefix(url):
+    """The directory a prefix crawl stays in: https://docs.example.com/guide/intro -> https://docs.example.com/guide/"""
+    parts = urlsplit(url)
+    path = parts.path if parts.path.endswith('/') else parts.path.rsplit('/', 1)[0] + '/'
+    return f"{parts.scheme}://{parts.netloc}{path}"
+
+
+def crawl(start_url, mode='auto', known=None, max_pages=None):
+    """
+    Yield a CrawledPage for each page of a single URL, a sitemap, or the pages
+    in `start_url`'s directory reachable by links from it (mode 'prefix'), as
+    fetches complete. `known` maps URLs fetched before to (etag, last_modified, fetched_at).
+    """
+    known = known or {}
+    max_pages = min(max_pages or settings.CRAWL_MAX_PAGES, settings.CRAWL_MAX_PAGES)
+    mode = resolve_mode(start_url, mode)
+    lastmods, prefix = {}, None
+    if mode == 'sitemap':
+        lastmods = discover_sitemap(start_url, max_pages)
+        frontier = list(lastmods)
+    elif mode == 'prefix':
+        prefix = site_prefix(start_url)
+        # Unchanged pages answer 304 without their links, so pages found by earlier crawls are seeded
+        frontier = [start_url] + sorted(url for url in known if url.startswith(prefix) and url != start_url)
+    else:
+        frontier = [start_url]
+    queue = deque(frontier[:max_pages])
+    seen = set(queue)
+    follow = mode == 'prefix'
+    with ThreadPoolExecutor(settings.CRAWL_CONCURRENCY) as pool:
+        running = set()
+        while queue or running:
+            while queue and len(running) < settings.CRAWL_CONCURRENCY:
+                url = queue.popleft()
+                running.add(pool.submit(_crawl_page, url, known.get(url), lastmods.get(url), follow))
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                page = future.result()
+                for link in page.links:
+                    if len(seen) >= max_pages:
+                        break
+                    if link.startswith(prefix) and link not in seen:
+                        seen.add(link)
+                        queue.append(link)
+                yield page
+
+
+def _crawl_page(url, validators, lastmod, follow):
+    etag, last_modified, fetched_at = validators or (None, None, None)
+    if lastmod and fetched_at and lastmod <= fetched_at:
+        return CrawledPage(url, 'fresh')
+    start = time.perf_counter()
+    try:
+        result = fetch(url, etag, last_modified)
+        if result.not_modified:
+            return CrawledPage(url, 'not_modified', seconds=time.perf_counter() - start)
+        text, links = _page_text_and_links(result, with_links=follow)
+    except FetchError as e:
+        return CrawledPage(url, 'skipped', seconds=time.perf_counter() - start, error=str(e))
+    except Exception as e:
+        return CrawledPage(url, 'failed', seconds=time.perf_counter() - start, error=str(e))
+    return CrawledPage(
+        url, 'fetched', text=text, etag=result.etag, last_modified=result.last_modified,
+        seconds=time.perf_counter() - start, links=links,
+    )
+
+
+# --- Ingestion ---
+def validators(doc):
+    """Conditional-request validators stored from a document's last fetch."""
+    return doc.http_etag, doc.http_last_modified
+
+
+def record_fetch(doc, etag, last_modified):
+    doc.http_etag = etag
+    doc.http_last_modified = last_modified
+    doc.fetched_at = datetime.utcnow()
+
+
+def ingest_site(db, batch, start_url, mode='auto', max_pages=None):
+    """
+    Crawl into `batch`: new pages become URL documents, changed pages of
+    existing documents are re-ingested, and unchanged pages only have their
+    fetch time and validators refreshed. Extracted text and validators are
+    handed to the pipeline, so pages are not fetched twice; finalize_document
+    stores the validators once the page's vectors are written. Returns the
+    crawl counts; raises CrawlAborted once the project is being deleted, before
+    adding documents its deletion job would miss.
+    """
+    from ..tasks import start_page_ingestion
+    _abort_if_deleting(db, batch.project_id)
+    documents = {doc.filename: doc for doc in crud.get_url_documents(db, batch.project_id)}
+    known = {url: (*validators(doc), doc.fetched_at) for url, doc in documents.items() if doc.status == 'ready'}
+    counts = {'new': 0, 'changed': 0, 'unchanged': 0, 'skipped': 0, 'failed': 0}
+    failures, rows, queued, touched = [], [], [], []
+
+    def flush():
+        _abort_if_deleting(db, batch.project_id)
+        if not (rows or queued or touched):
+            return
+        ids = crud.bulk_create_documents(db, [row for row, _ in rows])
+        for doc, _ in queued:
+            doc.batch_id, doc.status, doc.progress = batch.id, 'processing', 0.0
+        db.commit()
+        crud.add_batch_documents(db, batch.id, len(ids) + len(queued))
+        crud.touch_documents(db, touched)
+        start_page_ingestion(
+            [(i, page.text, page.seconds, page.etag, page.last_modified) for i, (_, page) in zip(ids, rows)]
+            + [(doc.id, page.text, page.seconds, page.etag, page.last_modified) for doc, page in queued]
+        )
+        rows.clear()
+        queued.clear()
+        touched.clear()
+
+    for page in crawl(start_url, mode, known, max_pages):
+        doc = documents.get(page.url)
+        if page.status in ('fresh', 'not_modified'):
+            counts['unchanged'] += 1
+            if page.status == 'not_modified':
+                touched.append(doc.id)
+        elif page.status in ('skipped', 'failed'):
+            counts[page.status] += 1
+            failures.append({'url': page.url, 'error': page.error})
+        elif doc is None:
+            counts['new'] += 1
+            rows.append(({
+                'project_id': batch.project_id, 'batch_id': batch.id, 'filename': page.url, 'filetype': 'url',
+                'status': 'processing',
+            }, page))
+        elif doc.status == 'ready' and doc.content_hash == _content_hash(page.text):
+            counts['unchanged'] += 1
+            record_fetch(doc, page.etag, page.last_modified)
+        else:
+            counts['changed'] += 1
+            queued.append((doc, page))
+        if len(rows) + len(queued) + len(touched) >= settings.BULK_DISPATCH_SIZE:
+            flush()
+            batch.crawl = {**counts, 'failures': failures[:50]}
+            db.commit()
+    flush()
+    batch.crawl = {**counts, 'failures': failures[:50]}
+    db.commit()
+    return counts
+
+
+def _abort_if_deleting(db, project_id):
+    if crud.project_deleting(db, project_id):
+        raise CrawlAborted(f"project {project_id} is being deleted")
+
+
+def _content_hash(text):
+    from .ingestion import content_hash
+    return content_hash(text)
@@ -0,0 +1,152 @@
+"""
+Background deletion of documents and projects.
+
+DELETE /api/documents/{id} and DELETE /api/projects/{id} only mark the
+documents (and project) 'deleting', record a DeletionJob and queue the
+run_deletion task; GET /api/deletions/{job_id} reports its progress. The job
+then removes, in order:
+
+- chunks: DELETE_BATCH_SIZE at a time, their vectors first (by id, or a whole
+  project's at once where the vector store can), then the rows
+- files: uploaded files and their GCS copies, DELETE_CONCURRENCY in parallel
+  (and the chat images of a deleted project)
+- rows: the documents, and for a project its chat sessions, messages and
+  ingestion batches, after a second pass over chunks
+
+Retrieval stops returning a marked document immediately: rag reads the
+project's deleting documents from the documents table on every retrieval (an
+indexed lookup), so the mark is in force as soon as DELETE returns. A failed
+job leaves everything marked; deleting again starts a new job that picks up
+where it stopped.
+
+Ingestion still in flight for a marked document checks its status again
+after each write the job could miss: embed_document deletes the vectors it
+just upserted, archive_document the GCS copy it just uploaded, and the second
+pass over chunks catches rows stored meanwhile. A marked project accepts no
+new documents or sessions (the API answers 409), a crawl stops, and documents
+that were added just before the mark are removed with the project.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from ..config import settings
+from ..database import SessionLocal
+from .. import crud
+from . import embeddings
+from . import ingestion
+from . import chunk_store
+from . import answer_cache
+
+UPLOAD_DIR = os.path.join(os.path.dirname(__file__), '..', '..', 'uploads')
+STATIC_DIR = os.path.join(os.path.dirname(__file__), '..', '..', 'static')
+
+
+# --- Retrieval exclusion ---
+def excluded_documents(project_id):
+    """(whole project being deleted, ids of its documents being deleted)."""
+    db = SessionLocal()
+    try:
+        return crud.get_deleting_document_ids(db, project_id)
+    finally:
+        db.close()
+
+
+# --- Starting a deletion ---
+def delete_document(db, document):
+    """Mark a document deleting and queue its removal; returns the DeletionJob."""
+    project_id = document.project_id
+    job = crud.create_deletion_job(db, project_id, [document.id])
+    crud.mark_documents_deleting(db, [document.id])
+    answer_cache.invalidate_project(project_id)
+    _queue(job)
+    return job
+
+
+def delete_project(db, project_id):
+    """Mark a project and all its documents deleting and queue their removal; returns the DeletionJob."""
+    job = crud.create_deletion_job(db, project_id)
+    crud.mark_project_deleting(db, project_id)
+    answer_cache.invalidate_project(project_id)
+    _queue(job)
+    return job
+
+
+def _queue(job):
+    from ..tasks import run_deletion
+    run_deletion.delay(job.id)
+
+
+# --- The job ---
+def run_job(db, job):
+    """Remove everything `job` covers, committing progress after each step. Returns its counts."""
+    whole_project = job.document_ids is None
+    job.stage = 'chunks'
+    _delete_chunks(db, job)
+
+    job.stage = 'files'
+    documents = crud.get_job_documents(db, job)
+    job.total_documents = len(documents)
+    db.commit()
+    with ThreadPoolExecutor(max_workers=settings.DELETE_CONCURRENCY) as executor:
+        for start in range(0, len(documents), settings.DELETE_BATCH_SIZE):
+            batch = documents[start:start + settings.DELETE_BATCH_SIZE]
+            list(executor.map(_remove_document_files, batch))
+            job.deleted_files += len(batch)
+            db.commit()
+    if whole_project:
+        for url in crud.get_project_image_urls(db, job.project_id):
+            _remove_file(os.path.join(STATIC_DIR, url.removeprefix('/static/')))
+
+    # Ingestion that was already past its status check may have stored chunks since the first pass
+    _delete_chunks(db, job)
+    job.stage = 'rows'
+    db.commit()
+    crud.delete_document_rows(db, [doc.id for doc in documents], settings.DELETE_BATCH_SIZE)
+    if whole_project:
+        # Uploads that passed their project check just before the mark may have added documents since
+        late = crud.get_job_documents(db, job)
+        if late:
+            crud.mark_documents_deleting(db, [doc.id for doc in late])
+            with ThreadPoolExecutor(max_workers=settings.DELETE_CONCURRENCY) as executor:
+                list(executor.map(_remove_document_files, late))
+            _delete_chunks(db, job)
+            crud.delete_document_rows(db, [doc.id for doc in late], settings.DELETE_BATCH_SIZE)
+            job.total_documents += len(late)
+            job.deleted_files += len(late)
+        crud.delete_project_rows(db, job.project_id)
+    answer_cache.invalidate_project(job.project_id)
+    crud.finish_deletion_job(db, job)
+    return {'chunks': job.deleted_chunks, 'vectors': job.deleted_vectors, 'documents': job.total_documents}
+
+
+def _delete_chunks(db, job):
+    job.total_chunks = job.deleted_chunks + crud.count_job_chunks(db, job)
+    db.commit()
+    by_scope = job.document_ids is None and embeddings.delete_project_vectors(job.project_id)
+    while True:
+        rows = crud.get_job_chunk_batch(db, job, settings.DELETE_BATCH_SIZE)
+        if not rows:
+            break
+        vector_ids = [row.vector_id for row in rows if row.vector_id]
+        # Vectors first: if the job fails, the rows left still hold the ids of the vectors left
+        if not by_scope:
+            embeddings.delete_vectors(vector_ids, job.project_id)
+        chunk_store.get_chunk_store().forget(vector_ids)
+        crud.delete_chunks(db, [row.id for row in rows], settings.DELETE_BATCH_SIZE)
+        job.deleted_chunks += len(rows)
+        job.deleted_vectors += len(vector_ids)
+        db.commit()
+
+
+def _remove_document_files(doc):
+    if doc.filetype == 'url':
+        return
+    _remove_file(os.path.join(UPLOAD_DIR, doc.filename))
+    if settings.GCS_BUCKET:
+        ingestion.delete_from_gcs(settings.GCS_BUCKET, doc.filename)
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,161 @@
+"""
+Two-tier cache for text embeddings, keyed by (model, sha256(text)).
+
+The first tier is a bounded in-process LRU. The second is a SQLite file shared
+by every process on the host and trimmed to EMBEDDING_CACHE_MAX_BYTES,
+least recently used entries first.
+"""
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from array import array
+from collections import OrderedDict
+from ..config import settings
+
+BACKEND_DIR = os.path.join(os.path.dirname(__file__), '..', '..')
+EVICTION_CHECK_INTERVAL = 256  # rows written between size checks
+
+
+def cache_key(model, text):
+    return f"{model}:{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
+
+
+class EmbeddingCache:
+    def __init__(self, path, memory_items=10000, max_bytes=1 << 30):
+        self.path = path
+        self.memory_items = memory_items
+        self.max_bytes = max_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._writes_since_check = 0
+        self.counters = {'hits_memory': 0, 'hits_disk': 0, 'misses': 0, 'evicted': 0}
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with self._conn() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key TEXT PRIMARY KEY, vector BLOB NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_embeddings_last_used ON embeddings (last_used)")
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _remember(self, key, vector):
+        with self._lock:
+            self._memory[key] = vector
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+
+    def get_many(self, model, texts):
+        """Return a list aligned with `texts` holding cached vectors or None."""
+        keys = [cache_key(model, t) for t in texts]
+        results = [None] * len(texts)
+        disk_lookup = {}
+        with self._lock:
+            for i, key in enumerate(keys):
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    results[i] = vector
+                    self.counters['hits_memory'] += 1
+                else:
+                    disk_lookup.setdefault(key, []).append(i)
+        if disk_lookup:
+            conn = self._conn()
+            found = {}
+            lookup_keys = list(disk_lookup)
+            for start in range(0, len(lookup_keys), 500):
+                batch = lookup_keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = conn.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch)
+                for key, blob in rows:
+                    found[key] = array('f', blob).tolist()
+            if found:
+                now = time.time()
+                with conn:
+                    conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, k) for k in found])
+            for key, positions in disk_lookup.items():
+                vector = found.get(key)
+                with self._lock:
+                    self.counters['hits_disk' if vector is not None else 'misses'] += len(positions)
+                if vector is not None:
+                    self._remember(key, vector)
+                    for i in positions:
+                        results[i] = vector
+        return results
+
+    def put_many(self, model, texts, vectors):
+        now = time.time()
+        rows = []
+        for text, vector in zip(texts, vectors):
+            key = cache_key(model, text)
+            self._remember(key, vector)
+            blob = array('f', vector).tobytes()
+            rows.append((key, blob, len(blob), now))
+        conn = self._conn()
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO embeddings (key, vector, size, last_used) VALUES (?, ?, ?, ?)", rows)
+        with self._lock:
+            self._writes_since_check += len(rows)
+            check = self._writes_since_check >= EVICTION_CHECK_INTERVAL
+            if check:
+                self._writes_since_check = 0
+        if check:
+            self._evict()
+
+    def _evict(self):
+        conn = self._conn()
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Trim to 90% of the budget so we don't evict again on the next write
+        excess = total - int(self.max_bytes * 0.9)
+        doomed = []
+        for key, size in conn.execute("SELECT key, size FROM embeddings ORDER BY last_used"):
+            doomed.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        with conn:
+            conn.executemany("DELETE FROM embeddings WHERE key = ?", doomed)
+        with self._lock:
+            self.counters['evicted'] += len(doomed)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats['memory_items'] = len(self._memory)
+        row = self._conn().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM embeddings").fetchone()
+        stats['disk_items'], stats['disk_bytes'] = row
+        lookups = stats['hits_memory'] + stats['hits_disk'] + stats['misses']
+        stats['hit_rate'] = (stats['hits_memory'] + stats['hits_disk']) / lookups if lookups else 0.0
+        return stats
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache():
+    """Process-wide embedding cache, or None when EMBEDDING_CACHE_ENABLED is off."""
+    global _cache
+    if not settings.EMBEDDING_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                path = settings.EMBEDDING_CACHE_PATH
+                if not os.path.isabs(path):
+                    path = os.path.join(BACKEND_DIR, path)
+                _cache = EmbeddingCache(path, settings.EMBEDDING_CACHE_MEMORY_ITEMS, settings.EMBEDDING_CACHE_MAX_BYTES)
+    return _cache
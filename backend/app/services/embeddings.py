@@ -1,41 +1,240 @@
 
+import time
+import random
+import asyncio
+import httpx
 import requests
-from pinecone import Pinecone
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from ..config import settings
+from .vectorstore import get_vector_store
+from .embedding_cache import get_embedding_cache
+from . import http
+from . import registry
+from . import metrics
 
 JINA_API_KEY = settings.JINA_API_KEY
-JINA_EMBEDDING_URL = "https://api.jina.ai/v1/embeddings"
+JINA_EMBEDDING_URL = settings.JINA_EMBEDDING_URL
+JINA_EMBEDDING_MODEL = "jina-embeddings-v2-base-en"
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
 
 
 def embed_texts(texts):
     """
     Generate embeddings using Jina AI's jina-embeddings-v2-base-en model.
+    Texts already in the embedding cache are served from it; only misses are sent to Jina.
     """
     if isinstance(texts, str):
         texts = [texts]
-    print("JINA_API_KEY used:", repr(JINA_API_KEY))
-    headers = {
+    cache = get_embedding_cache()
+    if cache is None:
+        return _jina_embed(texts)
+    embeddings = cache.get_many(JINA_EMBEDDING_MODEL, texts)
+    missing = _missing(texts, embeddings)
+    if missing:
+        embeddings = _fill_missing(cache, texts, embeddings, missing, _jina_embed(missing))
+    return embeddings
+
+def _missing(texts, embeddings):
+    return list(dict.fromkeys(t for t, e in zip(texts, embeddings) if e is None))
+
+def _fill_missing(cache, texts, embeddings, missing, vectors):
+    fetched = dict(zip(missing, vectors))
+    cache.put_many(JINA_EMBEDDING_MODEL, missing, vectors)
+    return [e if e is not None else fetched[t] for t, e in zip(texts, embeddings)]
+
+def _jina_headers():
+    return {
         "Authorization": f"Bearer {JINA_API_KEY}",
         "Content-Type": "application/json",
     }
-    data = {
-        "input": texts,
-        "model": "jina-embeddings-v2-base-en"
-    }
-    response = requests.post(JINA_EMBEDDING_URL, headers=headers, json=data)
+
+def _jina_embed(texts):
+    headers = _jina_headers()
+    embeddings = []
+    # Keep each request within the provider's payload limits
+    for start in range(0, len(texts), settings.EMBED_BATCH_SIZE):
+        data = {
+            "input": texts[start:start + settings.EMBED_BATCH_SIZE],
+            "model": JINA_EMBEDDING_MODEL
+        }
+        with metrics.timed('jina', 'embed'):
+            response = with_retry(_post_json, JINA_EMBEDDING_URL, headers, data)
+        result = response.json()
+        embeddings.extend(item["embedding"] for item in result["data"])
+    return embeddings
+
+def _post_json(url, headers, data):
+    response = registry.get_http_session().post(url, headers=headers, json=data, timeout=60)
     response.raise_for_status()
-    result = response.json()
-    embeddings = [item["embedding"] for item in result["data"]]
+    return response
+
+# --- Retry ---
+def _is_retryable(exc):
+    if isinstance(exc, (requests.ConnectionError, requests.Timeout, httpx.TransportError)):
+        return True
+    response = getattr(exc, 'response', None)
+    status = getattr(response, 'status_code', None) or getattr(exc, 'status', None)
+    return status in RETRYABLE_STATUS
+
+def _retry_delay(attempt, exc):
+    delay = random.uniform(0, min(settings.HTTP_BACKOFF_MAX, settings.HTTP_BACKOFF_BASE * 2 ** attempt))
+    retry_after = getattr(getattr(exc, 'response', None), 'headers', {}).get('Retry-After')
+    if retry_after and retry_after.isdigit():
+        delay = max(delay, float(retry_after))
+    return delay
+
+def with_retry(fn, *args, **kwargs):
+    """
+    Call fn, retrying 429/5xx and connection errors with full-jitter exponential
+    backoff (honouring Retry-After when the provider sends one).
+    """
+    for attempt in range(settings.HTTP_MAX_RETRIES + 1):
+        try:
+            return fn(*args, **kwargs)
+        except Exception as exc:
+            if attempt == settings.HTTP_MAX_RETRIES or not _is_retryable(exc):
+                raise
+            time.sleep(_retry_delay(attempt, exc))
+
+async def awith_retry(fn, *args, **kwargs):
+    """Async counterpart of with_retry for coroutine functions."""
+    for attempt in range(settings.HTTP_MAX_RETRIES + 1):
+        try:
+            return await fn(*args, **kwargs)
+        except Exception as exc:
+            if attempt == settings.HTTP_MAX_RETRIES or not _is_retryable(exc):
+                raise
+            await asyncio.sleep(_retry_delay(attempt, exc))
+
+def embedding_cache_stats():
+    cache = get_embedding_cache()
+    return cache.stats() if cache else {"enabled": False}
+
+# --- Async path (pooled client, see http.py) ---
+async def aembed_texts(texts):
+    """Async embed_texts for the request path; cache hits never leave the process."""
+    if isinstance(texts, str):
+        texts = [texts]
+    cache = get_embedding_cache()
+    if cache is None:
+        return await _ajina_embed(texts)
+    # The cache reads and writes SQLite: keep that disk I/O off the event loop
+    embeddings = await asyncio.to_thread(cache.get_many, JINA_EMBEDDING_MODEL, texts)
+    missing = _missing(texts, embeddings)
+    if missing:
+        vectors = await _ajina_embed(missing)
+        embeddings = await asyncio.to_thread(_fill_missing, cache, texts, embeddings, missing, vectors)
     return embeddings
 
-# Pinecone upsert remains unchanged
+async def _ajina_embed(texts):
+    headers = _jina_headers()
+    embeddings = []
+    for start in range(0, len(texts), settings.EMBED_BATCH_SIZE):
+        data = {
+            "input": texts[start:start + settings.EMBED_BATCH_SIZE],
+            "model": JINA_EMBEDDING_MODEL
+        }
+        with metrics.timed('jina', 'embed'):
+            response = await awith_retry(_apost_json, JINA_EMBEDDING_URL, headers, data)
+        embeddings.extend(item["embedding"] for item in response.json()["data"])
+    return embeddings
+
+async def _apost_json(url, headers, data):
+    response = await http.post(url, headers=headers, json=data)
+    response.raise_for_status()
+    return response
+
+async def aquery_vectors(vector, top_k=5, filter=None, include_metadata=True):
+    with metrics.timed(settings.VECTOR_BACKEND, 'query'):
+        return await get_vector_store().aquery(vector, top_k=top_k, filter=filter, include_metadata=include_metadata)
+
+# --- Vector store access (Pinecone or local, see vectorstore.py) ---
+
+def upsert_vectors(ids, embeddings, metadatas):
+    with metrics.timed(settings.VECTOR_BACKEND, 'upsert'):
+        get_vector_store().upsert(ids, embeddings, metadatas)
+
+# Kept for existing callers
+upsert_to_pinecone = upsert_vectors
+
+def query_vectors(vector, top_k=5, filter=None, include_metadata=True):
+    with metrics.timed(settings.VECTOR_BACKEND, 'query'):
+        return get_vector_store().query(vector, top_k=top_k, filter=filter, include_metadata=include_metadata)
+
+def delete_vectors(ids, project_id=None):
+    if ids:
+        with metrics.timed(settings.VECTOR_BACKEND, 'delete'):
+            with_retry(get_vector_store().delete, ids, project_id)
+
+def delete_project_vectors(project_id):
+    """Drop a project's vectors in one operation; False if the backend needs them deleted by id."""
+    with metrics.timed(settings.VECTOR_BACKEND, 'delete'):
+        return with_retry(get_vector_store().delete_project, project_id)
+
+# --- Batched embedding + upsert pipeline ---
+def _batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+def embed_and_upsert(records, batch_size=None, max_concurrency=None, stats=None, on_progress=None):
+    """
+    Embed (id, text, metadata) records in provider-sized batches with at most
+    `max_concurrency` requests in flight, upserting each batch as soon as its
+    embeddings arrive. Records are consumed lazily. Returns the number of vectors written.
+
+    Pass a dict as `stats` to accumulate 'embed' and 'upsert' busy seconds
+    (summed over concurrent requests) and request counts; `on_progress(written)`
+    is called from this thread after every completed upsert.
+    """
+    batch_size = batch_size or settings.EMBED_BATCH_SIZE
+    max_concurrency = max_concurrency or settings.EMBED_MAX_CONCURRENCY
+    stats = {} if stats is None else stats
+    written = 0
+    with ThreadPoolExecutor(max_concurrency) as embed_pool, \
+            ThreadPoolExecutor(settings.UPSERT_MAX_CONCURRENCY) as upsert_pool:
+        embedding, upserting = {}, set()
+
+        def drain(return_when):
+            nonlocal written
+            done, _ = wait(set(embedding) | upserting, return_when=return_when)
+            for future in done:
+                if future in upserting:
+                    upserting.discard(future)
+                    written += _account(stats, 'upsert', future.result())
+                    if on_progress:
+                        on_progress(written)
+                    continue
+                ids, metadatas = embedding.pop(future)
+                vectors = _account(stats, 'embed', future.result())
+                for start in range(0, len(ids), settings.UPSERT_BATCH_SIZE):
+                    stop = start + settings.UPSERT_BATCH_SIZE
+                    upserting.add(upsert_pool.submit(_timed, _upsert_batch, ids[start:stop], vectors[start:stop], metadatas[start:stop]))
+
+        for batch in _batches(records, batch_size):
+            ids, texts, metadatas = (list(column) for column in zip(*batch))
+            embedding[embed_pool.submit(_timed, embed_texts, texts)] = (ids, metadatas)
+            while len(embedding) + len(upserting) >= 2 * max_concurrency:
+                drain(FIRST_COMPLETED)
+        while embedding or upserting:
+            drain(FIRST_COMPLETED)
+    return written
+
+def _timed(fn, *args):
+    start = time.perf_counter()
+    return fn(*args), time.perf_counter() - start
 
-pc = Pinecone(api_key=settings.PINECONE_API_KEY)
-index = pc.Index(settings.PINECONE_INDEX)
+def _account(stats, stage, timed_result):
+    result, seconds = timed_result
+    stats[stage] = stats.get(stage, 0.0) + seconds
+    stats[stage + '_requests'] = stats.get(stage + '_requests', 0) + 1
+    return result
 
-def upsert_to_pinecone(ids, embeddings, metadatas):
-    vectors = [
-        {"id": str(id_), "values": emb, "metadata": meta}
-        for id_, emb, meta in zip(ids, embeddings, metadatas)
-    ]
-    index.upsert(vectors=vectors) 
\ No newline at end of file
+def _upsert_batch(ids, vectors, metadatas):
+    with_retry(upsert_vectors, ids, vectors, metadatas)
+    return len(ids)
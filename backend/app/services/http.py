@@ -0,0 +1,64 @@
+"""
+Pooled async HTTP client shared by the async request path.
+
+One keep-alive httpx.AsyncClient serves every outbound call from a worker.
+A per-host semaphore keeps any single provider (Jina, Groq, ElevenLabs,
+Deepgram) from taking every connection in the pool.
+"""
+import asyncio
+from urllib.parse import urlsplit
+import httpx
+from ..config import settings
+
+_client = None
+_host_limits = {}
+
+
+def get_async_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(settings.HTTP_TIMEOUT, connect=10.0),
+            limits=httpx.Limits(
+                max_connections=settings.HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=60,
+            ),
+        )
+    return _client
+
+
+def _host_semaphore(url) -> asyncio.Semaphore:
+    host = urlsplit(url).netloc
+    semaphore = _host_limits.get(host)
+    if semaphore is None:
+        semaphore = _host_limits[host] = asyncio.Semaphore(settings.HTTP_MAX_CONNECTIONS_PER_HOST)
+    return semaphore
+
+
+async def request(method, url, **kwargs) -> httpx.Response:
+    async with _host_semaphore(url):
+        return await get_async_client().request(method, url, **kwargs)
+
+
+async def post(url, **kwargs) -> httpx.Response:
+    return await request("POST", url, **kwargs)
+
+
+async def stream_lines(method, url, **kwargs):
+    """Yield response lines of a streamed request, raising on HTTP errors before the first line."""
+    async with _host_semaphore(url):
+        async with get_async_client().stream(method, url, **kwargs) as response:
+            if response.is_error:
+                await response.aread()
+                response.raise_for_status()
+            async for line in response.aiter_lines():
+                yield line
+
+
+async def aclose():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+    _host_limits.clear()
@@ -1,45 +1,140 @@
 import os
+import time
+import hashlib
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from ..config import settings
 from ..database import SessionLocal
 from .. import crud
-from google.cloud import storage
-from google.cloud import vision
-
-# Set Google Cloud credentials
-if settings.GOOGLE_APPLICATION_CREDENTIALS:
-    os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = settings.GOOGLE_APPLICATION_CREDENTIALS
-import cv2
-import spacy
+from . import registry
+from . import metrics
+from . import ocr
+from . import crawler
 import pdfplumber
 import docx
 import csv
-import requests
-from bs4 import BeautifulSoup
 
 def upload_to_gcs(local_path, bucket_name, dest_blob_name):
-    client = storage.Client()
+    client = registry.get_storage_client()
     bucket = client.bucket(bucket_name)
     blob = bucket.blob(dest_blob_name)
-    blob.upload_from_filename(local_path)
+    with metrics.timed('gcs', 'upload'):
+        blob.upload_from_filename(local_path)
     return f'gs://{bucket_name}/{dest_blob_name}'
 
-def update_document_status(document_id, status):
-    db = SessionLocal()
-    doc = crud.get_document(db, document_id)
-    if doc:
-        doc.status = status
-        db.commit()
-    db.close()
+def delete_from_gcs(bucket_name, blob_name):
+    """Delete an archived copy; False when there was none."""
+    from google.api_core.exceptions import NotFound
+    blob = registry.get_storage_client().bucket(bucket_name).blob(blob_name)
+    with metrics.timed('gcs', 'delete'):
+        try:
+            blob.delete()
+        except NotFound:
+            return False
+    return True
+
+def update_document_status(document_id, status, db=None):
+    """Set a document's status with one UPDATE, in `db` if given or a short-lived session."""
+    own_session = db is None
+    db = db or SessionLocal()
+    try:
+        crud.update_document_status(db, document_id, status)
+    finally:
+        if own_session:
+            db.close()
+
+# --- Content hashing / incremental re-ingestion ---
+def content_hash(data):
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return hashlib.sha256(data).hexdigest()
+
+def existing_chunks(db, document_id):
+    """A document's chunk rows as dicts, with content hashes filled in for rows written before hashing existed."""
+    refs = [row._asdict() for row in crud.get_chunk_refs(db, document_id)]
+    unhashed = [ref['id'] for ref in refs if not ref['content_hash']]
+    if unhashed:
+        texts = {}
+        for start in range(0, len(unhashed), 2000):
+            texts.update(crud.get_chunk_texts(db, unhashed[start:start + 2000]))
+        for ref in refs:
+            if not ref['content_hash']:
+                ref['content_hash'] = content_hash(texts.get(ref['id'], ''))
+    return refs
+
+def diff_chunks(existing, chunks):
+    """
+    Match new chunks to a document's existing rows by content hash.
+    Returns (added, kept, removed): chunks that need embedding, (row, chunk)
+    pairs whose vectors are reused, and rows whose text no longer appears.
+    Rows whose vector was never written (an ingestion that failed after
+    storing them) are never reused: they are removed and their text re-added.
+    """
+    by_hash, unembedded = {}, []
+    for row in existing:
+        if row.get('embedded') is False:
+            unembedded.append(row)
+        else:
+            by_hash.setdefault(row['content_hash'], []).append(row)
+    added, kept = [], []
+    for chunk in chunks:
+        rows = by_hash.get(content_hash(chunk.text))
+        if rows:
+            kept.append((rows.pop(), chunk))
+        else:
+            added.append(chunk)
+    removed = [row for rows in by_hash.values() for row in rows] + unembedded
+    return added, kept, removed
 
 def extract_text_from_pdf(file_path):
-    text = ""
     try:
-        with pdfplumber.open(file_path) as pdf:
-            for page in pdf.pages:
-                text += page.extract_text() or ""
+        return "\n".join(iter_pdf_pages(file_path))
     except Exception:
-        text = ""
-    return text
+        return ""
+
+def iter_pdf_pages(file_path, workers=None):
+    """
+    Yield the text of each PDF page in order, releasing parsed pages as we go.
+    Large PDFs are split into page ranges extracted in a process pool, with at
+    most two ranges per worker in memory at once.
+    """
+    workers = workers if workers is not None else (settings.PDF_EXTRACT_WORKERS or os.cpu_count() or 1)
+    with pdfplumber.open(file_path) as pdf:
+        page_count = len(pdf.pages)
+        if workers <= 1 or page_count < settings.PDF_PARALLEL_MIN_PAGES:
+            for page in pdf.pages:
+                yield page.extract_text() or ""
+                page.flush_cache()
+            return
+    step = settings.PDF_PAGES_PER_TASK
+    ranges = iter([(start, min(start + step, page_count)) for start in range(0, page_count, step)])
+    with ProcessPoolExecutor(workers) as pool:
+        pending = deque()
+        try:
+            for _ in range(workers * 2):
+                page_range = next(ranges, None)
+                if page_range:
+                    pending.append(pool.submit(_extract_page_range, file_path, *page_range))
+        except AssertionError:
+            # Daemonic processes (e.g. Celery prefork children) cannot start a pool
+            pending.clear()
+            yield from iter_pdf_pages(file_path, workers=1)
+            return
+        while pending:
+            pages = pending.popleft().result()
+            page_range = next(ranges, None)
+            if page_range:
+                pending.append(pool.submit(_extract_page_range, file_path, *page_range))
+            yield from pages
+
+def _extract_page_range(file_path, start, stop):
+    texts = []
+    with pdfplumber.open(file_path) as pdf:
+        for page in pdf.pages[start:stop]:
+            texts.append(page.extract_text() or "")
+            page.flush_cache()
+    return texts
 
 def extract_text_from_docx(file_path):
     text = ""
@@ -63,30 +158,66 @@ def extract_text_from_csv(file_path):
     return text
 
 def extract_text_from_image(file_path):
-    # Preprocess image with OpenCV
-    image = cv2.imread(file_path)
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    blurred = cv2.GaussianBlur(gray, (5, 5), 0)
-    _, thresh = cv2.threshold(blurred, 128, 255, cv2.THRESH_BINARY_INV)
-    cv2.imwrite(file_path, thresh)
-    # OCR with Google Vision
-    client = vision.ImageAnnotatorClient()
+    # Preprocessing happens in memory; the uploaded file is left as it was
     with open(file_path, "rb") as image_file:
-        content = image_file.read()
-    image_vision = vision.Image(content=content)
-    response = client.text_detection(image=image_vision)
-    texts = response.text_annotations
-    if texts:
-        return texts[0].description
-    return ""
+        return ocr.ocr_image(image_file.read())
+
+def fetch_url(url):
+    page = crawler.fetch(url)
+    return crawler.decode(page.content, page.charset)
+
+def html_to_text(html):
+    return crawler.html_to_text(html)
 
 def extract_text_from_url(url):
-    resp = requests.get(url)
-    soup = BeautifulSoup(resp.text, 'html.parser')
-    return soup.get_text()
-
-def process_text_with_spacy(text):
-    nlp = spacy.load('en_core_web_sm')
-    doc_spacy = nlp(text)
-    entities = [(ent.text, ent.label_) for ent in doc_spacy.ents]
-    return entities 
\ No newline at end of file
+    return crawler.page_text(crawler.fetch(url))
+
+def process_text_with_spacy(texts, report=None):
+    """
+    Named entities for a text or a sequence of texts (e.g. chunks), in order and
+    without duplicates. Documents over NER_MAX_CHARS are truncated or skipped per
+    NER_SKIP_POLICY. Pass a dict as `report` to receive the stage's counts and timings.
+    """
+    if isinstance(texts, str):
+        texts = [texts]
+    start = time.perf_counter()
+    nlp = registry.get_nlp()
+    loaded = time.perf_counter()
+    total_chars = sum(len(t) for t in texts)
+    selected, skipped = texts, None
+    if settings.NER_MAX_CHARS and total_chars > settings.NER_MAX_CHARS:
+        skipped = settings.NER_SKIP_POLICY
+        selected = [] if skipped == 'skip' else _within_char_budget(texts, settings.NER_MAX_CHARS)
+    # A whole plain-text file can arrive as one text; spaCy refuses anything over max_length
+    selected = [t[:nlp.max_length] for t in selected]
+    n_process = settings.NER_PROCESSES
+    if n_process != 1 and multiprocessing.current_process().daemon:
+        # Daemonic processes (e.g. Celery prefork children) cannot fork workers
+        n_process = 1
+    entities, seen = [], set()
+    for doc_spacy in nlp.pipe(selected, batch_size=settings.NER_BATCH_SIZE, n_process=n_process):
+        for ent in doc_spacy.ents:
+            entity = (ent.text, ent.label_)
+            if entity not in seen:
+                seen.add(entity)
+                entities.append(entity)
+    if report is not None:
+        report.update({
+            'texts': len(texts),
+            'texts_processed': len(selected),
+            'chars': total_chars,
+            'skipped': skipped,
+            'entities': len(entities),
+            'model_seconds': round(loaded - start, 3),
+            'ner_seconds': round(time.perf_counter() - loaded, 3),
+        })
+    return entities
+
+def _within_char_budget(texts, budget):
+    selected = []
+    for text in texts:
+        if budget <= 0:
+            break
+        selected.append(text[:budget])
+        budget -= len(text)
+    return selected
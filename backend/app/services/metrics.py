@@ -0,0 +1,169 @@
+"""
+Prometheus metrics.
+
+- HTTP: per-route latency histogram and in-flight gauge, recorded by
+  MetricsMiddleware with the route template (/api/documents/{document_id}) as
+  label so cardinality stays bounded.
+- External calls: `timed(service, operation)` wraps every call to Jina, the
+  vector store, Groq, Vision, GCS, ElevenLabs and Deepgram with a latency
+  histogram and an error counter. Times include retries.
+- Database: SQLAlchemy pool size, checked-out and overflow connections.
+- Prompts: tokens of context, history and the whole prompt per chat turn.
+
+With several API or Celery processes, set PROMETHEUS_MULTIPROC_DIR to a shared
+empty directory; /metrics then aggregates every process that writes to it.
+"""
+import os
+import time
+from contextlib import contextmanager
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest,
+)
+from prometheus_client.core import GaugeMetricFamily
+from starlette.routing import Match
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+REQUEST_LATENCY = Histogram(
+    'autorag_http_request_duration_seconds', 'HTTP request latency until the response body is sent',
+    ['method', 'route', 'status'], buckets=LATENCY_BUCKETS,
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    'autorag_http_requests_in_flight', 'HTTP requests being handled',
+    ['method', 'route'], multiprocess_mode='livesum',
+)
+EXTERNAL_LATENCY = Histogram(
+    'autorag_external_call_duration_seconds', 'Latency of calls to external services, retries included',
+    ['service', 'operation'], buckets=LATENCY_BUCKETS,
+)
+PROMPT_TOKENS = Histogram(
+    'autorag_prompt_tokens', 'Tokens per chat prompt, by part (see prompt_packer.py)',
+    ['part'], buckets=(250, 500, 1000, 2000, 3000, 4000, 6000, 8000, 12000, 16000, 32000),
+)
+EXTERNAL_ERRORS = Counter(
+    'autorag_external_call_errors_total', 'Failed calls to external services',
+    ['service', 'operation', 'error'],
+)
+
+
+# --- External calls ---
+@contextmanager
+def timed(service, operation):
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        record_error(service, operation, type(e).__name__)
+        raise
+    finally:
+        EXTERNAL_LATENCY.labels(service, operation).observe(time.perf_counter() - start)
+
+
+def record_error(service, operation, error):
+    """Count a failure that did not raise, e.g. a non-2xx response handled by the caller."""
+    EXTERNAL_ERRORS.labels(service, operation, str(error)).inc()
+
+
+async def time_to_first(service, operation, items):
+    """Pass an async iterator through, timing the wait for its first item (e.g. first streamed token)."""
+    with timed(service, operation):
+        try:
+            first = await items.__anext__()
+        except StopAsyncIteration:
+            return
+    yield first
+    async for item in items:
+        yield item
+
+
+# --- HTTP ---
+class MetricsMiddleware:
+    """
+    ASGI middleware; streamed responses are timed until their last chunk is
+    sent. `routers` is a list of (mount prefix, router) pairs whose routes give
+    the route label; paths no route matches are labelled 'unmatched'.
+    """
+
+    def __init__(self, app, routers):
+        self.app = app
+        self.routers = routers
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        method, route = scope['method'], self._route(scope)
+        status = {'code': 500}
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                status['code'] = message['status']
+            await send(message)
+
+        in_flight = REQUESTS_IN_FLIGHT.labels(method, route)
+        in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            in_flight.dec()
+            REQUEST_LATENCY.labels(method, route, str(status['code'])).observe(time.perf_counter() - start)
+
+    def _route(self, scope):
+        path = scope['path']
+        for prefix, router in self.routers:
+            if not path.startswith(prefix):
+                continue
+            child = dict(scope, path=path[len(prefix):])
+            for route in router.routes:
+                # Included routers are covered by their own (prefix, router) entry
+                if getattr(route, 'path', None) is None:
+                    continue
+                match, _ = route.matches(child)
+                if match == Match.FULL:
+                    return prefix + route.path
+        return 'unmatched'
+
+
+# --- Database pool ---
+class PoolCollector:
+    """Reads the engine's pool counters at scrape time."""
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    def collect(self):
+        pool = self.engine.pool
+        for name, doc in (
+            ('size', 'Configured pool size'),
+            ('checkedout', 'Connections in use'),
+            ('checkedin', 'Idle connections in the pool'),
+            ('overflow', 'Connections beyond the pool size'),
+        ):
+            value = getattr(pool, name, None)
+            if callable(value):
+                yield GaugeMetricFamily(f'autorag_db_pool_{name}', doc, value=value())
+
+
+_pool_collectors = []
+
+
+def register_engine(engine):
+    collector = PoolCollector(engine)
+    _pool_collectors.append(collector)
+    if not os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        REGISTRY.register(collector)
+
+
+def render():
+    """(body, content type) for the /metrics endpoint."""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        # Pool counters are per process: report the scraped process's own
+        for collector in _pool_collectors:
+            registry.register(collector)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
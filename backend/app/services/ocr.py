@@ -0,0 +1,232 @@
+"""
+Image OCR with Google Vision.
+
+Images are decoded, downscaled so the longest side is at most OCR_MAX_SIDE
+(Vision gains nothing from more pixels than that for text) and binarized,
+then PNG-encoded in memory; nothing is written back to disk. Misses are sent
+to Vision OCR_BATCH_SIZE images per batch_annotate_images request.
+
+Results are cached by a sha256 of the decoded pixels, so an image uploaded
+again, or re-encoded losslessly, skips OCR. The cache is an in-process LRU,
+shared between processes through Redis when it is reachable. With
+OCR_PERCEPTUAL_MATCH, images whose perceptual hash (a difference hash of the
+grayscale image) is within OCR_HASH_DISTANCE bits of a cached one reuse its
+text too, which also catches resized and lossy copies. It is off by default:
+screenshots of the same screen that differ only in some digits can have the
+same perceptual hash.
+
+An image that cannot be decoded, or that Vision reports an error for, fails
+on its own: ocr_images returns the error in its place and ocr_image raises it.
+"""
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+import cv2
+import numpy as np
+from ..config import settings
+from . import registry
+from . import metrics
+
+REDIS_KEY = "autorag:ocr:{}"
+REDIS_RETRY_SECONDS = 30
+VISION_MAX_BATCH = 16  # images per synchronous batch_annotate_images request
+
+
+class ImageDecodeError(ValueError):
+    pass
+
+
+class OcrError(RuntimeError):
+    """Vision reported an error for the image."""
+
+
+# --- Preprocessing ---
+def decode_gray(data):
+    gray = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+    if gray is None:
+        raise ImageDecodeError("not a decodable image")
+    return gray
+
+
+def downscale(gray, max_side=None):
+    max_side = max_side or settings.OCR_MAX_SIDE
+    height, width = gray.shape[:2]
+    scale = max_side / max(height, width)
+    if scale >= 1:
+        return gray
+    return cv2.resize(gray, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA)
+
+
+def preprocess(gray):
+    """PNG bytes of the OCR input: downscaled and, with OCR_BINARIZE, thresholded."""
+    image = downscale(gray)
+    if settings.OCR_BINARIZE:
+        blurred = cv2.GaussianBlur(image, (5, 5), 0)
+        _, image = cv2.threshold(blurred, 128, 255, cv2.THRESH_BINARY_INV)
+    ok, encoded = cv2.imencode('.png', image)
+    if not ok:
+        raise ImageDecodeError("could not encode image")
+    return encoded.tobytes()
+
+
+def content_key(gray):
+    """Exact cache key: sha256 of the decoded pixels and their shape."""
+    digest = hashlib.sha256(f"{gray.shape}".encode())
+    digest.update(np.ascontiguousarray(gray).data)
+    return digest.hexdigest()
+
+
+def perceptual_hash(gray, size=None):
+    """Difference hash: one bit per horizontally adjacent pixel pair of a size x size thumbnail."""
+    size = size or settings.OCR_HASH_SIZE
+    thumbnail = cv2.resize(gray, (size + 1, size), interpolation=cv2.INTER_AREA)
+    bits = (thumbnail[:, 1:] > thumbnail[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+# --- Cache ---
+class OcrCache:
+    """
+    Text by content key, with an optional near-match index by perceptual hash
+    (`perceptual`, local only).
+    """
+
+    def __init__(self, max_items=10000, perceptual=False, max_distance=0):
+        self.max_items = max_items
+        self.perceptual = perceptual
+        self.max_distance = max_distance
+        self._items = OrderedDict()  # content key -> text
+        self._similar = OrderedDict()  # perceptual hash -> text
+        self._lock = threading.Lock()
+        self._redis_down_until = 0.0
+        self.counters = {'hits': 0, 'hits_perceptual': 0, 'misses': 0}
+
+    def get(self, key, image_hash=None):
+        with self._lock:
+            text = self._items.get(key)
+            if text is not None:
+                self._items.move_to_end(key)
+        if text is None:
+            text = self._redis_get(key)
+            if text is not None:
+                with self._lock:
+                    self._store(self._items, key, text)
+        counter = 'hits'
+        if text is None and self.perceptual and image_hash is not None:
+            with self._lock:
+                text = self._nearest(image_hash)
+            counter = 'hits_perceptual'
+        with self._lock:
+            self.counters[counter if text is not None else 'misses'] += 1
+        return text
+
+    def put(self, key, text, image_hash=None):
+        with self._lock:
+            self._store(self._items, key, text)
+            if self.perceptual and image_hash is not None:
+                self._store(self._similar, image_hash, text)
+        self._redis_call(lambda redis: redis.set(REDIS_KEY.format(key), text, ex=settings.OCR_CACHE_TTL))
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats['items'] = len(self._items)
+        return stats
+
+    def _store(self, items, key, text):
+        items[key] = text
+        items.move_to_end(key)
+        while len(items) > self.max_items:
+            items.popitem(last=False)
+
+    def _nearest(self, image_hash):
+        best, best_distance = None, self.max_distance + 1
+        for candidate, text in self._similar.items():
+            distance = (candidate ^ image_hash).bit_count()
+            if distance < best_distance:
+                best, best_distance = text, distance
+        return best
+
+    def _redis_get(self, key):
+        value = self._redis_call(lambda redis: redis.get(REDIS_KEY.format(key)))
+        return value.decode('utf-8') if isinstance(value, bytes) else value
+
+    def _redis_call(self, fn):
+        if time.monotonic() < self._redis_down_until:
+            return None
+        try:
+            return fn(registry.get_redis())
+        except Exception as e:
+            print(f"ocr cache: Redis unavailable, using the local cache only: {e}")
+            self._redis_down_until = time.monotonic() + REDIS_RETRY_SECONDS
+            return None
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_ocr_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = OcrCache(settings.OCR_CACHE_ITEMS, settings.OCR_PERCEPTUAL_MATCH, settings.OCR_HASH_DISTANCE)
+    return _cache
+
+
+# --- OCR ---
+def ocr_images(images):
+    """
+    Text of each image (encoded bytes), in order, or the ImageDecodeError or
+    OcrError that image failed with. Cached images skip Vision.
+    """
+    cache = get_ocr_cache()
+    results, pending = [None] * len(images), OrderedDict()  # content key -> (indices, perceptual hash, preprocessed image)
+    for i, data in enumerate(images):
+        try:
+            gray = decode_gray(data)
+            key = content_key(gray)
+            if key in pending:
+                pending[key][0].append(i)
+                continue
+            image_hash = perceptual_hash(gray) if cache.perceptual else None
+            results[i] = cache.get(key, image_hash)
+            if results[i] is None:
+                pending[key] = ([i], image_hash, preprocess(gray))
+        except ImageDecodeError as e:
+            results[i] = e
+    pending = list(pending.items())
+    batch_size = min(settings.OCR_BATCH_SIZE, VISION_MAX_BATCH)
+    for start in range(0, len(pending), batch_size):
+        batch = pending[start:start + batch_size]
+        for (key, (indices, image_hash, _)), text in zip(batch, _annotate([content for _, (_, _, content) in batch])):
+            for i in indices:
+                results[i] = text
+            if not isinstance(text, OcrError):
+                cache.put(key, text, image_hash)
+    return results
+
+
+def ocr_image(data):
+    result = ocr_images([data])[0]
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+
+def _annotate(contents):
+    """One batch_annotate_images request; an OcrError for images Vision reported an error for."""
+    from google.cloud import vision
+    feature = vision.Feature(type_=vision.Feature.Type.TEXT_DETECTION)
+    requests = [vision.AnnotateImageRequest(image=vision.Image(content=c), features=[feature]) for c in contents]
+    with metrics.timed('vision', 'batch_annotate'):
+        response = registry.get_vision_client().batch_annotate_images(requests=requests)
+    texts = []
+    for item in response.responses:
+        if item.error.message:
+            texts.append(OcrError(f"Vision error: {item.error.message}"))
+        else:
+            texts.append(item.text_annotations[0].description if item.text_annotations else "")
+    return texts
@@ -0,0 +1,195 @@
+"""
+Token-budgeted prompt packing.
+
+Tokens are counted locally: with the model's tokenizer when PROMPT_TOKENIZER
+names one (loaded through the registry), otherwise with a word-piece estimate
+that errs on the high side.
+
+- Retrieved chunks are deduplicated, then taken by score until
+  PROMPT_CONTEXT_TOKENS are used. Duplicates are repeated text, chunks
+  contained in one already taken, and the overlap that neighbouring chunks of
+  a document share (only the new part of the second one is kept).
+- History keeps the most recent turns verbatim up to PROMPT_HISTORY_TOKENS.
+  For a chat session the turns are read from its message store, at most the
+  last CHAT_HISTORY_TURNS not yet summarized. Older turns are represented by
+  the session's rolling summary (ChatSession.summary, covering messages up to
+  `summarized_through`), which the summarize_session task extends in the
+  background once PROMPT_SUMMARY_BATCH turns have aged out of the verbatim
+  window.
+
+So a prompt holds at most the template, the question, PROMPT_CONTEXT_TOKENS of
+context, PROMPT_HISTORY_TOKENS of recent turns and a summary of about
+PROMPT_SUMMARY_TOKENS, however long the conversation.
+"""
+import re
+from ..config import settings
+from ..database import SessionLocal
+from .. import crud
+from . import registry
+
+_PIECE = re.compile(r'\w+|[^\w\s]')
+_WORD = re.compile(r'\S+')
+WORD_PIECE_CHARS = 6  # an estimated token per this many characters of a long word
+CHUNK_HEADER_TOKENS = 8  # "[Chunk n] " and the separator
+
+
+# --- Token counting ---
+def estimate_tokens(text):
+    """BPE-like token estimate: one per punctuation mark, one or more per word by length."""
+    return sum(1 + (len(piece) - 1) // WORD_PIECE_CHARS for piece in _PIECE.findall(text))
+
+
+def count_tokens(text):
+    return registry.get_token_counter()(text) if text else 0
+
+
+def truncate_to_tokens(text, budget):
+    """`text` cut at a word boundary to at most `budget` tokens."""
+    if count_tokens(text) <= budget:
+        return text
+    words = list(_WORD.finditer(text))
+    low, high = 0, len(words)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count_tokens(text[:words[middle - 1].end()]) + 1 <= budget:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:words[low - 1].end()] + " …" if low else ""
+
+
+# --- Context ---
+def _overlap(before, after, max_words):
+    """Number of leading words of `after` that repeat the end of `before` (chunk overlap)."""
+    tail = before.split()[-max_words:]
+    head = after.split(None, max_words)[:max_words]
+    for size in range(min(len(tail), len(head)), 0, -1):
+        if tail[-size:] == head[:size]:
+            return size
+    return 0
+
+
+def _drop_words(text, count, from_end=False):
+    if not count:
+        return text
+    spans = list(_WORD.finditer(text))
+    return (text[:spans[-count].start()] if from_end else text[spans[count - 1].end():]).strip()
+
+
+def pack_chunks(chunks, budget=None):
+    """
+    (chunks to put in the prompt, their tokens): deduplicated and taken by
+    descending score while they fit in `budget`. A chunk that does not fit is
+    skipped, so a shorter lower-scored one can still use the remaining space.
+    """
+    budget = settings.PROMPT_CONTEXT_TOKENS if budget is None else budget
+    overlap_words = 2 * settings.CHUNK_OVERLAP_TOKENS
+    packed, taken, used = [], [], 0
+    for chunk in sorted(chunks, key=lambda c: c.get('score') or 0.0, reverse=True):
+        text = chunk['text']
+        for other in packed:
+            if other['document_id'] != chunk['document_id']:
+                continue
+            if other['chunk_index'] == chunk['chunk_index'] - 1:
+                text = _drop_words(text, _overlap(other['text'], text, overlap_words))
+            elif other['chunk_index'] == chunk['chunk_index'] + 1:
+                # The following chunk is already in: drop this one's tail instead
+                text = _drop_words(text, _overlap(text, other['text'], overlap_words), from_end=True)
+        normalized = " ".join(text.split())
+        if not normalized or any(normalized in seen for seen in taken):
+            continue
+        tokens = count_tokens(text) + CHUNK_HEADER_TOKENS
+        if used + tokens > budget:
+            continue
+        packed.append({**chunk, 'text': text})
+        # Compare later chunks with the full text too, so a copy of a trimmed chunk is still a duplicate
+        taken.extend({normalized, " ".join(chunk['text'].split())})
+        used += tokens
+    return packed, used
+
+
+# --- History ---
+def _turn_line(message):
+    prefix = "User:" if message['role'] == 'user' else "AI:"
+    return f"{prefix} {truncate_to_tokens(message['content'], settings.PROMPT_MAX_TURN_TOKENS)}"
+
+
+def pack_history(history, summary=None, budget=None):
+    """
+    (history text, its tokens, first verbatim turn). The text is the summary
+    of the turns before `history` followed by the most recent turns that fit
+    in `budget`; earlier turns of `history` are in neither until the summary
+    catches up.
+    """
+    budget = settings.PROMPT_HISTORY_TOKENS if budget is None else budget
+    lines, used, first = [], 0, len(history)
+    for index in range(len(history) - 1, -1, -1):
+        line = _turn_line(history[index])
+        tokens = count_tokens(line) + 1
+        if used + tokens > budget:
+            break
+        lines.append(line)
+        used += tokens
+        first = index
+    lines.reverse()
+    if summary:
+        lines.insert(0, f"Summary of earlier conversation: {summary}")
+        used += count_tokens(lines[0]) + 1
+    return "\n".join(lines), used, first
+
+
+# --- Session history ---
+def load_session_history(session_id):
+    """
+    (summary, summarized_through, turns, truncated) of a chat session. `turns`
+    are its last CHAT_HISTORY_TURNS messages after the summarized ones, as
+    {'id', 'role', 'content'} dicts; `truncated` is whether older unsummarized
+    messages were left out.
+    """
+    db = SessionLocal()
+    try:
+        session = crud.get_chat_session(db, session_id)
+        if not session:
+            return None, 0, [], False
+        summarized_through = session.summarized_through or 0
+        messages = crud.get_recent_messages(db, session_id, settings.CHAT_HISTORY_TURNS + 1, after_id=summarized_through)
+    finally:
+        db.close()
+    truncated = len(messages) > settings.CHAT_HISTORY_TURNS
+    turns = [
+        {'id': m.id, 'role': 'user' if m.sender == 'user' else 'assistant', 'content': m.text}
+        for m in messages[-settings.CHAT_HISTORY_TURNS:]
+    ]
+    return session.summary, summarized_through, turns, truncated
+
+
+def record_turn(session_id, question, answer, language='en'):
+    """Append a question and its answer to a session's message store."""
+    db = SessionLocal()
+    try:
+        crud.append_messages(db, session_id, [
+            {'sender': 'user', 'text': question, 'language': language},
+            {'sender': 'ai', 'text': answer, 'language': language},
+        ])
+    except Exception as e:
+        print(f"prompt: could not store turn of session {session_id}: {e}")
+    finally:
+        db.close()
+
+
+def extend_summary(session_id, turns, summarized_through, first_verbatim, truncated=False):
+    """
+    Queue summarization of the messages that left the verbatim window, once
+    PROMPT_SUMMARY_BATCH have or older ones were not even loaded.
+    """
+    if not session_id or not turns or (first_verbatim < settings.PROMPT_SUMMARY_BATCH and not truncated):
+        return
+    through_id = turns[first_verbatim]['id'] - 1 if first_verbatim < len(turns) else turns[-1]['id']
+    if through_id <= summarized_through:
+        return
+    from ..tasks import summarize_session
+    try:
+        summarize_session.delay(session_id, summarized_through, through_id)
+    except Exception as e:
+        # The messages stay unsummarized and are queued again on the next turn
+        print(f"prompt: could not queue summary of session {session_id}: {e}")
@@ -1,20 +1,26 @@
 import os
+import re
+import json
+import asyncio
 from . import embeddings
-import pinecone
-import requests
+from . import http
+from . import registry
+from . import answer_cache
+from . import chunk_store
+from . import deletion
+from . import metrics
+from . import prompt_packer
 from typing import List, Dict, Any, Generator
+from concurrent.futures import ThreadPoolExecutor
 from ..config import settings
-from groq import Groq
 
 groq_api_key = settings.GROQ_API_KEY
-client = Groq()
 
 GROQ_API_KEY = settings.GROQ_API_KEY
 GROQ_LLAMA_API_KEY = settings.GROQ_LLAMA_API_KEY
-GROQ_LLM_URL = 'https://api.groq.com/openai/v1/chat/completions'  # Example endpoint
+GROQ_LLM_URL = f'{settings.GROQ_BASE_URL}/openai/v1/chat/completions'  # Example endpoint
 LLM_MODEL = 'qwen/qwen3-32b'
-
-index = embeddings.index
+FOLLOWUPS_KEY = "autorag:followups:{}"
 
 DEFAULT_PROMPT_TEMPLATE = (
     "You are an expert assistant. Use the provided document chunks and chat history to answer the user's question. "
@@ -24,65 +30,145 @@ DEFAULT_PROMPT_TEMPLATE = (
     "Question: {question}\n\nAnswer:"
 )
 
-# --- Chat History Management ---
-def build_history(messages: List[Dict[str, Any]], max_turns: int = 50) -> str:
-    # messages: [{"role": "user"|"ai", "content": ...}]
-    history = []
-    for msg in messages[-max_turns:]:
-        prefix = "User:" if msg['role'] == 'user' else "AI:"
-        history.append(f"{prefix} {msg['content']}")
-    return "\n".join(history)
-
 # --- Retrieval ---
-def retrieve_relevant_chunks(query, project_id, top_k=5):
-    query_emb = embeddings.embed_texts([query])[0]
-    results = index.query(vector=query_emb, top_k=top_k, include_metadata=True, filter={"project_id": project_id})
+def retrieve_relevant_chunks(query, project_id, top_k=5, query_emb=None):
+    if query_emb is None:
+        query_emb = embeddings.embed_texts([query])[0]
+    results = embeddings.query_vectors(query_emb, top_k=top_k, filter={"project_id": project_id}, include_metadata=False)
+    return _chunks_from_matches(results, project_id)
+
+def _chunks_from_matches(results, project_id):
+    """Hydrate vector-store matches (ids and scores only) with chunk text from the database."""
+    matches = results['matches']
+    if not matches:
+        return []
+    # Documents being deleted keep their vectors until the deletion job reaches them
+    whole_project, deleting = deletion.excluded_documents(project_id)
+    if whole_project:
+        return []
+    records = chunk_store.get_chunk_store().get_chunks([match['id'] for match in matches])
     chunks = []
-    for match in results['matches']:
+    for match in matches:
+        record = records.get(match['id'])
+        if record is None or record['document_id'] in deleting:
+            # Chunk deleted (or not committed yet) since the vector was written
+            continue
         chunks.append({
-            'text': match['metadata'].get('text', ''),
-            'chunk_index': match['metadata'].get('chunk_index', -1),
-            'document_id': match['metadata'].get('document_id'),
+            'text': record['text'],
+            'chunk_index': record['chunk_index'],
+            'document_id': record['document_id'],
             'score': match['score'],
         })
     return chunks
 
 # --- Prompt Assembly ---
-def assemble_prompt(chunks, question, history, prompt_template=DEFAULT_PROMPT_TEMPLATE, language=None):
+def assemble_prompt(chunks, question, history, prompt_template=DEFAULT_PROMPT_TEMPLATE, language=None, summary=None):
+    """
+    Build the prompt with context and history packed into their token budgets
+    (see prompt_packer.py). Returns (prompt, chunks used, first verbatim history
+    turn); sources must come from the chunks used.
+    """
+    chunks, context_tokens = prompt_packer.pack_chunks(chunks)
     context = "\n\n".join(f"[Chunk {c['chunk_index']}] {c['text']}" for c in chunks)
-    history_str = build_history(history)
+    history_str, history_tokens, first_verbatim = prompt_packer.pack_history(history, summary)
+    metrics.PROMPT_TOKENS.labels('context').observe(context_tokens)
+    metrics.PROMPT_TOKENS.labels('history').observe(history_tokens)
     lang_instruction = f"Please answer in {language}.\n" if language else ""
-    return lang_instruction + prompt_template.format(context=context, question=question, history=history_str)
+    prompt = lang_instruction + prompt_template.format(context=context, question=question, history=history_str)
+    metrics.PROMPT_TOKENS.labels('total').observe(prompt_packer.count_tokens(prompt))
+    return prompt, chunks, first_verbatim
 
-# --- LLM Call ---
-def call_llm(prompt, model="qwen/qwen3-32b"):
-    chat_completion = client.chat.completions.create(
-        messages=[
-            {"role": "user", "content": prompt}
-        ],
-        model=model,
-        stream=False,
+def summarize_turns(summary, turns, model=None):
+    """Extend a conversation's rolling summary with `turns` ({'role', 'content'} dicts)."""
+    model = model or LLM_MODEL
+    transcript = "\n".join(f"{'User' if t['role'] == 'user' else 'AI'}: {t['content']}" for t in turns)
+    words = int(settings.PROMPT_SUMMARY_TOKENS * 0.7)
+    prompt = (
+        f"Update the running summary of a conversation between a user and an AI assistant with the new turns below. "
+        f"Keep facts, names, numbers, decisions and open questions the user may refer back to; drop pleasantries. "
+        f"Reply with the updated summary only, in at most {words} words.\n\n"
+        f"Current summary:\n{summary or '(none)'}\n\nNew turns:\n{transcript}\n\nUpdated summary:"
     )
+    data = {
+        'model': model,
+        'messages': [{'role': 'user', 'content': prompt}],
+        'temperature': 0.2,
+        'max_tokens': settings.PROMPT_SUMMARY_TOKENS * 2,
+    }
+    with metrics.timed('groq', 'summary'):
+        response = registry.get_http_session().post(GROQ_LLM_URL, headers=_groq_headers(model), json=data, timeout=60)
+        response.raise_for_status()
+    text = response.json()['choices'][0]['message']['content']
+    # Reasoning models may prepend their thinking
+    return re.sub(r'<think>.*?</think>', '', text, flags=re.S).strip()
+
+# --- LLM Call ---
+def call_llm(prompt, model="qwen/qwen3-32b", stream=False):
+    """
+    Return the completion text, or with stream=True a generator of text deltas
+    as Groq produces them.
+    """
+    # A streamed call returns once the response starts, so its time is time to first token
+    with metrics.timed('groq', 'chat_stream_first_token' if stream else 'chat'):
+        chat_completion = registry.get_groq_client().chat.completions.create(
+            messages=[
+                {"role": "user", "content": prompt}
+            ],
+            model=model,
+            stream=stream,
+        )
+    if stream:
+        return _iter_deltas(chat_completion)
     return chat_completion.choices[0].message.content
 
+def _iter_deltas(chat_stream):
+    for chunk in chat_stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
 # --- Follow-up Suggestions ---
-def suggest_followups(answer: str, question: str, language='en', model=None) -> List[str]:
-    # Use LLM to generate follow-up questions
-    prompt = (
-        f"Given the answer to the user's question, suggest 3 relevant follow-up questions.\n"
-        f"Question: {question}\nAnswer: {answer}\nSuggestions:"
-    )
-    model = model or LLM_MODEL
+FOLLOWUP_MODES = ('concurrent', 'deferred', 'sequential')
+
+_followup_executor = ThreadPoolExecutor(max_workers=settings.FOLLOWUP_MAX_WORKERS)
+
+def suggest_followups(answer: str, question: str, language='en', model=None, context: str = None) -> List[str]:
+    """
+    Use the LLM to suggest follow-up questions. Without an answer (when running
+    alongside answer generation) the suggestions are based on the retrieved context.
+    """
+    prompt = _followup_prompt(answer, question, context)
+    headers, data = _followup_request(prompt, model)
+    with metrics.timed('groq', 'followups'):
+        response = registry.get_http_session().post(GROQ_LLM_URL, headers=headers, json=data, timeout=60)
+        response.raise_for_status()
+    return _parse_followups(response.json())
+
+def _groq_api_key(model):
     if model.startswith('llama'):
-        api_key = GROQ_LLAMA_API_KEY
+        return GROQ_LLAMA_API_KEY
     elif model.startswith('qwen'):
-        api_key = GROQ_API_KEY
-    else:
-        api_key = GROQ_LLAMA_API_KEY
-    headers = {
-        'Authorization': f'Bearer {api_key}',
+        return GROQ_API_KEY
+    return GROQ_LLAMA_API_KEY
+
+def _groq_headers(model):
+    return {
+        'Authorization': f'Bearer {_groq_api_key(model)}',
         'Content-Type': 'application/json',
     }
+
+def _followup_prompt(answer, question, context=None):
+    if answer is None:
+        return (
+            f"Given the user's question and the document excerpts retrieved for it, suggest 3 relevant follow-up questions.\n"
+            f"Question: {question}\nExcerpts: {(context or '')[:4000]}\nSuggestions:"
+        )
+    return (
+        f"Given the answer to the user's question, suggest 3 relevant follow-up questions.\n"
+        f"Question: {question}\nAnswer: {answer}\nSuggestions:"
+    )
+
+def _followup_request(prompt, model=None):
+    model = model or LLM_MODEL
     data = {
         'model': model,
         'messages': [
@@ -92,37 +178,296 @@ def suggest_followups(answer: str, question: str, language='en', model=None) ->
         'temperature': 0.5,
         'max_tokens': 128,
     }
-    response = requests.post(GROQ_LLM_URL, headers=headers, json=data)
-    response.raise_for_status()
-    result = response.json()
+    return _groq_headers(model), data
+
+def _parse_followups(result) -> List[str]:
     suggestions = result['choices'][0]['message']['content'].split('\n')
     return [s.strip('- ').strip() for s in suggestions if s.strip()]
 
+def start_followups(chunks, question, language='en'):
+    """Start generating follow-ups in the background, alongside answer generation."""
+    return _followup_executor.submit(suggest_followups, None, question, language, "qwen/qwen3-32b", _followup_context(chunks))
+
+def _followup_context(chunks):
+    return "\n\n".join(c['text'] for c in chunks)
+
+def collect_followups(future) -> List[str]:
+    # Follow-ups are a nice-to-have; never fail the answer because of them
+    try:
+        return future.result()
+    except Exception:
+        import traceback
+        print(traceback.format_exc())
+        return []
+
+def defer_followups(answer, question, language='en') -> str:
+    """Queue follow-up generation and return a handle for GET /api/chat/followups/{followups_id}."""
+    from ..tasks import suggest_followups_task
+    followups_id = suggest_followups_task.delay(answer, question, language).id
+    # Celery reports unknown task ids as pending; the key tells issued ids from the rest
+    registry.get_redis().set(FOLLOWUPS_KEY.format(followups_id), 1, ex=settings.FOLLOWUPS_TTL)
+    return followups_id
+
+def followups_issued(followups_id) -> bool:
+    """Whether `followups_id` came from defer_followups within the last FOLLOWUPS_TTL seconds."""
+    return bool(registry.get_redis().exists(FOLLOWUPS_KEY.format(followups_id)))
+
 # --- Main RAG Chat ---
 def rag_chat(
     project_id,
     question,
     prompt_template=DEFAULT_PROMPT_TEMPLATE,
     language='en',
-    top_k=5,
+    top_k=None,
     history: List[Dict[str, Any]] = None,
     stream: bool = False,
-    model: str = None
+    model: str = None,
+    followups_mode: str = 'concurrent',
+    session_id: int = None
 ):
+    """
+    followups_mode: 'concurrent' generates follow-ups while the answer is being
+    generated, 'deferred' returns a `followups_id` to fetch them later, and
+    'sequential' generates them from the finished answer.
+
+    Answers to first-turn questions are served from the answer cache when
+    possible; `cache` in the result (or the 'done' event) reports the hit.
+
+    With a `session_id`, `history` is ignored: the recent turns are read from
+    the session's message store and older ones are replaced by its rolling
+    summary, which is extended in the background. The caller records the new
+    turn (prompt_packer.record_turn).
+    """
+    summary, summarized_through, truncated = None, 0, False
+    if session_id:
+        summary, summarized_through, history, truncated = prompt_packer.load_session_history(session_id)
     history = history or []
-    chunks = retrieve_relevant_chunks(question, project_id, top_k=top_k)
-    prompt = assemble_prompt(chunks, question, history, prompt_template, language)
+    cache, cache_key = _answer_cache_key(project_id, prompt_template, language, question, history)
+    cached = cache.get(cache_key) if cache_key else None
+    if cached is not None:
+        return _replay_cached(cached) if stream else _cached_result(cached, history)
+    query_emb = embeddings.embed_texts([question])[0]
+    cached = _similar_cached(cache, cache_key, query_emb)
+    if cached is not None:
+        return _replay_cached(cached) if stream else _cached_result(cached, history)
+    chunks = retrieve_relevant_chunks(question, project_id, top_k=top_k or settings.PROMPT_CANDIDATES, query_emb=query_emb)
+    prompt, chunks, first_verbatim = assemble_prompt(chunks, question, history, prompt_template, language, summary)
+    prompt_packer.extend_summary(session_id, history, summarized_through, first_verbatim, truncated)
+    if stream:
+        events = stream_rag_chat(chunks, prompt, question, language, followups_mode)
+        return _cache_stream(events, cache, cache_key, query_emb, prompt, chunks) if cache_key else events
+    followups_future = start_followups(chunks, question, language) if followups_mode == 'concurrent' else None
     # Always use Qwen model
     answer = call_llm(prompt, model="qwen/qwen3-32b")
+    result = _chat_result(answer, prompt, chunks, history)
+    if followups_future is not None:
+        result['followups'] = collect_followups(followups_future)
+    elif followups_mode == 'deferred':
+        result['followups_id'] = defer_followups(answer, question, language)
+    else:
+        result['followups'] = suggest_followups(answer, question, language, model="qwen/qwen3-32b")
+    if cache_key:
+        cache.put(cache_key, result, query_emb)
+    return result
+
+def _chat_result(answer, prompt, chunks, history):
     raw_model_response = None  # or set to something meaningful if needed
     sources = [c['chunk_index'] for c in chunks]
-    followups = suggest_followups(answer, question, language, model="qwen/qwen3-32b")
     return {
         'answer': answer,
         'sources': sources,
         'raw_model_response': raw_model_response,
         'prompt': prompt,
         'chunks': chunks,
-        'followups': followups,
+        'followups': [],
         'history': history[-50:],
-    } 
\ No newline at end of file
+        'prompt_tokens': prompt_packer.count_tokens(prompt),
+        'cache': {'hit': False},
+    }
+
+# --- Answer Cache ---
+def _answer_cache_key(project_id, prompt_template, language, question, history):
+    # An answer that depends on earlier turns is not reusable in another conversation
+    cache = answer_cache.get_answer_cache()
+    if cache is None or history:
+        return None, None
+    return cache, cache.make_key(project_id, prompt_template, language, question)
+
+def _similar_cached(cache, cache_key, query_emb):
+    if not cache_key:
+        return None
+    cached = cache.get_similar(cache_key, query_emb) if settings.ANSWER_CACHE_SEMANTIC else None
+    if cached is None:
+        cache.record_miss()
+    return cached
+
+def _cached_result(cached, history):
+    cached['history'] = history[-50:]
+    return cached
+
+def _replay_cached(cached):
+    """Stream a cached answer with the same events as a generated one."""
+    yield 'sources', {'sources': cached['sources'], 'chunks': cached['chunks']}
+    yield 'token', {'delta': cached['answer']}
+    yield 'done', {'answer': cached['answer'], 'followups': cached.get('followups', []), 'cache': cached['cache']}
+
+def _cache_stream(events, cache, cache_key, query_emb, prompt, chunks):
+    for event, data in events:
+        if event == 'done':
+            _store_streamed(cache, cache_key, query_emb, prompt, chunks, data)
+        yield event, data
+
+def _store_streamed(cache, cache_key, query_emb, prompt, chunks, done):
+    result = _chat_result(done['answer'], prompt, chunks, [])
+    result['followups'] = done.get('followups', [])
+    cache.put(cache_key, result, query_emb)
+
+def stream_rag_chat(chunks, prompt, question, language='en', followups_mode='concurrent'):
+    """
+    Generate (event, data) pairs for a streamed chat answer: 'sources' first,
+    then one 'token' per answer delta, then 'done' with the full answer and
+    follow-ups (or a `followups_id` in deferred mode).
+    """
+    followups_future = start_followups(chunks, question, language) if followups_mode == 'concurrent' else None
+    yield 'sources', {'sources': [c['chunk_index'] for c in chunks], 'chunks': chunks}
+    parts = []
+    for delta in call_llm(prompt, model="qwen/qwen3-32b", stream=True):
+        parts.append(delta)
+        yield 'token', {'delta': delta}
+    answer = "".join(parts)
+    done = {'answer': answer, 'followups': [], 'cache': {'hit': False}}
+    if followups_future is not None:
+        done['followups'] = collect_followups(followups_future)
+    elif followups_mode == 'deferred':
+        done['followups_id'] = defer_followups(answer, question, language)
+    else:
+        done['followups'] = suggest_followups(answer, question, language, model="qwen/qwen3-32b")
+    yield 'done', done
+
+# --- Async path ---
+# Same flow as above on the pooled async HTTP client (services/http.py), so a
+# chat in flight holds no worker thread while it waits on Jina, the vector store or Groq.
+async def aretrieve_relevant_chunks(query, project_id, top_k=5, query_emb=None):
+    if query_emb is None:
+        query_emb = (await embeddings.aembed_texts([query]))[0]
+    results = await embeddings.aquery_vectors(query_emb, top_k=top_k, filter={"project_id": project_id}, include_metadata=False)
+    # One indexed IN (...) lookup, or none at all when every id is in the chunk cache
+    return await asyncio.to_thread(_chunks_from_matches, results, project_id)
+
+async def acall_llm(prompt, model="qwen/qwen3-32b", stream=False):
+    """Async call_llm: the completion text, or with stream=True an async generator of deltas."""
+    data = {'model': model, 'messages': [{'role': 'user', 'content': prompt}], 'stream': stream}
+    if stream:
+        return metrics.time_to_first('groq', 'chat_stream_first_token', _aiter_deltas(data))
+    with metrics.timed('groq', 'chat'):
+        response = await http.post(GROQ_LLM_URL, headers=_groq_headers(model), json=data)
+        response.raise_for_status()
+    return response.json()['choices'][0]['message']['content']
+
+async def _aiter_deltas(data):
+    async for line in http.stream_lines('POST', GROQ_LLM_URL, headers=_groq_headers(data['model']), json=data):
+        if not line.startswith('data:'):
+            continue
+        payload = line[len('data:'):].strip()
+        if payload == '[DONE]':
+            break
+        choices = json.loads(payload).get('choices') or []
+        delta = choices[0].get('delta', {}).get('content') if choices else None
+        if delta:
+            yield delta
+
+async def asuggest_followups(answer: str, question: str, language='en', model=None, context: str = None) -> List[str]:
+    headers, data = _followup_request(_followup_prompt(answer, question, context), model)
+    with metrics.timed('groq', 'followups'):
+        response = await http.post(GROQ_LLM_URL, headers=headers, json=data)
+        response.raise_for_status()
+    return _parse_followups(response.json())
+
+async def _acollect_followups(chunks, question, language):
+    try:
+        return await asuggest_followups(None, question, language, "qwen/qwen3-32b", _followup_context(chunks))
+    except Exception:
+        import traceback
+        print(traceback.format_exc())
+        return []
+
+async def _afinish_followups(followups_task, followups_mode, answer, question, language):
+    if followups_task is not None:
+        return {'followups': await followups_task}
+    if followups_mode == 'deferred':
+        return {'followups': [], 'followups_id': await asyncio.to_thread(defer_followups, answer, question, language)}
+    return {'followups': await asuggest_followups(answer, question, language, model="qwen/qwen3-32b")}
+
+async def arag_chat(
+    project_id,
+    question,
+    prompt_template=DEFAULT_PROMPT_TEMPLATE,
+    language='en',
+    top_k=None,
+    history: List[Dict[str, Any]] = None,
+    stream: bool = False,
+    model: str = None,
+    followups_mode: str = 'concurrent',
+    session_id: int = None
+):
+    """Async rag_chat; with stream=True returns an async generator of (event, data) pairs."""
+    summary, summarized_through, truncated = None, 0, False
+    if session_id:
+        summary, summarized_through, history, truncated = await asyncio.to_thread(prompt_packer.load_session_history, session_id)
+    history = history or []
+    # make_key reads the project's generation from Redis
+    cache, cache_key = await asyncio.to_thread(_answer_cache_key, project_id, prompt_template, language, question, history)
+    cached = cache.get(cache_key) if cache_key else None
+    if cached is None:
+        query_emb = (await embeddings.aembed_texts([question]))[0]
+        cached = _similar_cached(cache, cache_key, query_emb)
+    if cached is not None:
+        return _areplay_cached(cached) if stream else _cached_result(cached, history)
+    chunks = await aretrieve_relevant_chunks(question, project_id, top_k=top_k or settings.PROMPT_CANDIDATES, query_emb=query_emb)
+    prompt, chunks, first_verbatim = assemble_prompt(chunks, question, history, prompt_template, language, summary)
+    await asyncio.to_thread(prompt_packer.extend_summary, session_id, history, summarized_through, first_verbatim, truncated)
+    if stream:
+        events = astream_rag_chat(chunks, prompt, question, language, followups_mode)
+        return _acache_stream(events, cache, cache_key, query_emb, prompt, chunks) if cache_key else events
+    followups_task = asyncio.create_task(_acollect_followups(chunks, question, language)) if followups_mode == 'concurrent' else None
+    try:
+        answer = await acall_llm(prompt, model="qwen/qwen3-32b")
+    except BaseException:
+        if followups_task is not None:
+            followups_task.cancel()
+        raise
+    result = _chat_result(answer, prompt, chunks, history)
+    result.update(await _afinish_followups(followups_task, followups_mode, answer, question, language))
+    if cache_key:
+        cache.put(cache_key, result, query_emb)
+    return result
+
+async def _areplay_cached(cached):
+    for event, data in _replay_cached(cached):
+        yield event, data
+
+async def _acache_stream(events, cache, cache_key, query_emb, prompt, chunks):
+    try:
+        async for event, data in events:
+            if event == 'done':
+                _store_streamed(cache, cache_key, query_emb, prompt, chunks, data)
+            yield event, data
+    finally:
+        await events.aclose()
+
+async def astream_rag_chat(chunks, prompt, question, language='en', followups_mode='concurrent'):
+    """Async stream_rag_chat: 'sources', then 'token' deltas, then 'done'."""
+    followups_task = asyncio.create_task(_acollect_followups(chunks, question, language)) if followups_mode == 'concurrent' else None
+    try:
+        yield 'sources', {'sources': [c['chunk_index'] for c in chunks], 'chunks': chunks}
+        parts = []
+        async for delta in await acall_llm(prompt, model="qwen/qwen3-32b", stream=True):
+            parts.append(delta)
+            yield 'token', {'delta': delta}
+        answer = "".join(parts)
+        done = {'answer': answer, 'cache': {'hit': False}}
+        done.update(await _afinish_followups(followups_task, followups_mode, answer, question, language))
+        yield 'done', done
+    finally:
+        if followups_task is not None and not followups_task.done():
+            followups_task.cancel()
@@ -0,0 +1,171 @@
+"""
+Process-wide registry of heavy clients and models.
+
+Each entry (spaCy pipeline, Google Vision and Cloud Storage clients, the Groq
+SDK client, a pooled requests.Session, a Redis client, the prompt tokenizer) is built lazily on
+first use and then shared by every caller in the process. Construction time is recorded so
+`stats()` can show what a cold start costs. Each entry has its own lock, so a slow
+factory only blocks callers waiting for that same entry. Entries are dropped in a forked
+child, since gRPC channels and sockets must not cross a fork; Celery workers
+rebuild them in worker_process_init via `warm()`.
+"""
+import os
+import time
+import threading
+from ..config import settings
+
+_factories = {}
+_instances = {}
+_timings = {}
+_entry_locks = {}  # name -> lock held while that entry is built
+_lock = threading.Lock()  # guards the dicts above, never held while a factory runs
+_pid = os.getpid()
+
+
+def register(name, factory):
+    _factories[name] = factory
+
+
+def get(name):
+    global _pid
+    if _pid != os.getpid():
+        with _lock:
+            if _pid != os.getpid():
+                _instances.clear()
+                _timings.clear()
+                # A lock held by another thread at fork time would never be released here
+                _entry_locks.clear()
+                _pid = os.getpid()
+    instance = _instances.get(name)
+    if instance is None:
+        factory = _factories[name]
+        with _lock:
+            entry_lock = _entry_locks.setdefault(name, threading.Lock())
+        with entry_lock:
+            instance = _instances.get(name)
+            if instance is None:
+                start = time.perf_counter()
+                instance = factory()
+                elapsed = time.perf_counter() - start
+                with _lock:
+                    _timings[name] = elapsed
+                    _instances[name] = instance
+    return instance
+
+
+def warm(names=None):
+    """Build the given entries (default: REGISTRY_WARM) now rather than on first use."""
+    if names is None:
+        names = [n.strip() for n in settings.REGISTRY_WARM.split(",") if n.strip()]
+    for name in names:
+        try:
+            get(name)
+        except Exception as e:
+            # A missing model or credentials must not stop the worker; the first real use will raise
+            print(f"registry: could not warm {name}: {e}")
+
+
+def stats():
+    with _lock:
+        return {
+            name: {
+                "loaded": name in _instances,
+                "construct_ms": round(_timings[name] * 1000, 1) if name in _timings else None,
+            }
+            for name in _factories
+        }
+
+
+# --- Factories ---
+def _google_credentials():
+    if settings.GOOGLE_APPLICATION_CREDENTIALS:
+        os.environ.setdefault("GOOGLE_APPLICATION_CREDENTIALS", settings.GOOGLE_APPLICATION_CREDENTIALS)
+
+
+def _spacy():
+    import spacy
+    disabled = [p.strip() for p in settings.SPACY_DISABLED_PIPES.split(",") if p.strip()]
+    return spacy.load(settings.SPACY_MODEL, disable=disabled)
+
+
+def _vision():
+    _google_credentials()
+    from google.cloud import vision
+    return vision.ImageAnnotatorClient()
+
+
+def _storage():
+    _google_credentials()
+    from google.cloud import storage
+    return storage.Client()
+
+
+def _groq():
+    from groq import Groq
+    return Groq(api_key=settings.GROQ_API_KEY or None, base_url=settings.GROQ_BASE_URL)
+
+
+def _http_session():
+    import requests
+    from requests.adapters import HTTPAdapter
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=20, pool_maxsize=max(10, settings.EMBED_MAX_CONCURRENCY, settings.CRAWL_CONCURRENCY))
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def _token_counter():
+    """Token counting function for prompt budgets: the PROMPT_TOKENIZER tokenizer, or an estimate."""
+    from .prompt_packer import estimate_tokens
+    if not settings.PROMPT_TOKENIZER:
+        return estimate_tokens
+    try:
+        from tokenizers import Tokenizer
+        tokenizer = Tokenizer.from_pretrained(settings.PROMPT_TOKENIZER)
+    except Exception as e:
+        print(f"registry: tokenizer {settings.PROMPT_TOKENIZER} unavailable, estimating tokens: {e}")
+        return estimate_tokens
+    return lambda text: len(tokenizer.encode(text, add_special_tokens=False).ids)
+
+
+def _redis():
+    import redis
+    return redis.Redis.from_url(settings.REDIS_URL, socket_timeout=0.5, socket_connect_timeout=0.5)
+
+
+register("spacy", _spacy)
+register("vision", _vision)
+register("storage", _storage)
+register("groq", _groq)
+register("http_session", _http_session)
+register("redis", _redis)
+register("token_counter", _token_counter)
+
+
+def get_nlp():
+    return get("spacy")
+
+
+def get_vision_client():
+    return get("vision")
+
+
+def get_storage_client():
+    return get("storage")
+
+
+def get_groq_client():
+    return get("groq")
+
+
+def get_http_session():
+    return get("http_session")
+
+
+def get_redis():
+    return get("redis")
+
+
+def get_token_counter():
+    return get("token_counter")
@@ -1,2 +1,170 @@
-# Placeholder for ingestion status tracking
-# Implement status checking for background ingestion tasks here. 
\ No newline at end of file
+"""
+Ingestion progress and per-stage timings.
+
+An IngestionTracker follows one document through ingestion. Stage times and counts
+accumulate in `stats` and are written to Document.ingestion_stats and
+Document.progress with a single UPDATE, at every stage change and at most
+every STATUS_UPDATE_INTERVAL seconds in between, so pollers of
+/ingestion/{document_id}/status see live progress.
+
+Stage times are exclusive: a stage that drives another (chunking pulls pages
+from the PDF extractor) is charged only for its own work. Embedding and
+upserting overlap in a pipeline, so theirs are busy time summed over requests.
+
+Ingestion runs as a chain of Celery tasks; each task resumes the tracker from
+the stored stats, and the time a document waits in a queue between tasks is
+recorded as 'queue_wait'.
+"""
+import copy
+import time
+from datetime import datetime
+from contextlib import contextmanager
+from ..config import settings
+from .. import crud
+
+STAGES = ('read', 'extract', 'chunk', 'ner', 'gcs_upload', 'db_write', 'queue_wait', 'embed', 'upsert')
+# Progress once each stage completes; embedding and upserting fill the rest up to EMBED_DONE as vectors land
+STAGE_PROGRESS = {'read': 0.05, 'extract': 0.25, 'chunk': 0.3, 'ner': 0.4, 'gcs_upload': 0.45, 'db_write': 0.5}
+EMBED_DONE = 0.95
+SIZE_BUCKETS = ((1 << 20, '<1MB'), (10 << 20, '1-10MB'), (100 << 20, '10-100MB'))
+
+
+class IngestionTracker:
+    def __init__(self, db, document, size_bytes=None, resume=False):
+        self.db = db
+        self.document_id = document.id
+        self._charged = 0.0  # seconds already attributed to some stage
+        self._last_save = 0.0
+        if resume and document.ingestion_stats:
+            self.progress = document.progress or 0.0
+            self.stats = copy.deepcopy(document.ingestion_stats)
+            handoff = self.stats.pop('handoff_at', None)
+            if handoff:
+                self.add_time('queue_wait', _seconds_since(handoff))
+        else:
+            self.progress = 0.0
+            self.stats = {
+                'file_type': document.filetype,
+                'size_bytes': size_bytes,
+                'stage': None,
+                'started_at': datetime.utcnow().isoformat(),
+                'finished_at': None,
+                'total_seconds': None,
+                'stages': {},
+                'counts': {},
+            }
+        self.save(force=True)
+
+    @contextmanager
+    def stage(self, name):
+        self.stats['stage'] = name
+        self.save(force=True)
+        start, charged = time.perf_counter(), self._charged
+        try:
+            yield
+        finally:
+            # A failing stage still reports how long it ran
+            nested = self._charged - charged
+            self.add_time(name, time.perf_counter() - start - nested)
+        self.set_progress(STAGE_PROGRESS.get(name, self.progress), force=True)
+
+    def timed_iter(self, name, iterable, count_as=None):
+        """Yield from `iterable`, charging the time spent producing items to stage `name`."""
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_time(name, time.perf_counter() - start)
+                return
+            self.add_time(name, time.perf_counter() - start)
+            if count_as:
+                self.count(count_as)
+            yield item
+
+    def add_time(self, name, seconds):
+        stages = self.stats['stages']
+        stages[name] = round(stages.get(name, 0.0) + seconds, 4)
+        self._charged += seconds
+
+    def count(self, name, value=1):
+        counts = self.stats['counts']
+        counts[name] = counts.get(name, 0) + value
+
+    def set_progress(self, fraction, force=False):
+        self.progress = max(self.progress, min(fraction, 1.0))
+        self.save(force)
+
+    def save(self, force=False, status=None):
+        now = time.monotonic()
+        if not force and now - self._last_save < settings.STATUS_UPDATE_INTERVAL:
+            return
+        self._last_save = now
+        crud.update_document_progress(self.db, self.document_id, round(self.progress, 4), dict(self.stats), status)
+
+    def handoff(self):
+        """Persist before the document is queued for its next task."""
+        self.stats['handoff_at'] = datetime.utcnow().isoformat()
+        self.save(force=True)
+
+    def finish(self, status):
+        self.stats.pop('handoff_at', None)
+        self.stats['stage'] = None
+        self.stats['finished_at'] = datetime.utcnow().isoformat()
+        self.stats['total_seconds'] = round(_seconds_since(self.stats['started_at']), 4)
+        if status == 'ready':
+            self.progress = 1.0
+        self.save(force=True, status=status)
+
+
+def _seconds_since(timestamp):
+    return max((datetime.utcnow() - datetime.fromisoformat(timestamp)).total_seconds(), 0.0)
+
+
+def size_bucket(size_bytes):
+    if size_bytes is None:
+        return 'unknown'
+    for limit, label in SIZE_BUCKETS:
+        if size_bytes < limit:
+            return label
+    return '>=100MB'
+
+
+def _percentile(sorted_values, q):
+    index = min(len(sorted_values) - 1, int(round(q / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def project_ingestion_stats(documents):
+    """
+    Aggregate finished documents' ingestion_stats by (file type, size bucket):
+    document count, p50/p95 total seconds, mean seconds per stage, chunks per
+    second and the stage that dominates.
+    """
+    groups = {}
+    for doc in documents:
+        stats = doc.ingestion_stats
+        if not stats or not stats.get('total_seconds'):
+            continue
+        key = (stats.get('file_type') or doc.filetype, size_bucket(stats.get('size_bytes')))
+        groups.setdefault(key, []).append(stats)
+    report = []
+    for (file_type, bucket), runs in sorted(groups.items()):
+        totals = sorted(r['total_seconds'] for r in runs)
+        stage_means = {
+            stage: round(sum(r['stages'].get(stage, 0.0) for r in runs) / len(runs), 4)
+            for stage in STAGES if any(stage in r['stages'] for r in runs)
+        }
+        chunks = sum(r['counts'].get('chunks', 0) for r in runs)
+        report.append({
+            'file_type': file_type,
+            'size_bucket': bucket,
+            'documents': len(runs),
+            'p50_seconds': _percentile(totals, 50),
+            'p95_seconds': _percentile(totals, 95),
+            'stage_mean_seconds': stage_means,
+            'dominant_stage': max(stage_means, key=stage_means.get) if stage_means else None,
+            'chunks_per_second': round(chunks / sum(totals), 2) if sum(totals) else None,
+        })
+    return report
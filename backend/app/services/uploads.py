@@ -0,0 +1,285 @@
+"""
+Streaming and resumable uploads.
+
+`save_stream` writes an upload to disk in fixed-size pieces, hashing as it
+goes and stopping at a size limit, so API worker memory stays flat whatever
+the file size.
+
+Resumable uploads keep a `<upload_id>.json` descriptor and a `<upload_id>.part`
+file under UPLOAD_PARTIAL_DIR. Clients append bytes at the current offset,
+can ask for the offset after a dropped connection, and complete the upload
+once every declared byte has arrived. Each append is written piece by piece
+as the request body arrives. The running sha256 lives in process memory; if
+the upload was resumed on another worker the hash is recomputed from the part
+file on completion. Sessions untouched for UPLOAD_SESSION_TTL seconds expire:
+their files and hash state are dropped when the next session is created.
+"""
+import os
+import json
+import time
+import uuid
+import hashlib
+import tarfile
+import zipfile
+import threading
+from contextlib import contextmanager
+from ..config import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process development only
+    fcntl = None
+
+BACKEND_DIR = os.path.join(os.path.dirname(__file__), '..', '..')
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class UploadNotFound(Exception):
+    pass
+
+
+class UploadConflict(Exception):
+    """An append did not start at the upload's current offset."""
+
+    def __init__(self, offset):
+        super().__init__(f"upload is at offset {offset}")
+        self.offset = offset
+
+
+def save_stream(read, destination, max_bytes=None):
+    """
+    Copy from `read(n)` (e.g. UploadFile.file.read) to `destination` in
+    UPLOAD_CHUNK_BYTES pieces. Returns (size, sha256); raises UploadTooLarge
+    and removes the partial file once more than `max_bytes` arrive.
+    """
+    max_bytes = max_bytes or settings.MAX_UPLOAD_BYTES
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(destination, 'wb') as out:
+            while True:
+                piece = read(settings.UPLOAD_CHUNK_BYTES)
+                if not piece:
+                    break
+                size += len(piece)
+                if size > max_bytes:
+                    raise UploadTooLarge(f"upload exceeds {max_bytes} bytes")
+                digest.update(piece)
+                out.write(piece)
+    except BaseException:
+        if os.path.exists(destination):
+            os.remove(destination)
+        raise
+    return size, digest.hexdigest()
+
+
+# --- Archives ---
+def iter_archive(path):
+    """
+    Yield (member name, file object) for each regular file in a zip or tar
+    (optionally compressed) archive. Tars are read as a stream, so each file
+    object must be consumed before asking for the next member.
+    """
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or _skip_member(info.filename):
+                    continue
+                with archive.open(info) as member:
+                    yield info.filename, member
+        return
+    with tarfile.open(path, mode='r|*') as archive:
+        for info in archive:
+            if not info.isfile() or _skip_member(info.name):
+                continue
+            yield info.name, archive.extractfile(info)
+
+
+def _skip_member(name):
+    # macOS resource forks and hidden files are never documents
+    parts = name.replace('\\', '/').split('/')
+    return '__MACOSX' in parts or parts[-1].startswith('.')
+
+
+# --- Resumable uploads ---
+_hashers = {}  # upload_id -> (offset, sha256 object, last use) for uploads appended in this process
+_hashers_lock = threading.Lock()
+
+
+def _partial_dir():
+    path = settings.UPLOAD_PARTIAL_DIR
+    path = path if os.path.isabs(path) else os.path.join(BACKEND_DIR, path)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _paths(upload_id):
+    upload_id = uuid.UUID(upload_id).hex  # rejects anything that is not an id we issued
+    base = os.path.join(_partial_dir(), upload_id)
+    return base + '.json', base + '.part'
+
+
+@contextmanager
+def _locked(upload_id):
+    """Serialize appends to one upload across threads and worker processes."""
+    info_path, _ = _paths(upload_id)
+    if not os.path.exists(info_path):
+        raise UploadNotFound(upload_id)
+    if fcntl is None:
+        yield
+        return
+    with open(info_path) as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def create_session(project_id, filename, size, content_type=None):
+    if size > settings.MAX_RESUMABLE_UPLOAD_BYTES:
+        raise UploadTooLarge(f"upload exceeds {settings.MAX_RESUMABLE_UPLOAD_BYTES} bytes")
+    expire_sessions()
+    upload_id = uuid.uuid4().hex
+    info_path, part_path = _paths(upload_id)
+    info = {
+        'upload_id': upload_id,
+        'project_id': project_id,
+        'filename': os.path.basename(filename),
+        'content_type': content_type or 'application/octet-stream',
+        'size': size,
+    }
+    with open(info_path, 'w') as f:
+        json.dump(info, f)
+    open(part_path, 'wb').close()
+    with _hashers_lock:
+        _hashers[upload_id] = (0, hashlib.sha256(), time.monotonic())
+    return session_status(upload_id)
+
+
+def expire_sessions():
+    """Drop uploads untouched for UPLOAD_SESSION_TTL seconds: their hash state and files."""
+    cutoff = time.monotonic() - settings.UPLOAD_SESSION_TTL
+    with _hashers_lock:
+        for upload_id in [i for i, (_, _, used) in _hashers.items() if used < cutoff]:
+            del _hashers[upload_id]
+    stale = time.time() - settings.UPLOAD_SESSION_TTL
+    for name in os.listdir(_partial_dir()):
+        upload_id, ext = os.path.splitext(name)
+        if ext != '.json':
+            continue
+        # The part file's mtime moves with every append; the descriptor's only at creation
+        touched = max((os.path.getmtime(p) for p in _paths(upload_id) if os.path.exists(p)), default=None)
+        if touched is not None and touched < stale:
+            abort(upload_id)
+
+
+def get_session(upload_id):
+    """The upload's descriptor plus its current offset, or None if unknown."""
+    info_path, part_path = _paths(upload_id)
+    if not os.path.exists(info_path):
+        return None
+    with open(info_path) as f:
+        info = json.load(f)
+    info['offset'] = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    return info
+
+
+def session_status(upload_id):
+    info = get_session(upload_id)
+    if info is None:
+        return None
+    return {
+        'upload_id': info['upload_id'],
+        'offset': info['offset'],
+        'size': info['size'],
+        'chunk_size': settings.UPLOAD_CHUNK_BYTES,
+        'complete': info['offset'] == info['size'],
+    }
+
+
+def append(upload_id, offset, pieces):
+    """
+    Append `pieces` (an iterable of bytes, written as they arrive) at `offset`,
+    which must equal the current size of the part file. Returns the new offset.
+    A part over MAX_UPLOAD_PART_BYTES or past the declared size raises
+    UploadTooLarge and is discarded; a body cut short keeps what arrived.
+    """
+    with _locked(upload_id):
+        return _append(upload_id, offset, pieces)
+
+
+def _append(upload_id, offset, pieces):
+    info = get_session(upload_id)
+    if info is None:
+        raise UploadNotFound(upload_id)
+    if info['offset'] != offset:
+        raise UploadConflict(info['offset'])
+    upload_id = info['upload_id']
+    _, part_path = _paths(upload_id)
+    with _hashers_lock:
+        state = _hashers.pop(upload_id, None)
+    digest = state[1] if state is not None and state[0] == offset else None
+    written = offset
+    try:
+        with open(part_path, 'ab') as f:
+            try:
+                for piece in pieces:
+                    if written + len(piece) > info['size']:
+                        raise UploadTooLarge(f"upload declared {info['size']} bytes")
+                    if written + len(piece) - offset > settings.MAX_UPLOAD_PART_BYTES:
+                        raise UploadTooLarge(f"Each part must be at most {settings.MAX_UPLOAD_PART_BYTES} bytes")
+                    f.write(piece)
+                    written += len(piece)
+                    if digest is not None:
+                        digest.update(piece)
+            except UploadTooLarge:
+                f.flush()
+                f.truncate(offset)
+                written, digest = offset, None
+                raise
+    finally:
+        if digest is not None:
+            with _hashers_lock:
+                _hashers[upload_id] = (written, digest, time.monotonic())
+    return written
+
+
+def complete(upload_id, destination):
+    """Move a fully received upload to `destination`; returns (info, sha256)."""
+    with _locked(upload_id):
+        return _complete(upload_id, destination)
+
+
+def _complete(upload_id, destination):
+    info = get_session(upload_id)
+    if info is None:
+        raise UploadNotFound(upload_id)
+    if info['offset'] != info['size']:
+        raise UploadConflict(info['offset'])
+    info_path, part_path = _paths(upload_id)
+    with _hashers_lock:
+        state = _hashers.pop(info['upload_id'], None)
+    if state is not None and state[0] == info['size']:
+        content_hash = state[1].hexdigest()
+    else:
+        digest = hashlib.sha256()
+        with open(part_path, 'rb') as f:
+            for piece in iter(lambda: f.read(settings.UPLOAD_CHUNK_BYTES), b''):
+                digest.update(piece)
+        content_hash = digest.hexdigest()
+    os.replace(part_path, destination)
+    os.remove(info_path)
+    return info, content_hash
+
+
+def abort(upload_id):
+    info_path, part_path = _paths(upload_id)
+    with _hashers_lock:
+        _hashers.pop(uuid.UUID(upload_id).hex, None)
+    for path in (info_path, part_path):
+        if os.path.exists(path):
+            os.remove(path)
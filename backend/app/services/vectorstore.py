@@ -0,0 +1,417 @@
+"""
+Vector store backends.
+
+`get_vector_store()` returns the backend selected by `settings.VECTOR_BACKEND`:
+- "pinecone": the hosted Pinecone index (default)
+- "local": an in-process store that keeps float32 vectors in memory-mapped,
+  per-project shard files. Small shards are searched exactly with a NumPy
+  matrix product, large ones through an IVF index built on demand.
+
+Both backends return query results shaped like Pinecone's:
+{"matches": [{"id": ..., "score": ..., "metadata": {...}}]}
+"""
+import os
+import json
+import shutil
+import asyncio
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager, nullcontext
+import numpy as np
+from ..config import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking, single writer assumed
+    fcntl = None
+
+BACKEND_DIR = os.path.join(os.path.dirname(__file__), '..', '..')
+PINECONE_DELETE_BATCH = 1000  # ids per delete request (Pinecone's limit)
+
+
+class VectorStore(ABC):
+    """Interface shared by all vector store backends."""
+
+    @abstractmethod
+    def upsert(self, ids, embeddings, metadatas):
+        ...
+
+    @abstractmethod
+    def query(self, vector, top_k=5, filter=None, include_metadata=True):
+        ...
+
+    async def aquery(self, vector, top_k=5, filter=None, include_metadata=True):
+        return await asyncio.to_thread(self.query, vector, top_k, filter, include_metadata)
+
+    @abstractmethod
+    def delete(self, ids, project_id=None):
+        """Delete vectors by id; `project_id` narrows the search where the backend can use it."""
+
+    def delete_project(self, project_id):
+        """
+        Drop every vector of a project in one operation. Returns False where the
+        backend cannot, and the vectors must be deleted by id instead.
+        """
+        return False
+
+
+# --- Pinecone ---
+class PineconeVectorStore(VectorStore):
+    def __init__(self):
+        from pinecone import Pinecone
+        self._pc = Pinecone(api_key=settings.PINECONE_API_KEY)
+        self._host = None
+        self.index = self._pc.Index(settings.PINECONE_INDEX)
+
+    def upsert(self, ids, embeddings, metadatas):
+        vectors = [
+            {"id": str(id_), "values": emb, "metadata": meta}
+            for id_, emb, meta in zip(ids, embeddings, metadatas)
+        ]
+        self.index.upsert(vectors=vectors)
+
+    def query(self, vector, top_k=5, filter=None, include_metadata=True):
+        return self.index.query(vector=vector, top_k=top_k, include_metadata=include_metadata, filter=filter)
+
+    def delete(self, ids, project_id=None):
+        ids = [str(id_) for id_ in ids]
+        for start in range(0, len(ids), PINECONE_DELETE_BATCH):
+            self.index.delete(ids=ids[start:start + PINECONE_DELETE_BATCH])
+
+    async def aquery(self, vector, top_k=5, filter=None, include_metadata=True):
+        # Query the data plane over the shared async client instead of parking a thread on the SDK
+        from . import http
+        if self._host is None:
+            self._host = (await asyncio.to_thread(self._pc.describe_index, settings.PINECONE_INDEX)).host
+        body = {"vector": list(vector), "topK": top_k, "includeMetadata": include_metadata}
+        if filter:
+            body["filter"] = filter
+        response = await http.post(
+            f"https://{self._host}/query",
+            headers={"Api-Key": settings.PINECONE_API_KEY, "Content-Type": "application/json"},
+            json=body,
+        )
+        response.raise_for_status()
+        return response.json()
+
+
+# --- Local (memory-mapped shards) ---
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def _matches_filter(metadata, flt):
+    """Evaluate the subset of Pinecone's filter language we use: equality, $eq, $ne, $in, $nin."""
+    for key, cond in flt.items():
+        value = metadata.get(key)
+        if isinstance(cond, dict):
+            for op, arg in cond.items():
+                if op == '$eq' and value != arg:
+                    return False
+                if op == '$ne' and value == arg:
+                    return False
+                if op == '$in' and value not in arg:
+                    return False
+                if op == '$nin' and value in arg:
+                    return False
+        elif value != cond:
+            return False
+    return True
+
+
+@contextmanager
+def _file_lock(path):
+    if fcntl is None:
+        yield
+        return
+    with open(path, 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class _IVFIndex:
+    """Inverted-file index over unit vectors (spherical k-means coarse quantizer)."""
+
+    def __init__(self, matrix, live, iterations=10, seed=0):
+        n = matrix.shape[0]
+        live_rows = np.flatnonzero(live)
+        self.n_lists = int(min(4096, max(16, np.sqrt(n)), len(live_rows)))
+        rng = np.random.default_rng(seed)
+        sample_size = min(len(live_rows), self.n_lists * 64)
+        sample = np.asarray(matrix[np.sort(rng.choice(live_rows, sample_size, replace=False))])
+        centroids = sample[rng.choice(sample_size, self.n_lists, replace=False)]
+        for _ in range(iterations):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, sample)
+            empty = ~sums.any(axis=1)
+            sums[empty] = centroids[empty]
+            centroids = _normalize(sums)
+        self.centroids = centroids
+        self.lists = [np.empty(0, dtype=np.int64) for _ in range(self.n_lists)]
+        self.trained_rows = n
+        self.indexed_rows = 0
+        self.add(matrix)
+
+    def add(self, matrix, block=65536):
+        """Assign rows appended since the last call to their nearest list."""
+        n = matrix.shape[0]
+        for start in range(self.indexed_rows, n, block):
+            stop = min(start + block, n)
+            assign = np.argmax(np.asarray(matrix[start:stop]) @ self.centroids.T, axis=1)
+            order = np.argsort(assign, kind='stable')
+            bounds = np.searchsorted(assign[order], np.arange(self.n_lists + 1))
+            for i in range(self.n_lists):
+                if bounds[i] < bounds[i + 1]:
+                    self.lists[i] = np.concatenate([self.lists[i], order[bounds[i]:bounds[i + 1]] + start])
+        self.indexed_rows = n
+
+    def candidates(self, q, nprobe):
+        nprobe = min(nprobe, self.n_lists)
+        probe = np.argpartition(-(self.centroids @ q), nprobe - 1)[:nprobe]
+        return np.concatenate([self.lists[i] for i in probe])
+
+
+class _Shard:
+    """
+    One project's vectors: `vectors.f32` holds row-major float32 unit vectors and
+    `meta.jsonl` is an append-only log of {"id", "row", "metadata"} records.
+    Readers pick up rows written by other processes on their next refresh.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.vectors_path = os.path.join(path, 'vectors.f32')
+        self.meta_path = os.path.join(path, 'meta.jsonl')
+        self.info_path = os.path.join(path, 'shard.json')
+        self.lock_path = os.path.join(path, '.lock')
+        self.lock = threading.RLock()
+        self.dim = None
+        self.rows = {}
+        self.ids = []
+        self.metadatas = []
+        self.live = np.zeros(0, dtype=bool)
+        self.matrix = None
+        self._meta_offset = 0
+        self._ivf = None
+
+    def _refresh(self):
+        if self.dim is None:
+            if not os.path.exists(self.info_path):
+                return
+            with open(self.info_path) as f:
+                self.dim = json.load(f)['dim']
+        if os.path.exists(self.meta_path) and os.path.getsize(self.meta_path) > self._meta_offset:
+            with open(self.meta_path, 'rb') as f:
+                f.seek(self._meta_offset)
+                data = f.read()
+            complete = data[:data.rfind(b'\n') + 1]
+            self._meta_offset += len(complete)
+            records = [json.loads(line) for line in complete.splitlines()]
+            grow = max((r['row'] for r in records), default=-1) + 1 - len(self.ids)
+            if grow > 0:
+                self.ids.extend([None] * grow)
+                self.metadatas.extend([None] * grow)
+                self.live = np.concatenate([self.live, np.zeros(grow, dtype=bool)])
+            for record in records:
+                row = record['row']
+                if record.get('deleted'):
+                    self.rows.pop(record['id'], None)
+                    self.ids[row] = None
+                    self.metadatas[row] = None
+                    self.live[row] = False
+                else:
+                    self.rows[record['id']] = row
+                    self.ids[row] = record['id']
+                    self.metadatas[row] = record.get('metadata') or {}
+                    self.live[row] = True
+        n_rows = len(self.ids)
+        if n_rows and (self.matrix is None or self.matrix.shape[0] != n_rows):
+            self.matrix = np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(n_rows, self.dim))
+
+    def upsert(self, ids, vectors, metadatas):
+        vectors = _normalize(np.asarray(vectors, dtype=np.float32))
+        with self.lock, _file_lock(self.lock_path):
+            self._refresh()
+            if self.dim is None:
+                self.dim = int(vectors.shape[1])
+                with open(self.info_path, 'w') as f:
+                    json.dump({'dim': self.dim}, f)
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Vector dimension {vectors.shape[1]} does not match shard dimension {self.dim}")
+            row_bytes = self.dim * 4
+            if not os.path.exists(self.vectors_path):
+                open(self.vectors_path, 'wb').close()
+            next_row = os.path.getsize(self.vectors_path) // row_bytes
+            records = []
+            new_rows = {}
+            with open(self.vectors_path, 'r+b') as f:
+                appended = []
+                for id_, vec, meta in zip(ids, vectors, metadatas):
+                    id_ = str(id_)
+                    row = self.rows.get(id_, new_rows.get(id_))
+                    if row is None:
+                        row = new_rows[id_] = next_row + len(appended)
+                        appended.append(vec)
+                    elif row >= next_row:
+                        appended[row - next_row] = vec
+                    else:
+                        f.seek(row * row_bytes)
+                        f.write(vec.tobytes())
+                    records.append({'id': id_, 'row': row, 'metadata': meta})
+                if appended:
+                    f.seek(next_row * row_bytes)
+                    f.write(np.stack(appended).tobytes())
+            with open(self.meta_path, 'a', encoding='utf-8') as f:
+                f.write(''.join(json.dumps(r) + '\n' for r in records))
+            self._refresh()
+
+    def delete(self, ids):
+        """Tombstone rows in the metadata log; their vector slots are not reused."""
+        with self.lock, _file_lock(self.lock_path):
+            self._refresh()
+            records = [{'id': str(id_), 'row': self.rows[str(id_)], 'deleted': True} for id_ in ids if str(id_) in self.rows]
+            if records:
+                with open(self.meta_path, 'a', encoding='utf-8') as f:
+                    f.write(''.join(json.dumps(r) + '\n' for r in records))
+                self._refresh()
+            return len(records)
+
+    def search(self, q, top_k, flt, include_metadata):
+        with self.lock:
+            self._refresh()
+            if self.matrix is None:
+                return []
+            matrix, live, ids, metadatas = self.matrix, self.live, self.ids, self.metadatas
+            n = matrix.shape[0]
+            # A shard whose rows are all deleted has nothing to train an index on
+            if n > settings.LOCAL_VECTOR_EXACT_LIMIT and live.any():
+                if self._ivf is None or n > 2 * self._ivf.trained_rows:
+                    self._ivf = _IVFIndex(matrix, live)
+                elif n > self._ivf.indexed_rows:
+                    self._ivf.add(matrix)
+                rows = self._ivf.candidates(q, settings.LOCAL_VECTOR_IVF_NPROBE)
+            else:
+                rows = None
+        # Rows rewritten in place keep their IVF list until the next retrain.
+        if rows is None:
+            rows = np.arange(n)
+            scores = np.asarray(matrix) @ q
+        else:
+            rows = np.sort(rows[live[rows]])
+            scores = matrix[rows] @ q
+        scores = np.where(live[rows], scores, -np.inf)
+        want = top_k * 4 if flt else top_k
+        if len(rows) > want:
+            top = np.argpartition(-scores, want - 1)[:want]
+            order = top[np.argsort(-scores[top])]
+        else:
+            order = np.argsort(-scores)
+        matches = self._collect(order, rows, scores, ids, metadatas, top_k, flt, include_metadata)
+        if flt and len(matches) < top_k and len(order) < len(rows):
+            order = np.argsort(-scores)
+            matches = self._collect(order, rows, scores, ids, metadatas, top_k, flt, include_metadata)
+        return matches
+
+    @staticmethod
+    def _collect(order, rows, scores, ids, metadatas, top_k, flt, include_metadata):
+        matches = []
+        for i in order:
+            if scores[i] == -np.inf:
+                break
+            row = rows[i]
+            meta = metadatas[row]
+            if flt and not _matches_filter(meta, flt):
+                continue
+            match = {'id': ids[row], 'score': float(scores[i])}
+            if include_metadata:
+                match['metadata'] = meta
+            matches.append(match)
+            if len(matches) == top_k:
+                break
+        return matches
+
+
+class LocalVectorStore(VectorStore):
+    def __init__(self, root=None):
+        root = root or settings.LOCAL_VECTOR_DIR
+        self.root = root if os.path.isabs(root) else os.path.join(BACKEND_DIR, root)
+        os.makedirs(self.root, exist_ok=True)
+        self._shards = {}
+        self._lock = threading.Lock()
+
+    def _shard(self, project_id):
+        key = str(project_id)
+        with self._lock:
+            shard = self._shards.get(key)
+            if shard is None:
+                shard = self._shards[key] = _Shard(os.path.join(self.root, f"project_{key}"))
+            return shard
+
+    def _all_shards(self):
+        prefix = 'project_'
+        return [self._shard(name[len(prefix):]) for name in os.listdir(self.root) if name.startswith(prefix)]
+
+    def upsert(self, ids, embeddings, metadatas):
+        groups = {}
+        for id_, emb, meta in zip(ids, embeddings, metadatas):
+            group = groups.setdefault(str(meta.get('project_id')), ([], [], []))
+            group[0].append(id_)
+            group[1].append(emb)
+            group[2].append(meta)
+        for project_id, (group_ids, group_embs, group_metas) in groups.items():
+            self._shard(project_id).upsert(group_ids, group_embs, group_metas)
+
+    def query(self, vector, top_k=5, filter=None, include_metadata=True):
+        flt = dict(filter or {})
+        project_id = flt.pop('project_id', None)
+        if isinstance(project_id, dict) and set(project_id) == {'$eq'}:
+            project_id = project_id['$eq']
+        elif isinstance(project_id, dict):
+            flt['project_id'] = project_id
+            project_id = None
+        shards = [self._shard(project_id)] if project_id is not None else self._all_shards()
+        q = _normalize(np.asarray(vector, dtype=np.float32))
+        matches = []
+        for shard in shards:
+            matches.extend(shard.search(q, top_k, flt, include_metadata))
+        matches.sort(key=lambda m: m['score'], reverse=True)
+        return {'matches': matches[:top_k]}
+
+    def delete(self, ids, project_id=None):
+        shards = [self._shard(project_id)] if project_id is not None else self._all_shards()
+        for shard in shards:
+            shard.delete(ids)
+
+    def delete_project(self, project_id):
+        path = os.path.join(self.root, f"project_{project_id}")
+        with self._lock:
+            shard = self._shards.pop(str(project_id), None)
+        if os.path.isdir(path):
+            # Under the shard's lock so an upsert in flight finishes first
+            with (shard.lock if shard else nullcontext()), _file_lock(os.path.join(path, '.lock')):
+                shutil.rmtree(path)
+        return True
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_vector_store() -> VectorStore:
+    """Process-wide vector store for the configured backend, created on first use."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if settings.VECTOR_BACKEND == 'local':
+                    _store = LocalVectorStore()
+                else:
+                    _store = PineconeVectorStore()
+    return _store
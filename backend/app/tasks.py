@@ -1,5 +1,7 @@
 import os
-from celery import Celery
+import time
+from celery import Celery, chain, group
+from celery.signals import worker_process_init
 from .config import settings
 from .database import SessionLocal
 from . import crud, models
@@ -12,77 +14,490 @@ celery_app = Celery(
     backend=settings.REDIS_URL
 )
 
-# Placeholder for GCS integration
-from google.cloud import storage
+# CPU-heavy and IO-bound stages scale on separate worker pools
+_IO_TASKS = ('embed_document', 'finalize_document', 'archive_document', 'expand_archive', 'crawl_site', 'run_deletion')
+celery_app.conf.task_routes = {
+    'app.tasks.extract_document': {'queue': settings.INGEST_CPU_QUEUE},
+    'app.tasks.ocr_batch': {'queue': settings.INGEST_CPU_QUEUE},
+    **{f'app.tasks.{name}': {'queue': settings.INGEST_IO_QUEUE} for name in _IO_TASKS},
+}
+# A CPU worker holding prefetched documents would keep them from idle workers
+celery_app.conf.worker_prefetch_multiplier = settings.CELERY_PREFETCH_MULTIPLIER
 
-def upload_to_gcs(local_path, bucket_name, dest_blob_name):
-    client = storage.Client()
-    bucket = client.bucket(bucket_name)
-    blob = bucket.blob(dest_blob_name)
-    blob.upload_from_filename(local_path)
-    return f'gs://{bucket_name}/{dest_blob_name}'
-
-# Placeholder for OpenCV, Google Vision, spaCy imports
-import cv2
-import spacy
-from google.cloud import vision
 from .services import embeddings
+from .services import chunking
+from .services import registry
+from .services import answer_cache
+from .services import chunk_store
+from .services import status
+from .services import ocr
+from .services import crawler
+from .services import deletion
+
+@worker_process_init.connect
+def warm_registry(**kwargs):
+    # Pay for spaCy and the Google clients once per worker process, not per document
+    registry.warm()
+
+def _chunk_metadata(chunk):
+    return {"chunk_index": chunk.index, "start": chunk.start, "end": chunk.end, "tokens": chunk.tokens}
+
+# --- Ingestion pipeline ---
+# extract_document (CPU queue) -> embed_document (IO queue) -> finalize_document (IO queue),
+# chained per document, with archive_document (GCS upload, IO queue) running alongside.
+# Each stage passes a small payload (ids and counts) to the next; chunk text goes
+# through the chunks table, never through the broker. Run one worker per pool
+# (see backend/README.md).
+
+EXTRACTED_DIR = 'extracted'  # under uploads/: text extracted before the pipeline, see _stash_text
+
+def _upload_path(filename):
+    return os.path.join(os.path.dirname(__file__), '..', 'uploads', filename)
+
+def _skip(payload):
+    # A failed or unchanged document stops the chain without failing the task
+    return not payload or 'error' in payload or payload.get('unchanged')
+
+def _fail(db, tracker, project_id, document_id, e):
+    db.rollback()
+    if tracker is None:
+        # Failed before the tracker recorded anything
+        crud.update_document_progress(db, document_id, 0.0, {'stage': None, 'error': str(e)}, 'error')
+    else:
+        tracker.stats['error'] = str(e)
+        tracker.finish('error')
+    # Some chunks may already be searchable
+    answer_cache.invalidate_project(project_id)
+    return {'document_id': document_id, 'error': str(e)}
+
+def ingestion_pipeline(document_id: int):
+    """Signature that ingests one document through the staged tasks."""
+    return group(
+        _stages(extract_document.s(document_id)),
+        archive_document.si(document_id),
+    )
+
+def start_ingestion(document_id: int):
+    ingestion_pipeline(document_id).apply_async()
 
-def chunk_text(text, chunk_size=500):
-    # Simple chunking by words
-    words = text.split()
-    chunks = [" ".join(words[i:i+chunk_size]) for i in range(0, len(words), chunk_size)]
-    return chunks
+def start_bulk_ingestion(document_ids, image_ids=()):
+    """
+    Queue many documents at once. Images are OCRed OCR_BATCH_SIZE per task
+    (one batched Vision request) before their pipelines start.
+    """
+    images = set(image_ids)
+    image_ids = [i for i in document_ids if i in images]
+    batches = [image_ids[i:i + settings.OCR_BATCH_SIZE] for i in range(0, len(image_ids), settings.OCR_BATCH_SIZE)]
+    group(
+        *(ingestion_pipeline(i) for i in document_ids if i not in images),
+        *(ocr_batch.si(batch) for batch in batches),
+        *(archive_document.si(i) for i in image_ids),
+    ).apply_async()
+
+def start_page_ingestion(pages):
+    """
+    Queue crawled pages, given as (document_id, text, fetch seconds, etag,
+    last_modified), with their text already extracted.
+    """
+    if pages:
+        group(
+            _stages(extract_document.s(i, _stash_text(i, text), seconds, (etag, last_modified)))
+            for i, text, seconds, etag, last_modified in pages
+        ).apply_async()
 
 @celery_app.task
-def ingest_document(document_id: int):
+def ocr_batch(document_ids):
+    """
+    OCR a batch of image documents in one Vision request, then start each one's
+    pipeline with its text. A document whose image is unreadable, or that Vision
+    fails on, starts without text: extract_document OCRs it again on its own and
+    marks it 'error' if that fails too.
+    """
+    db = SessionLocal()
+    try:
+        docs = [doc for doc in (crud.get_document(db, i) for i in document_ids) if doc]
+    finally:
+        db.close()
+    images = []
+    for doc in docs:
+        try:
+            with open(_upload_path(doc.filename), 'rb') as f:
+                images.append(f.read())
+        except OSError as e:
+            print(f"ocr_batch: document {doc.id}: {e}")
+            images.append(b'')
+    start = time.perf_counter()
+    try:
+        texts = ocr.ocr_images(images)
+    except Exception as e:
+        # The Vision request itself failed: every document retries on its own
+        print(f"ocr_batch {document_ids}: {e}")
+        texts = [e] * len(docs)
+    seconds = (time.perf_counter() - start) / max(len(docs), 1)
+    for doc, text in zip(docs, texts):
+        if isinstance(text, Exception):
+            print(f"ocr_batch: document {doc.id}: {text}")
+            _stages(extract_document.s(doc.id)).apply_async()
+        else:
+            _stages(extract_document.s(doc.id, _stash_text(doc.id, text), seconds)).apply_async()
+    return len(docs)
+
+def _stash_text(document_id, text):
+    """
+    Write text extracted before the pipeline (OCR, crawled pages) where
+    extract_document picks it up, and return its name: text never goes through
+    the broker.
+    """
+    name = os.path.join(EXTRACTED_DIR, f"{document_id}_{uuid.uuid4().hex}.txt")
+    os.makedirs(os.path.dirname(_upload_path(name)), exist_ok=True)
+    with open(_upload_path(name), 'w', encoding='utf-8') as f:
+        f.write(text)
+    return name
+
+def _take_text(name):
+    """Stashed text, removed once read; None if it is gone (extract_document then extracts again)."""
+    path = _upload_path(name)
+    try:
+        with open(path, encoding='utf-8') as f:
+            text = f.read()
+    except FileNotFoundError:
+        return None
+    os.remove(path)
+    return text
+
+def _discard_text(name):
+    try:
+        os.remove(_upload_path(name))
+    except FileNotFoundError:
+        pass
+
+def _ingested(db, document_id):
+    """Whether the document has chunks and all their vectors were written."""
+    refs = crud.get_chunk_refs(db, document_id)
+    return bool(refs) and all(ref.embedded is not False for ref in refs)
+
+def _stages(extract):
+    return chain(extract, embed_document.s(), finalize_document.s())
+
+@celery_app.task
+def extract_document(document_id: int, extracted_file: str = None, extract_seconds: float = None, fetch_validators=None):
+    """
+    Extract, chunk and run NER, then persist the chunk diff. CPU-bound.
+    Images OCRed by ocr_batch and pages fetched by the crawler arrive with
+    their text (stashed by _stash_text) and the time it took to produce, pages
+    also with the (etag, last_modified) they were fetched with.
+    """
     db = SessionLocal()
     doc = crud.get_document(db, document_id)
-    if not doc:
+    # A document added just before its project was marked is removed with the project
+    if not doc or doc.status == crud.DELETING or crud.project_deleting(db, doc.project_id):
         db.close()
-        return
+        if extracted_file:
+            _discard_text(extracted_file)
+        return None
+    project_id = doc.project_id
+    file_path = _upload_path(doc.filename)
+    tracker = None
     try:
-        ingestion.update_document_status(document_id, 'processing')
-        file_path = os.path.join(os.path.dirname(__file__), '..', 'uploads', doc.filename)
+        size_bytes = os.path.getsize(file_path) if doc.filetype != 'url' and os.path.exists(file_path) else None
+        tracker = status.IngestionTracker(db, doc, size_bytes)
+        ingestion.update_document_status(document_id, 'processing', db=db)
         text = ""
-        if doc.filetype.startswith('image/'):
-            text = ingestion.extract_text_from_image(file_path)
+        segments = None
+        extracted_text = _take_text(extracted_file) if extracted_file else None
+        validators = fetch_validators if extracted_text is not None else None
+        if extracted_text is not None:
+            text = extracted_text
+            tracker.add_time('extract', extract_seconds or 0.0)
+        elif doc.filetype.startswith('image/'):
+            with tracker.stage('extract'):
+                text = ingestion.extract_text_from_image(file_path)
         elif doc.filetype == 'url':
-            text = ingestion.extract_text_from_url(doc.filename)
+            # Validators only help if the last fetch made it into vectors
+            with tracker.stage('read'):
+                page = crawler.fetch(doc.filename, *(crawler.validators(doc) if _ingested(db, document_id) else ()))
+            if page.not_modified:
+                # A 304 may omit the validators, which then stay as they were
+                crawler.record_fetch(doc, *crawler.validators(doc))
+                tracker.count('unchanged')
+                tracker.finish('ready')
+                return {'document_id': document_id, 'chunks': 0, 'unchanged': True}
+            validators = (page.etag, page.last_modified)
+            tracker.count('bytes', len(page.content))
+            with tracker.stage('extract'):
+                text = crawler.page_text(page)
         elif doc.filetype == 'application/pdf' or doc.filename.lower().endswith('.pdf'):
-            text = ingestion.extract_text_from_pdf(file_path)
+            # Pages stream straight into the chunker; the time spent producing them is charged to extract
+            segments = tracker.timed_iter('extract', ingestion.iter_pdf_pages(file_path), count_as='pages')
         elif doc.filetype in ['application/vnd.openxmlformats-officedocument.wordprocessingml.document', 'application/msword'] or doc.filename.lower().endswith('.docx'):
-            text = ingestion.extract_text_from_docx(file_path)
+            with tracker.stage('extract'):
+                text = ingestion.extract_text_from_docx(file_path)
         elif doc.filetype == 'text/csv' or doc.filename.lower().endswith('.csv'):
-            text = ingestion.extract_text_from_csv(file_path)
+            with tracker.stage('extract'):
+                text = ingestion.extract_text_from_csv(file_path)
         elif doc.filetype == 'text/plain' or doc.filename.lower().endswith('.txt'):
-            with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                text = f.read()
+            with tracker.stage('read'):
+                with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+                    text = f.read()
         else:
             text = ""
-        entities = ingestion.process_text_with_spacy(text) if text else []
-        from .config import settings
-        # Upload file to GCS
-        gcs_url = ingestion.upload_to_gcs(file_path, settings.GCS_BUCKET, doc.filename)
-        # Chunk text and generate embeddings
-        if text:
-            chunks = chunk_text(text)
-            embeddings_arr = embeddings.embed_texts(chunks)
-            ids = [str(uuid.uuid4()) for _ in chunks]
-            metadatas = [{"document_id": doc.id, "chunk_index": i} for i in range(len(chunks))]
-            embeddings.upsert_to_pinecone(ids, embeddings_arr, metadatas)
-            # Store chunks in DB
-            for i, (chunk, vector_id) in enumerate(zip(chunks, ids)):
-                db_chunk = models.Chunk(document_id=doc.id, text=chunk, chunk_metadata={"chunk_index": i}, vector_id=vector_id)
-                db.add(db_chunk)
-            db.commit()
-        # Update document status and metadata
-        db_doc = crud.get_document(db, document_id)
-        db_doc.status = 'ready'
-        db.commit()
+        page = None
+        if doc.filetype == 'url':
+            # Re-syncs of an unchanged page stop here
+            page_hash = ingestion.content_hash(text)
+            if page_hash == doc.content_hash and _ingested(db, document_id):
+                crawler.record_fetch(doc, *(validators or crawler.validators(doc)))
+                tracker.count('unchanged')
+                tracker.finish('ready')
+                return {'document_id': document_id, 'chunks': 0, 'unchanged': True}
+            # Stored by finalize_document: a page whose vectors were never written must be fetched and ingested again
+            page = {'content_hash': page_hash, 'validators': validators}
+        # Chunk text
+        with tracker.stage('chunk'):
+            chunks = list(chunking.iter_chunks(segments if segments is not None else text))
+        tracker.count('chars', sum(len(c.text) for c in chunks))
+        tracker.count('chunks', len(chunks))
+        ner_report = {}
+        with tracker.stage('ner'):
+            entities = ingestion.process_text_with_spacy([c.text for c in chunks], report=ner_report) if chunks else []
+        tracker.count('entities', len(entities))
+        tracker.stats['ner'] = ner_report
+        with tracker.stage('db_write'):
+            # Re-ingestion only embeds chunks whose text changed
+            added, kept, removed = ingestion.diff_chunks(ingestion.existing_chunks(db, document_id), chunks)
+            ids = [str(uuid.uuid4()) for _ in added]
+            # Store chunks in DB first: retrieval hydrates vector ids from this table,
+            # and embed_document reads the new chunks' text back from it
+            crud.bulk_insert_chunks(db, (
+                {
+                    "document_id": document_id,
+                    "text": chunk.text,
+                    "chunk_metadata": _chunk_metadata(chunk),
+                    "vector_id": vector_id,
+                    "content_hash": ingestion.content_hash(chunk.text),
+                    "embedded": False,
+                }
+                for chunk, vector_id in zip(added, ids)
+            ), settings.DB_BULK_BATCH_SIZE)
+            crud.bulk_update_chunks(db, (
+                {"id": row['id'], "chunk_metadata": _chunk_metadata(chunk)}
+                for row, chunk in kept if row['chunk_metadata'] != _chunk_metadata(chunk)
+            ), settings.DB_BULK_BATCH_SIZE)
+            # Rows go before vectors so a removed chunk is never hydrated
+            crud.delete_chunks(db, [row['id'] for row in removed], settings.DB_BULK_BATCH_SIZE)
+        diff = {'embedded': len(added), 'reused': len(kept), 'removed': len(removed)}
+        for name, value in diff.items():
+            tracker.count(name, value)
+        tracker.handoff()
+        return {
+            'document_id': document_id,
+            'project_id': project_id,
+            'chunks': len(chunks),
+            **diff,
+            'entities': len(entities),
+            'vector_ids': ids,
+            'removed_vectors': [row['vector_id'] for row in removed if row['vector_id']],
+            'page': page,
+        }
+    except Exception as e:
+        return _fail(db, tracker, project_id, document_id, e)
+    finally:
         db.close()
-        return {'text': text, 'entities': entities, 'gcs_url': gcs_url}
+
+@celery_app.task
+def embed_document(payload):
+    """Embed the chunks extract_document added and upsert their vectors. IO-bound."""
+    if _skip(payload) or not payload['vector_ids']:
+        return payload
+    db = SessionLocal()
+    document_id, project_id = payload['document_id'], payload['project_id']
+    doc = crud.get_document(db, document_id)
+    if not doc or doc.status == crud.DELETING:
+        db.close()
+        return None
+    tracker = None
+    try:
+        tracker = status.IngestionTracker(db, doc, resume=True)
+        tracker.stats['stage'] = 'embed'
+        vector_ids = payload['vector_ids']
+        texts = {row.vector_id: row.text for row in crud.get_chunks_by_vector_ids(db, vector_ids)}
+        # Vector metadata holds only what query filters need
+        metadata = {"project_id": project_id, "document_id": document_id}
+        records = ((vector_id, texts[vector_id], metadata) for vector_id in vector_ids if vector_id in texts)
+        pipeline = {}
+        start = tracker.progress
+        span = status.EMBED_DONE - start
+        embeddings.embed_and_upsert(
+            records,
+            stats=pipeline,
+            on_progress=lambda written: tracker.set_progress(start + span * written / len(vector_ids)),
+        )
+        if crud.document_deleting(db, document_id):
+            # Deleted while embedding: the deletion job may already have removed these rows and missed the vectors
+            embeddings.delete_vectors(vector_ids, project_id)
+            return None
+        # Only now can a re-ingestion reuse these rows (see ingestion.diff_chunks)
+        crud.mark_chunks_embedded(db, vector_ids, settings.DB_BULK_BATCH_SIZE)
+        tracker.add_time('embed', pipeline.get('embed', 0.0))
+        tracker.add_time('upsert', pipeline.get('upsert', 0.0))
+        tracker.count('embed_requests', pipeline.get('embed_requests', 0))
+        tracker.count('upsert_requests', pipeline.get('upsert_requests', 0))
+        tracker.handoff()
+        return payload
     except Exception as e:
-        ingestion.update_document_status(document_id, 'error')
+        return _fail(db, tracker, project_id, document_id, e)
+    finally:
         db.close()
-        return {'error': str(e)} 
\ No newline at end of file
+
+@celery_app.task
+def finalize_document(payload):
+    """Drop vectors of removed chunks and mark the document ready."""
+    if _skip(payload):
+        return payload
+    db = SessionLocal()
+    document_id, project_id = payload['document_id'], payload['project_id']
+    doc = crud.get_document(db, document_id)
+    if not doc or doc.status == crud.DELETING:
+        db.close()
+        return None
+    tracker = None
+    try:
+        tracker = status.IngestionTracker(db, doc, resume=True)
+        removed_vectors = payload['removed_vectors']
+        if removed_vectors:
+            with tracker.stage('upsert'):
+                embeddings.delete_vectors(removed_vectors, project_id)
+        chunk_store.get_chunk_store().forget(removed_vectors)
+        page = payload.get('page')
+        if page:
+            doc.content_hash = page['content_hash']
+            crawler.record_fetch(doc, *(page['validators'] or (None, None)))
+        tracker.finish('ready')
+        answer_cache.invalidate_project(project_id)
+        result = {k: v for k, v in payload.items() if k not in ('vector_ids', 'removed_vectors', 'page')}
+        result['timings'] = tracker.stats['stages']
+        print(
+            f"ingest_document {document_id}: {result['chunks']} chunks "
+            f"({result['embedded']} embedded, {result['reused']} reused) in {tracker.stats['total_seconds']}s"
+        )
+        return result
+    except Exception as e:
+        return _fail(db, tracker, project_id, document_id, e)
+    finally:
+        db.close()
+
+@celery_app.task
+def archive_document(document_id: int):
+    """Copy the uploaded file to GCS. Runs beside the pipeline; a failure does not fail ingestion."""
+    db = SessionLocal()
+    try:
+        doc = crud.get_document(db, document_id)
+        if not doc or doc.filetype == 'url' or doc.status == crud.DELETING:
+            return None
+        gcs_url = ingestion.upload_to_gcs(_upload_path(doc.filename), settings.GCS_BUCKET, doc.filename)
+        if crud.document_deleting(db, document_id):
+            # The deletion job may already have removed the GCS copy it did not know about yet
+            ingestion.delete_from_gcs(settings.GCS_BUCKET, doc.filename)
+            return None
+        return gcs_url
+    except Exception as e:
+        print(f"archive_document {document_id}: GCS upload failed: {e}")
+        return None
+    finally:
+        db.close()
+
+@celery_app.task
+def ingest_document(document_id: int):
+    """Every stage inline in one task, for single-worker setups and benchmarks."""
+    gcs_url = archive_document(document_id)
+    result = finalize_document(embed_document(extract_document(document_id)))
+    if result is not None:
+        result['gcs_url'] = gcs_url
+    return result
+
+@celery_app.task
+def expand_archive(batch_id: int, archive_path: str):
+    """Unpack a bulk-upload archive and fan its documents out to the ingestion pipeline."""
+    from .services import bulk
+    db = SessionLocal()
+    try:
+        batch = crud.get_ingestion_batch(db, batch_id)
+        if batch:
+            bulk.expand_archive(db, batch, archive_path)
+    finally:
+        db.close()
+
+@celery_app.task
+def crawl_site(batch_id: int, start_url: str, mode: str = 'auto', max_pages: int = None):
+    """Crawl a page, sitemap or site prefix into an ingestion batch (see services/crawler.py)."""
+    db = SessionLocal()
+    try:
+        batch = crud.get_ingestion_batch(db, batch_id)
+        if not batch:
+            return None
+        try:
+            counts = crawler.ingest_site(db, batch, start_url, mode, max_pages)
+        except crawler.CrawlAborted as e:
+            # The deletion job removes the batch with the project
+            db.rollback()
+            print(f"crawl_site {batch_id} {start_url}: {e}")
+            return None
+        except Exception as e:
+            db.rollback()
+            crud.finish_ingestion_batch(db, batch, status='failed', error=str(e))
+            raise
+        batch.status = 'running'
+        db.commit()
+        print(f"crawl_site {batch_id} {start_url}: {counts}")
+        return counts
+    finally:
+        db.close()
+
+@celery_app.task
+def run_deletion(job_id: int):
+    """Remove the chunks, vectors, files and rows of a deletion job (see services/deletion.py)."""
+    db = SessionLocal()
+    try:
+        job = crud.get_deletion_job(db, job_id)
+        if not job:
+            return None
+        try:
+            counts = deletion.run_job(db, job)
+        except Exception as e:
+            db.rollback()
+            crud.finish_deletion_job(db, job, status='failed', error=str(e))
+            raise
+        print(f"run_deletion {job_id}: {counts}")
+        return counts
+    finally:
+        db.close()
+
+@celery_app.task
+def summarize_session(session_id: int, start: int, through_id: int):
+    """Fold the session's messages with start < id <= through_id into its rolling summary."""
+    from .services import rag
+    db = SessionLocal()
+    try:
+        session = crud.get_chat_session(db, session_id)
+        # A summarization queued by an earlier turn may have covered these already
+        if not session or (session.summarized_through or 0) != start:
+            return None
+        summary = session.summary
+        while start < through_id:
+            messages = crud.get_messages_between(db, session_id, start, through_id, settings.SUMMARY_PAGE_MESSAGES)
+            if not messages:
+                break
+            turns = [{'role': 'user' if m.sender == 'user' else 'assistant', 'content': m.text} for m in messages]
+            summary = rag.summarize_turns(summary, turns)
+            # Each page is stored as it is folded in, so a long backlog is never summarized twice
+            if not crud.update_session_summary(db, session_id, start, summary, messages[-1].id):
+                return False
+            start = messages[-1].id
+        return True
+    finally:
+        db.close()
+
+@celery_app.task
+def suggest_followups_task(answer: str, question: str, language: str = 'en'):
+    from .services import rag
+    return rag.suggest_followups(answer, question, language, model="qwen/qwen3-32b")
@@ -0,0 +1,197 @@
+"""
+Chat concurrency benchmark against local stand-in services.
+
+Serves the app with a single uvicorn worker and drives N concurrent chats
+through the async /api/chat endpoint and through a sync baseline route that
+runs rag.rag_chat on the threadpool (how /api/chat used to work). Jina and
+Groq are replaced by the stand-ins in standins.py and the vector store is the
+local backend behind a Pinecone-like delay, so no outside service is
+contacted. Each level also reports the time spent in every external service,
+read from the app's /metrics. Results go to stdout and, with --output, to a
+JSON file.
+
+    cd backend
+    python -m benchmarks.chat_concurrency --concurrency 10 50 200 --output chat_bench.json
+"""
+import os
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+
+APP_PORT = 18000
+STANDIN_PORT = 18001
+
+
+def configure_env(workdir):
+    # Must run before anything under app/ is imported: settings are read at import time
+    os.environ.update({
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        "JINA_EMBEDDING_URL": f"http://127.0.0.1:{STANDIN_PORT}/v1/embeddings",
+        "GROQ_BASE_URL": f"http://127.0.0.1:{STANDIN_PORT}",
+        "GROQ_API_KEY": "standin",
+        "JINA_API_KEY": "standin",
+        "VECTOR_BACKEND": "local",
+        "LOCAL_VECTOR_DIR": os.path.join(workdir, "vectors"),
+        "EMBEDDING_CACHE_ENABLED": "false",
+    })
+
+
+def seed_project(project_id, n_chunks):
+    """Create a project with `n_chunks` chunks in the database and the local vector store."""
+    from app import models
+    from app.database import Base, SessionLocal, engine
+    from app.services.vectorstore import get_vector_store
+    from benchmarks.standins import fake_embedding
+    Base.metadata.create_all(engine)
+    texts = [f"Document passage {i} about topic {i % 37}." for i in range(n_chunks)]
+    ids = [f"bench-{i}" for i in range(n_chunks)]
+    db = SessionLocal()
+    db.add(models.Project(id=project_id, name="bench"))
+    for document_id in range(1, n_chunks // 100 + 2):
+        db.add(models.Document(id=document_id, project_id=project_id, filename=f"bench-{document_id}.txt", filetype="text/plain", status="ready"))
+    db.add_all(
+        models.Chunk(document_id=i // 100 + 1, text=t, chunk_metadata={"chunk_index": i % 100}, vector_id=vector_id)
+        for i, (t, vector_id) in enumerate(zip(texts, ids))
+    )
+    db.commit()
+    db.close()
+    metadatas = [{"project_id": project_id, "document_id": i // 100 + 1} for i in range(n_chunks)]
+    get_vector_store().upsert(ids, [fake_embedding(t) for t in texts], metadatas)
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(q / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1) if latencies else None,
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1) if latencies else None,
+    }
+
+
+def external_calls(client):
+    """{(service, operation): (seconds, calls)} from the app's external call histogram."""
+    from prometheus_client.parser import text_string_to_metric_families
+    totals = {}
+    for family in text_string_to_metric_families(client.get("/metrics").text):
+        if family.name != "autorag_external_call_duration_seconds":
+            continue
+        for sample in family.samples:
+            key = (sample.labels.get("service"), sample.labels.get("operation"))
+            seconds, calls = totals.get(key, (0.0, 0))
+            if sample.name.endswith("_sum"):
+                totals[key] = (seconds + sample.value, calls)
+            elif sample.name.endswith("_count"):
+                totals[key] = (seconds, calls + int(sample.value))
+    return totals
+
+
+def external_breakdown(before, after, requests):
+    """Per service and operation: calls and mean milliseconds per chat request between two scrapes."""
+    breakdown = {}
+    for key, (seconds, calls) in after.items():
+        seconds -= before.get(key, (0.0, 0))[0]
+        calls -= before.get(key, (0.0, 0))[1]
+        if calls and requests:
+            breakdown[f"{key[0]}.{key[1]}"] = {
+                "calls_per_request": round(calls / requests, 2),
+                "mean_ms": round(seconds / calls * 1000, 1),
+            }
+    return breakdown
+
+
+async def run_level(path, concurrency, total, project_id):
+    import httpx
+    latencies, errors = [], 0
+    counter = iter(range(total))
+    limits = httpx.Limits(max_connections=concurrency + 10, max_keepalive_connections=concurrency + 10)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{APP_PORT}", limits=limits, timeout=600) as client:
+
+        async def worker():
+            nonlocal errors
+            for i in counter:
+                start = time.perf_counter()
+                try:
+                    response = await client.post(path, json={"project_id": project_id, "question": f"question {i}?"})
+                    response.raise_for_status()
+                    latencies.append(time.perf_counter() - start)
+                except Exception:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return summarize(latencies, errors, elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[10, 50, 200])
+    parser.add_argument("--requests-per-level", type=int, default=0, help="default: 2x concurrency, at least 50")
+    parser.add_argument("--embed-latency", type=float, default=0.05)
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--vector-latency", type=float, default=0.03, help="per Pinecone call")
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--skip-sync", action="store_true", help="only benchmark the async endpoint")
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="autorag-bench-")
+    configure_env(workdir)
+    from benchmarks import standins
+    from app.main import app
+    from app.services import rag
+
+    @app.post("/bench/chat-sync")
+    def chat_sync(body: dict):
+        return rag.rag_chat(body["project_id"], body["question"])
+
+    standins.install_fakes(vector_latency=args.vector_latency)
+    project_id = 1
+    seed_project(project_id, args.chunks)
+    standin_process = standins.serve_standins(STANDIN_PORT, embed_latency=args.embed_latency, llm_latency=args.llm_latency)
+    standins.serve(app, APP_PORT)
+
+    import httpx
+    metrics_client = httpx.Client(base_url=f"http://127.0.0.1:{APP_PORT}")
+    endpoints = [("async", "/api/chat")] + ([] if args.skip_sync else [("sync", "/bench/chat-sync")])
+    results = []
+    for concurrency in args.concurrency:
+        total = args.requests_per_level or max(50, 2 * concurrency)
+        for name, path in endpoints:
+            before = external_calls(metrics_client)
+            result = {"endpoint": name, "concurrency": concurrency, **asyncio.run(run_level(path, concurrency, total, project_id))}
+            result["external"] = external_breakdown(before, external_calls(metrics_client), result["requests"])
+            print(json.dumps(result))
+            results.append(result)
+
+    report = {
+        "benchmark": "chat_concurrency",
+        "config": {
+            "embed_latency": args.embed_latency,
+            "llm_latency": args.llm_latency,
+            "vector_latency": args.vector_latency,
+            "chunks": args.chunks,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    standin_process.terminate()
+    return report
+
+
+if __name__ == "__main__":
+    main()
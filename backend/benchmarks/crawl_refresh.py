@@ -0,0 +1,82 @@
+"""
+Crawl benchmark against the stand-in docs site.
+
+Crawls the stand-ins' sitemap of --pages pages twice with crawler.crawl: an
+initial crawl, then a refresh that sends the validators recorded by the first
+one (every page answers 304). Reports seconds and pages/s per pass; ingestion
+of the crawled text is measured by ingestion_throughput, not here.
+
+    cd backend
+    python -m benchmarks.crawl_refresh --pages 500 --page-latency 0.1 --output crawl_bench.json
+"""
+import os
+import json
+import time
+import argparse
+import tempfile
+from datetime import datetime
+
+from benchmarks.chat_concurrency import STANDIN_PORT, configure_env
+
+
+def run_pass(name, url, known):
+    from app.services import crawler
+    start = time.perf_counter()
+    pages = list(crawler.crawl(url, 'sitemap', known))
+    elapsed = time.perf_counter() - start
+    statuses = {}
+    for page in pages:
+        statuses[page.status] = statuses.get(page.status, 0) + 1
+    result = {
+        'pass': name,
+        'pages': len(pages),
+        'statuses': statuses,
+        'errors': statuses.get('failed', 0) + statuses.get('skipped', 0),
+        'seconds': round(elapsed, 3),
+        'pages_per_second': round(len(pages) / elapsed, 2) if elapsed else None,
+        'text_chars': sum(len(page.text or '') for page in pages),
+    }
+    return result, pages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--size", type=int, default=20000, help="characters of text per page")
+    parser.add_argument("--page-latency", type=float, default=0.1, help="per page fetch")
+    parser.add_argument("--embed-latency", type=float, default=0.05)
+    parser.add_argument("--host-rate", type=float, default=0, help="CRAWL_HOST_RATE; 0 = unlimited")
+    parser.add_argument("--concurrency", type=int, default=16, help="CRAWL_CONCURRENCY")
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    configure_env(tempfile.mkdtemp(prefix="autorag-bench-"))
+    os.environ.update({"CRAWL_HOST_RATE": str(args.host_rate), "CRAWL_CONCURRENCY": str(args.concurrency)})
+    from benchmarks import standins
+    standin_process = standins.serve_standins(STANDIN_PORT, embed_latency=args.embed_latency, page_latency=args.page_latency)
+    url = f"http://127.0.0.1:{STANDIN_PORT}/sitemap.xml?pages={args.pages}&size={args.size}"
+    results = []
+    try:
+        initial, pages = run_pass('initial', url, {})
+        results.append(initial)
+        print(json.dumps(initial))
+        known = {page.url: (page.etag, page.last_modified, datetime.utcnow()) for page in pages if page.status == 'fetched'}
+        refresh, _ = run_pass('refresh', url, known)
+        results.append(refresh)
+        print(json.dumps(refresh))
+    finally:
+        standin_process.terminate()
+
+    report = {
+        "benchmark": "crawl_refresh",
+        "config": {k: v for k, v in vars(args).items() if k != "output"},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+"""
+Ingestion throughput benchmark against local stand-in services.
+
+Generates documents of each file type and size, runs ingest_document on them
+in-process and reports seconds, MB/s, chunks/s and the per-stage breakdown
+recorded in Document.ingestion_stats. Jina and the web pages for URL documents
+are served by the stand-ins process; GCS, Vision and Pinecone are in-process
+fakes with injected latency (see standins.py), so nothing outside the machine
+is contacted. Results go to stdout and, with --output, to a JSON file.
+
+    cd backend
+    python -m benchmarks.ingestion_throughput --types txt pdf docx --sizes 100k 1m 10m --output ingest_bench.json
+"""
+import os
+import csv
+import json
+import time
+import argparse
+import tempfile
+import textwrap
+
+from benchmarks.chat_concurrency import STANDIN_PORT, configure_env, percentile
+from benchmarks.standins import fake_text
+
+UPLOAD_DIR = None  # under the benchmark's workdir, see use_upload_dir
+FILE_TYPES = {
+    'txt': 'text/plain',
+    'csv': 'text/csv',
+    'docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'pdf': 'application/pdf',
+    'image': 'image/png',
+    'url': 'url',
+}
+# OCR output size is set by the Vision fake, not the image
+FIXED_SIZE_TYPES = {'image'}
+PDF_PAGE_CHARS = 4000
+
+
+def parse_size(value):
+    units = {'k': 1000, 'm': 1000 ** 2, 'g': 1000 ** 3}
+    value = value.lower().rstrip('b')
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
+# --- Document generators (size is characters of text content) ---
+def write_txt(path, size, seed):
+    with open(path, 'w') as f:
+        f.write(fake_text(size, seed))
+
+
+def write_csv(path, size, seed):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['id', 'title', 'body'])
+        written, row = 0, 0
+        while written < size:
+            body = fake_text(200, seed + row)
+            writer.writerow([row, f"record {row}", body])
+            written += len(body) + 20
+            row += 1
+
+
+def write_docx(path, size, seed):
+    import docx
+    document = docx.Document()
+    for i in range(max(1, size // 1000)):
+        document.add_paragraph(fake_text(1000, seed + i))
+    document.save(path)
+
+
+def _pdf_escape(line):
+    return line.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def write_pdf(path, size, seed):
+    """A plain text PDF, PDF_PAGE_CHARS characters per page, written without a PDF library."""
+    pages = [fake_text(PDF_PAGE_CHARS, seed + i) for i in range(max(1, size // PDF_PAGE_CHARS))]
+    kids = [4 + 2 * i for i in range(len(pages))]
+    objects = {
+        1: b"<< /Type /Catalog /Pages 2 0 R >>",
+        2: f"<< /Type /Pages /Kids [{' '.join(f'{k} 0 R' for k in kids)}] /Count {len(pages)} >>".encode(),
+        3: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    }
+    for page_obj, text in zip(kids, pages):
+        lines = " ".join(f"({_pdf_escape(line)}) '" for line in textwrap.wrap(text, 90))
+        stream = f"BT /F1 8 Tf 30 810 Td 11 TL {lines} ET".encode()
+        objects[page_obj] = (
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {page_obj + 1} 0 R >>"
+        ).encode()
+        objects[page_obj + 1] = b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream"
+    out, offsets = bytearray(b"%PDF-1.4\n"), {}
+    for number in sorted(objects):
+        offsets[number] = len(out)
+        out += b"%d 0 obj\n" % number + objects[number] + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for number in sorted(objects):
+        out += b"%010d 00000 n \n" % offsets[number]
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, 'wb') as f:
+        f.write(out)
+
+
+def write_image(path, size, seed):
+    import cv2
+    import numpy as np
+    image = np.full((1200, 1600, 3), 255, dtype=np.uint8)
+    for i, line in enumerate(textwrap.wrap(fake_text(1500, seed), 60)[:30]):
+        cv2.putText(image, line, (40, 50 + 38 * i), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 0, 0), 2)
+    cv2.imwrite(path, image)
+
+
+WRITERS = {'txt': write_txt, 'csv': write_csv, 'docx': write_docx, 'pdf': write_pdf, 'image': write_image}
+
+
+def use_upload_dir(path):
+    """Generate documents in `path` and have the ingestion tasks read uploads from there, not backend/uploads."""
+    global UPLOAD_DIR
+    from app import tasks
+    os.makedirs(path, exist_ok=True)
+    UPLOAD_DIR = path
+    tasks._upload_path = lambda filename: os.path.join(path, filename)
+
+
+def make_document(db, project_id, kind, size, seed):
+    from app import models
+    if kind == 'url':
+        filename = f"http://127.0.0.1:{STANDIN_PORT}/pages/{seed}?size={size}"
+    else:
+        extension = 'png' if kind == 'image' else kind
+        filename = f"bench_{seed}.{extension}"
+        WRITERS[kind](os.path.join(UPLOAD_DIR, filename), size, seed)
+    document = models.Document(project_id=project_id, filename=filename, filetype=FILE_TYPES[kind], status='processing')
+    db.add(document)
+    db.commit()
+    return document.id, filename
+
+
+def run_case(db, project_id, kind, size, repeat, seed):
+    from app import crud
+    from app.tasks import ingest_document
+    runs, errors = [], 0
+    for i in range(repeat):
+        document_id, filename = make_document(db, project_id, kind, size or 0, seed + i)
+        start = time.perf_counter()
+        result = ingest_document(document_id)
+        elapsed = time.perf_counter() - start
+        db.expire_all()
+        document = crud.get_document(db, document_id)
+        if kind != 'url':
+            os.remove(os.path.join(UPLOAD_DIR, filename))
+        if not result or 'error' in result:
+            errors += 1
+            print(f"  {kind} run {i} failed: {(result or {}).get('error')}")
+            continue
+        stats = document.ingestion_stats or {}
+        runs.append({
+            'seconds': elapsed,
+            'bytes': stats.get('size_bytes') or stats.get('counts', {}).get('bytes', 0),
+            'chunks': result['chunks'],
+            'stages': stats.get('stages', {}),
+        })
+    return summarize_case(kind, size, runs, errors)
+
+
+def summarize_case(kind, size, runs, errors):
+    seconds = sorted(r['seconds'] for r in runs)
+    total_seconds = sum(seconds)
+    stages = sorted({stage for r in runs for stage in r['stages']})
+    return {
+        'file_type': kind,
+        'size_chars': size,
+        'runs': len(runs),
+        'errors': errors,
+        'bytes': round(sum(r['bytes'] for r in runs) / len(runs)) if runs else None,
+        'chunks': round(sum(r['chunks'] for r in runs) / len(runs)) if runs else None,
+        'p50_seconds': round(percentile(seconds, 50), 4) if runs else None,
+        'max_seconds': round(seconds[-1], 4) if runs else None,
+        'mb_per_second': round(sum(r['bytes'] for r in runs) / 1e6 / total_seconds, 3) if total_seconds else None,
+        'chunks_per_second': round(sum(r['chunks'] for r in runs) / total_seconds, 2) if total_seconds else None,
+        'stage_mean_seconds': {
+            stage: round(sum(r['stages'].get(stage, 0.0) for r in runs) / len(runs), 4) for stage in stages
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--types", nargs="+", default=list(FILE_TYPES), choices=list(FILE_TYPES))
+    parser.add_argument("--sizes", nargs="+", default=["100k", "1m"], help="characters of text per document, e.g. 100k 1m 10m")
+    parser.add_argument("--repeat", type=int, default=3, help="documents per file type and size")
+    parser.add_argument("--embed-latency", type=float, default=0.05)
+    parser.add_argument("--vector-latency", type=float, default=0.03, help="per Pinecone call")
+    parser.add_argument("--gcs-latency", type=float, default=0.2)
+    parser.add_argument("--vision-latency", type=float, default=0.5)
+    parser.add_argument("--page-latency", type=float, default=0.1, help="per URL fetch")
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="autorag-bench-")
+    configure_env(workdir)
+    from benchmarks import standins
+    from app import models
+    from app.database import Base, SessionLocal, engine
+    Base.metadata.create_all(engine)
+    standins.install_fakes(gcs_latency=args.gcs_latency, vision_latency=args.vision_latency, vector_latency=args.vector_latency)
+    standin_process = standins.serve_standins(STANDIN_PORT, embed_latency=args.embed_latency, page_latency=args.page_latency)
+    use_upload_dir(os.path.join(workdir, "uploads"))
+
+    db = SessionLocal()
+    project = models.Project(name="bench")
+    db.add(project)
+    db.commit()
+    results, seed = [], 0
+    try:
+        for kind in args.types:
+            sizes = [None] if kind in FIXED_SIZE_TYPES else [parse_size(s) for s in args.sizes]
+            for size in sizes:
+                result = run_case(db, project.id, kind, size, args.repeat, seed)
+                seed += args.repeat
+                print(json.dumps(result))
+                results.append(result)
+    finally:
+        db.close()
+        standin_process.terminate()
+
+    report = {
+        "benchmark": "ingestion_throughput",
+        "config": {k: v for k, v in vars(args).items() if k != "output"},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    main()
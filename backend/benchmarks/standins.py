@@ -0,0 +1,276 @@
+"""
+Local stand-ins for every external service, so benchmarks run offline.
+
+Served over HTTP by `create_app` (latency injected with asyncio.sleep, so the
+stand-ins can serve thousands of concurrent requests and never become the
+bottleneck):
+- Jina embeddings: POST /v1/embeddings (deterministic vectors derived from the text)
+- Groq chat completions: POST /openai/v1/chat/completions (plain and SSE streaming)
+- Web pages for URL ingestion: GET /pages/{n}?size=bytes&pages=N, with site
+  chrome, links to the next pages (for prefix crawls) and ETag/Last-Modified
+  validators (304 when unchanged; ?version= changes a page), plus
+  GET /sitemap.xml?pages=N&size=bytes listing them
+
+In-process, installed with `install_fakes` (latency injected with time.sleep):
+- Google Cloud Storage and Vision clients, through the registry
+- Pinecone: the local vector store behind a fixed per-call delay
+"""
+import json
+import time
+import asyncio
+import hashlib
+import functools
+import threading
+import multiprocessing
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import Response, StreamingResponse
+
+EMBEDDING_DIM = 768
+PAGE_LAST_MODIFIED = "Mon, 01 Jan 2024 00:00:00 GMT"
+
+
+@functools.lru_cache(maxsize=100000)
+def _fake_embedding_json(text, dim=EMBEDDING_DIM):
+    return json.dumps(fake_embedding(text, dim))
+
+
+def fake_embedding(text, dim=EMBEDDING_DIM):
+    seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+    vector = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+def fake_text(n_chars, seed=0):
+    """Prose-like text of about `n_chars` characters."""
+    words, size, i = [], 0, 0
+    while size < n_chars:
+        word = f"term{(i * 7919 + seed) % 5000}"
+        words.append(word + ("." if i % 15 == 14 else ""))
+        size += len(word) + 1
+        i += 1
+    return " ".join(words)
+
+
+def create_app(embed_latency=0.05, llm_latency=0.5, llm_tokens=50, page_latency=0.1):
+    """
+    embed_latency: seconds per embeddings request
+    llm_latency: seconds per completion, spread evenly over `llm_tokens` deltas when streaming
+    page_latency: seconds per web page fetch
+    """
+    app = FastAPI()
+    app.state.requests = {'embeddings': 0, 'completions': 0, 'pages': 0, 'pages_not_modified': 0}
+
+    @app.get("/pages/{n}")
+    async def page(request: Request, n: int, size: int = 20000, pages: int = 0, version: int = 0):
+        app.state.requests['pages'] += 1
+        await asyncio.sleep(page_latency)
+        etag = f'"{n}-{size}-{version}"'
+        validators = {"ETag": etag, "Last-Modified": PAGE_LAST_MODIFIED}
+        if request.headers.get("if-none-match") == etag:
+            app.state.requests['pages_not_modified'] += 1
+            return Response(status_code=304, headers=validators)
+        query = f"size={size}&pages={pages}&version={version}"
+        links = "".join(f'<li><a href="/pages/{m}?{query}">Page {m}</a></li>' for m in (n + 1, n + 2) if m < pages)
+        paragraphs = "".join(f"<p>{fake_text(1000, seed=n * 1000 + i + version)}</p>" for i in range(max(1, size // 1000)))
+        html = (
+            f"<html><head><title>Page {n}</title><style>body {{ margin: 0 }}</style></head><body>"
+            f"<header><nav><a href=\"/\">Home</a> | <a href=\"/pages/0?{query}\">Docs</a></nav></header>"
+            f"<main><h1>Page {n}</h1>{paragraphs}<ul>{links}</ul></main>"
+            f"<footer>Copyright stand-in docs</footer><script>var tracking = 1;</script></body></html>"
+        )
+        return Response(content=html, media_type="text/html", headers=validators)
+
+    @app.get("/sitemap.xml")
+    async def sitemap(request: Request, pages: int = 100, size: int = 20000, version: int = 0):
+        base = str(request.base_url).rstrip("/")
+        urls = "".join(
+            f"<url><loc>{base}/pages/{n}?size={size}&amp;pages={pages}&amp;version={version}</loc></url>" for n in range(pages)
+        )
+        xml = f'<?xml version="1.0" encoding="UTF-8"?><urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{urls}</urlset>'
+        return Response(content=xml, media_type="application/xml")
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        app.state.requests['embeddings'] += 1
+        await asyncio.sleep(embed_latency)
+        # Hand-built JSON: FastAPI's encoder would dominate the stand-in's CPU time
+        items = ",".join(f'{{"index": {i}, "embedding": {_fake_embedding_json(t)}}}' for i, t in enumerate(body["input"]))
+        return Response(content=f'{{"data": [{items}]}}', media_type="application/json")
+
+    @app.post("/openai/v1/chat/completions")
+    async def completions(request: Request):
+        body = await request.json()
+        app.state.requests['completions'] += 1
+        words = [f"word{i}" for i in range(llm_tokens)]
+        if not body.get("stream"):
+            await asyncio.sleep(llm_latency)
+            return {
+                "id": "standin",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body["model"],
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": " ".join(words)}, "finish_reason": "stop"}],
+            }
+
+        async def events():
+            for word in words:
+                await asyncio.sleep(llm_latency / llm_tokens)
+                chunk = {
+                    "id": "standin",
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": body["model"],
+                    "choices": [{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}],
+                }
+                yield f"data: {json.dumps(chunk)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+# --- In-process fakes ---
+class _Blob:
+    def __init__(self, latency):
+        self.latency = latency
+
+    def upload_from_filename(self, path):
+        time.sleep(self.latency)
+
+    def delete(self):
+        time.sleep(self.latency)
+
+
+class _Bucket:
+    def __init__(self, latency):
+        self.latency = latency
+
+    def blob(self, name):
+        return _Blob(self.latency)
+
+
+class FakeStorageClient:
+    def __init__(self, latency=0.2):
+        self.latency = latency
+
+    def bucket(self, name):
+        return _Bucket(self.latency)
+
+
+class _Annotation:
+    def __init__(self, description):
+        self.description = description
+
+
+class _VisionError:
+    message = ""
+
+
+class _VisionResponse:
+    def __init__(self, text):
+        self.text_annotations = [_Annotation(text)]
+        self.error = _VisionError()
+
+
+class _BatchResponse:
+    def __init__(self, responses):
+        self.responses = responses
+
+
+class FakeVisionClient:
+    """Returns `chars` characters of text per image; a batch request costs one latency."""
+
+    def __init__(self, latency=0.5, chars=2000):
+        self.latency = latency
+        self.chars = chars
+        self.images = 0
+
+    def text_detection(self, image):
+        time.sleep(self.latency)
+        self.images += 1
+        return _VisionResponse(fake_text(self.chars, seed=len(image.content)))
+
+    def batch_annotate_images(self, requests):
+        time.sleep(self.latency)
+        self.images += len(requests)
+        return _BatchResponse([_VisionResponse(fake_text(self.chars, seed=len(r.image.content))) for r in requests])
+
+
+class DelayedVectorStore:
+    """Wraps a vector store, adding a fixed delay to every call (Pinecone round trips)."""
+
+    def __init__(self, store, latency=0.03):
+        self.store = store
+        self.latency = latency
+
+    def upsert(self, ids, embeddings, metadatas):
+        time.sleep(self.latency)
+        return self.store.upsert(ids, embeddings, metadatas)
+
+    def query(self, vector, top_k=5, filter=None, include_metadata=True):
+        time.sleep(self.latency)
+        return self.store.query(vector, top_k=top_k, filter=filter, include_metadata=include_metadata)
+
+    async def aquery(self, vector, top_k=5, filter=None, include_metadata=True):
+        await asyncio.sleep(self.latency)
+        return await self.store.aquery(vector, top_k=top_k, filter=filter, include_metadata=include_metadata)
+
+    def delete(self, ids, project_id=None):
+        time.sleep(self.latency)
+        return self.store.delete(ids, project_id)
+
+    def __getattr__(self, name):
+        return getattr(self.store, name)
+
+
+def _spacy_or_blank():
+    import spacy
+    from app.config import settings
+    try:
+        return spacy.load(settings.SPACY_MODEL)
+    except OSError:
+        # Without the trained model NER finds nothing, but the pipeline cost is still measured
+        print(f"standins: spaCy model {settings.SPACY_MODEL} not installed, using a blank English pipeline")
+        return spacy.blank("en")
+
+
+def install_fakes(gcs_latency=0.2, vision_latency=0.5, vector_latency=0.03):
+    """Point the app's GCS, Vision and vector store clients at in-process fakes. Call after configure_env."""
+    from app.services import registry, vectorstore
+    registry.register("storage", lambda: FakeStorageClient(gcs_latency))
+    registry.register("vision", lambda: FakeVisionClient(vision_latency))
+    registry.register("spacy", _spacy_or_blank)
+    vectorstore._store = DelayedVectorStore(vectorstore.LocalVectorStore(), vector_latency)
+
+
+def serve(app, port, host="127.0.0.1"):
+    """Run an ASGI app with uvicorn on a daemon thread; returns once it accepts connections."""
+    server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level="warning", backlog=4096))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def _run_standins(port, kwargs):
+    uvicorn.run(create_app(**kwargs), host="127.0.0.1", port=port, log_level="warning", backlog=4096)
+
+
+def serve_standins(port, **kwargs):
+    """
+    Run the stand-ins in a separate process so they never compete with the
+    code under test for the GIL. Returns the process; terminate() it when done.
+    """
+    import httpx
+    process = multiprocessing.get_context("spawn").Process(target=_run_standins, args=(port, kwargs), daemon=True)
+    process.start()
+    while True:
+        try:
+            httpx.post(f"http://127.0.0.1:{port}/v1/embeddings", json={"input": ["ping"]})
+            return process
+        except httpx.TransportError:
+            time.sleep(0.1)
@@ -0,0 +1,98 @@
+"""
+Run the offline benchmarks and compare them with a baseline.
+
+Runs ingestion_throughput, chat_concurrency and crawl_refresh (each in its own
+process, since settings are read at import time), writes the reports to one JSON file and,
+given --baseline, flags every result that got worse than the baseline by more
+than --tolerance. Exits with status 1 when anything regressed, so it can gate a
+deploy.
+
+    cd backend
+    python -m benchmarks.suite --output bench.json
+    python -m benchmarks.suite --output bench.json --baseline bench_main.json --tolerance 0.2
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+
+# metric -> True when higher is better
+CHECKS = {
+    "chat_concurrency": (("endpoint", "concurrency"), {"p50_ms": False, "p95_ms": False, "p99_ms": False, "throughput_rps": True, "errors": False}),
+    "ingestion_throughput": (("file_type", "size_chars"), {"p50_seconds": False, "chunks_per_second": True, "mb_per_second": True, "errors": False}),
+    "crawl_refresh": (("pass",), {"seconds": False, "pages_per_second": True, "errors": False}),
+}
+
+
+def run(module, extra_args):
+    fd, path = tempfile.mkstemp(suffix=".json")
+    os.close(fd)
+    subprocess.run([sys.executable, "-m", f"benchmarks.{module}", "--output", path, *extra_args], check=True)
+    with open(path) as f:
+        report = json.load(f)
+    os.remove(path)
+    return report
+
+
+def compare(current, baseline, tolerance):
+    """List of regressions between two suite reports."""
+    regressions = []
+    for name, (key_fields, metrics) in CHECKS.items():
+        if name not in current or name not in baseline:
+            continue
+        previous = {tuple(r[k] for k in key_fields): r for r in baseline[name]["results"]}
+        for result in current[name]["results"]:
+            key = tuple(result[k] for k in key_fields)
+            before = previous.get(key)
+            if before is None:
+                continue
+            for metric, higher_is_better in metrics.items():
+                old, new = before.get(metric), result.get(metric)
+                if old is None or new is None:
+                    continue
+                if metric == "errors":
+                    worse = new > old
+                elif higher_is_better:
+                    worse = new < old * (1 - tolerance)
+                else:
+                    worse = new > old * (1 + tolerance)
+                if worse:
+                    regressions.append({"benchmark": name, "case": dict(zip(key_fields, key)), "metric": metric, "baseline": old, "current": new})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--baseline", help="an earlier --output to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative change before a result counts as a regression")
+    parser.add_argument("--skip", nargs="*", default=[], choices=list(CHECKS))
+    parser.add_argument("--ingestion-args", default="", help="extra arguments for ingestion_throughput, as one string")
+    parser.add_argument("--chat-args", default="--skip-sync", help="extra arguments for chat_concurrency, as one string")
+    parser.add_argument("--crawl-args", default="", help="extra arguments for crawl_refresh, as one string")
+    args = parser.parse_args()
+
+    report = {}
+    if "ingestion_throughput" not in args.skip:
+        report["ingestion_throughput"] = run("ingestion_throughput", args.ingestion_args.split())
+    if "chat_concurrency" not in args.skip:
+        report["chat_concurrency"] = run("chat_concurrency", args.chat_args.split())
+    if "crawl_refresh" not in args.skip:
+        report["crawl_refresh"] = run("crawl_refresh", args.crawl_args.split())
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        report["regressions"] = compare(report, baseline, args.tolerance)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    for regression in report.get("regressions", []):
+        print(f"REGRESSION {json.dumps(regression)}")
+    if report.get("regressions"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,11 @@
+import os
+import tempfile
+
+# Settings are read when app.config is imported: point the app at throwaway local stores,
+# and let crawls of the local stand-ins run unthrottled, first
+_workdir = tempfile.mkdtemp(prefix="autorag-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_workdir, 'test.db')}")
+os.environ.setdefault("VECTOR_BACKEND", "local")
+os.environ.setdefault("LOCAL_VECTOR_DIR", os.path.join(_workdir, "vectors"))
+os.environ.setdefault("EMBEDDING_CACHE_ENABLED", "false")
+os.environ.setdefault("CRAWL_HOST_RATE", "0")
@@ -0,0 +1,124 @@
+import gzip
+import socket
+import pytest
+from app.database import Base, SessionLocal, engine
+from app import crud, models, tasks
+from app.services import crawler
+from benchmarks import standins
+
+
+@pytest.fixture(scope="module")
+def site():
+    """Base URL of the stand-in docs site, and its request counters."""
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    app = standins.create_app(page_latency=0)
+    server = standins.serve(app, port)
+    yield f"http://127.0.0.1:{port}", app.state.requests
+    server.should_exit = True
+
+
+@pytest.fixture
+def db():
+    Base.metadata.create_all(engine)
+    session = SessionLocal()
+    yield session
+    session.close()
+
+
+def test_parse_sitemap_of_the_site(site):
+    base, _ = site
+    pages, children = crawler.parse_sitemap(crawler.fetch(f"{base}/sitemap.xml?pages=3&size=1000").content)
+    assert [url for url, _ in pages] == [f"{base}/pages/{n}?size=1000&pages=3&version=0" for n in range(3)]
+    assert [lastmod for _, lastmod in pages] == [None] * 3
+    assert children == []
+
+
+def test_parse_sitemap_index_gzipped():
+    index = (
+        b'<?xml version="1.0" encoding="UTF-8"?><sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+        b'<sitemap><loc> https://example.com/a.xml </loc></sitemap></sitemapindex>'
+    )
+    sitemap = (
+        b'<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+        b'<url><loc>https://example.com/x</loc><lastmod>2024-01-02T03:04:05+01:00</lastmod></url></urlset>'
+    )
+    assert crawler.parse_sitemap(gzip.compress(index)) == ([], ["https://example.com/a.xml"])
+    [(url, lastmod)], _ = crawler.parse_sitemap(sitemap)
+    assert url == "https://example.com/x" and lastmod.isoformat() == "2024-01-02T02:04:05"
+
+
+def test_parse_html_keeps_main_content_and_links(site):
+    base, _ = site
+    page = crawler.fetch(f"{base}/pages/1?size=1000&pages=3")
+    text, links = crawler.parse_html(crawler.decode(page.content, page.charset), page.url)
+    assert text.startswith("Page 1\n\nPage 1\n\nterm")
+    assert "Copyright" not in text and "tracking" not in text and "Home" not in text
+    assert f"{base}/pages/2?size=1000&pages=3&version=0" in links
+    assert f"{base}/" in links
+
+
+def test_parse_html_of_xhtml_with_an_encoding_declaration():
+    xhtml = (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<html xmlns="http://www.w3.org/1999/xhtml"><body><main><p>Grüße</p></main></body></html>'
+    )
+    assert crawler.parse_html(xhtml) == ("Grüße", [])
+    page = crawler.FetchResult("https://example.com/", 200, xhtml.encode('utf-8'), 'application/xhtml+xml')
+    assert crawler.page_text(page) == "Grüße"
+
+
+def test_conditional_fetch_is_not_modified(site):
+    base, requests = site
+    url = f"{base}/pages/0?size=1000"
+    page = crawler.fetch(url)
+    assert page.status == 200 and page.etag and page.last_modified == standins.PAGE_LAST_MODIFIED
+    before = requests['pages_not_modified']
+    again = crawler.fetch(url, page.etag, page.last_modified)
+    assert again.not_modified and again.content == b""
+    assert requests['pages_not_modified'] == before + 1
+    assert crawler.fetch(f"{base}/pages/0?size=1000&version=1", page.etag).status == 200
+
+
+def test_prefix_crawl_follows_links_under_the_prefix(site):
+    base, _ = site
+    page_url = f"{base}/pages/{{}}?size=1000&pages=5&version=0"
+    pages = list(crawler.crawl(page_url.format(0), 'prefix'))
+    # Every page links to the next two and to the site root, which lies outside /pages/
+    assert sorted(page.url for page in pages) == [page_url.format(n) for n in range(5)]
+    assert {page.status for page in pages} == {'fetched'}
+    assert len(list(crawler.crawl(page_url.format(0), 'prefix', max_pages=3))) == 3
+
+
+def test_ingest_site_counts(site, db, monkeypatch):
+    base, _ = site
+    queued = []
+    monkeypatch.setattr(tasks, 'start_page_ingestion', queued.extend)
+    project = models.Project(name="crawl")
+    db.add(project)
+    db.commit()
+    url = f"{base}/sitemap.xml?pages=4&size=1000"
+
+    batch = crud.create_ingestion_batch(db, project.id, status='crawling')
+    assert crawler.ingest_site(db, batch, url) == {'new': 4, 'changed': 0, 'unchanged': 0, 'skipped': 0, 'failed': 0}
+    assert len(queued) == 4
+    # Validators are only stored once a page is ingested: finish the pipeline as finalize_document would
+    for document_id, text, _, etag, last_modified in queued:
+        doc = crud.get_document(db, document_id)
+        assert doc.http_etag is None and doc.fetched_at is None
+        doc.status, doc.content_hash = 'ready', crawler._content_hash(text)
+        crawler.record_fetch(doc, etag, last_modified)
+    docs = crud.get_url_documents(db, project.id)
+    # A stale ETag refetches the page: one with the same text, one whose text changed since
+    docs[0].http_etag = docs[1].http_etag = '"stale"'
+    docs[1].content_hash = 'changed'
+    db.commit()
+
+    queued.clear()
+    batch = crud.create_ingestion_batch(db, project.id, status='crawling')
+    assert crawler.ingest_site(db, batch, url) == {'new': 0, 'changed': 1, 'unchanged': 3, 'skipped': 0, 'failed': 0}
+    assert [page[0] for page in queued] == [docs[1].id]
+    db.refresh(docs[0])
+    assert docs[0].http_etag != '"stale"'
+    assert batch.crawl['changed'] == 1
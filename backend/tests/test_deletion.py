@@ -0,0 +1,112 @@
+import pytest
+from app.database import Base, SessionLocal, engine
+from app import crud, models, tasks
+from app.services import crawler, deletion, embeddings
+
+
+@pytest.fixture
+def db(monkeypatch):
+    Base.metadata.create_all(engine)
+    session = SessionLocal()
+    # Deletion jobs are run by hand
+    monkeypatch.setattr(deletion, '_queue', lambda job: None)
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def deleted_vectors(monkeypatch):
+    deleted = []
+    monkeypatch.setattr(embeddings, 'delete_vectors', lambda ids, project_id=None: deleted.extend(ids))
+    return deleted
+
+
+def _document(db, n_chunks=2):
+    project = models.Project(name="deletion")
+    db.add(project)
+    db.commit()
+    doc = models.Document(project_id=project.id, filename=f"p{project.id}.txt", filetype="text/plain", status="processing")
+    db.add(doc)
+    db.commit()
+    _chunks(db, doc.id, n_chunks)
+    return doc
+
+
+def _chunks(db, document_id, n, prefix="v"):
+    crud.bulk_insert_chunks(db, (
+        {"document_id": document_id, "text": f"chunk {i}", "chunk_metadata": {}, "vector_id": f"{prefix}{document_id}-{i}", "embedded": False}
+        for i in range(n)
+    ))
+    return [f"{prefix}{document_id}-{i}" for i in range(n)]
+
+
+def test_embed_removes_its_vectors_when_deleted_meanwhile(db, deleted_vectors, monkeypatch):
+    doc = _document(db)
+    vector_ids = [row.vector_id for row in crud.get_chunk_refs(db, doc.id)]
+
+    def upsert_while_deleting(records, **kwargs):
+        list(records)
+        deletion.delete_document(db, doc)
+
+    monkeypatch.setattr(embeddings, 'embed_and_upsert', upsert_while_deleting)
+    payload = {'document_id': doc.id, 'project_id': doc.project_id, 'vector_ids': vector_ids, 'removed_vectors': []}
+    assert tasks.embed_document(payload) is None
+    assert deleted_vectors == vector_ids
+    assert tasks.finalize_document(payload) is None
+    assert crud.get_document(db, doc.id).status == crud.DELETING
+
+
+def test_job_removes_chunks_stored_while_it_ran(db, deleted_vectors, monkeypatch):
+    doc = _document(db)
+    document_id = doc.id
+    job = deletion.delete_document(db, doc)
+    late = []
+    # An extract_document that passed its status check before the mark stores its rows during the files stage
+    monkeypatch.setattr(deletion, '_remove_document_files', lambda d: late.extend(_chunks(db, document_id, 3, prefix="late")))
+    counts = deletion.run_job(db, job)
+    assert counts == {'chunks': 5, 'vectors': 5, 'documents': 1}
+    assert late and set(late) <= set(deleted_vectors)
+    assert crud.get_chunk_refs(db, document_id) == []
+    assert crud.get_document(db, document_id) is None
+
+
+def test_deleting_documents_are_excluded_at_once(db):
+    doc = _document(db, n_chunks=0)
+    other = models.Document(project_id=doc.project_id, filename="other.txt", filetype="text/plain")
+    db.add(other)
+    db.commit()
+    assert deletion.excluded_documents(doc.project_id) == (False, set())
+    deletion.delete_document(db, doc)
+    assert deletion.excluded_documents(doc.project_id) == (False, {doc.id})
+    deletion.delete_project(db, doc.project_id)
+    assert deletion.excluded_documents(doc.project_id) == (True, set())
+
+
+def test_project_job_removes_documents_added_after_the_mark(db, deleted_vectors, monkeypatch):
+    doc = _document(db)
+    project_id = doc.project_id
+    job = deletion.delete_project(db, project_id)
+    late = []
+
+    def upload_during_files_stage(d):
+        if not late:
+            added = models.Document(project_id=project_id, filename="late.txt", filetype="text/plain", status="processing")
+            db.add(added)
+            db.commit()
+            late.append(added.id)
+            _chunks(db, added.id, 2, prefix="late")
+
+    monkeypatch.setattr(deletion, '_remove_document_files', upload_during_files_stage)
+    counts = deletion.run_job(db, job)
+    assert counts['documents'] == 2 and counts['chunks'] == 4
+    assert crud.get_document(db, late[0]) is None
+    assert crud.get_project(db, project_id) is None
+
+
+def test_crawl_stops_once_its_project_is_deleting(db):
+    doc = _document(db, n_chunks=0)
+    batch = crud.create_ingestion_batch(db, doc.project_id, status='crawling')
+    deletion.delete_project(db, doc.project_id)
+    with pytest.raises(crawler.CrawlAborted):
+        crawler.ingest_site(db, batch, "http://127.0.0.1:9/sitemap.xml")
+    assert crud.get_url_documents(db, doc.project_id) == []
@@ -0,0 +1,39 @@
+from app.services.chunking import TextChunk
+from app.services.ingestion import content_hash, diff_chunks
+
+
+def _chunk(index, text):
+    return TextChunk(index=index, text=text, start=0, end=len(text), tokens=len(text.split()))
+
+
+def _row(row_id, text, embedded=True):
+    return {'id': row_id, 'vector_id': f"v{row_id}", 'content_hash': content_hash(text), 'chunk_metadata': {}, 'embedded': embedded}
+
+
+def test_diff_reuses_rows_with_unchanged_text():
+    existing = [_row(1, "alpha"), _row(2, "beta")]
+    added, kept, removed = diff_chunks(existing, [_chunk(0, "alpha"), _chunk(1, "gamma")])
+    assert [c.text for c in added] == ["gamma"]
+    assert [(row['id'], chunk.text) for row, chunk in kept] == [(1, "alpha")]
+    assert [row['id'] for row in removed] == [2]
+
+
+def test_diff_reembeds_rows_whose_vectors_were_never_written():
+    # An ingestion that failed after storing its chunk rows left them unembedded
+    existing = [_row(1, "alpha"), _row(2, "beta", embedded=False)]
+    added, kept, removed = diff_chunks(existing, [_chunk(0, "alpha"), _chunk(1, "beta")])
+    assert [c.text for c in added] == ["beta"]
+    assert [row['id'] for row, _ in kept] == [1]
+    assert [row['id'] for row in removed] == [2]
+
+
+def test_diff_treats_rows_from_before_the_flag_as_embedded():
+    added, kept, removed = diff_chunks([_row(1, "alpha", embedded=None)], [_chunk(0, "alpha")])
+    assert not added and not removed
+    assert [row['id'] for row, _ in kept] == [1]
+
+
+def test_diff_matches_repeated_text_once_per_row():
+    existing = [_row(1, "same")]
+    added, kept, removed = diff_chunks(existing, [_chunk(0, "same"), _chunk(1, "same")])
+    assert len(kept) == 1 and [c.index for c in added] == [1] and not removed
@@ -0,0 +1,61 @@
+import cv2
+import numpy as np
+import pytest
+from app.services import ocr
+
+
+def _png(gray):
+    return cv2.imencode('.png', gray)[1].tobytes()
+
+
+def _screen(value):
+    # A gradient whose difference hash ignores a one-level change to a single pixel
+    gray = np.tile(np.arange(0, 256, 2, dtype=np.uint8), (128, 1))
+    gray[64, 64] += value
+    return gray
+
+
+@pytest.fixture
+def annotate(monkeypatch):
+    """Replaces Vision: an image's text is the number of its request and its position in it."""
+    requests = []
+
+    def fake(contents):
+        requests.append(len(contents))
+        return [f"text {len(requests)}.{i}" for i in range(len(contents))]
+
+    monkeypatch.setattr(ocr, '_annotate', fake)
+    monkeypatch.setattr(ocr, '_cache', ocr.OcrCache(100))
+    monkeypatch.setattr(ocr.OcrCache, '_redis_call', lambda self, fn: None)
+    return requests
+
+
+def test_images_with_the_same_perceptual_hash_are_cached_apart(annotate):
+    first, second = _screen(0), _screen(1)
+    assert ocr.perceptual_hash(first) == ocr.perceptual_hash(second)
+    assert ocr.content_key(first) != ocr.content_key(second)
+    assert ocr.ocr_images([_png(first)]) == ["text 1.0"]
+    assert ocr.ocr_images([_png(second), _png(first)]) == ["text 2.0", "text 1.0"]
+
+
+def test_perceptual_matching_is_opt_in(annotate, monkeypatch):
+    monkeypatch.setattr(ocr, '_cache', ocr.OcrCache(100, perceptual=True))
+    ocr.ocr_images([_png(_screen(0))])
+    assert ocr.ocr_images([_png(_screen(1))]) == ["text 1.0"]
+    assert ocr.get_ocr_cache().stats()['hits_perceptual'] == 1
+
+
+def test_an_undecodable_image_fails_only_itself(annotate):
+    texts = ocr.ocr_images([_png(_screen(0)), b'not an image', _png(_screen(0))])
+    assert texts[0] == texts[2] == "text 1.0"
+    assert isinstance(texts[1], ocr.ImageDecodeError)
+    assert annotate == [1]
+    with pytest.raises(ocr.ImageDecodeError):
+        ocr.ocr_image(b'not an image')
+
+
+def test_vision_errors_are_raised_and_not_cached(annotate, monkeypatch):
+    monkeypatch.setattr(ocr, '_annotate', lambda contents: [ocr.OcrError("Vision error: fail") for _ in contents])
+    with pytest.raises(ocr.OcrError):
+        ocr.ocr_image(_png(_screen(0)))
+    assert ocr.get_ocr_cache().stats()['items'] == 0
@@ -0,0 +1,41 @@
+import pytest
+from app.database import Base, SessionLocal, engine
+from app import crud, models, tasks
+from app.services import status
+
+
+@pytest.fixture
+def doc():
+    Base.metadata.create_all(engine)
+    db = SessionLocal()
+    project = models.Project(name="status")
+    db.add(project)
+    db.commit()
+    document = models.Document(project_id=project.id, filename="missing.txt", filetype="text/plain")
+    db.add(document)
+    db.commit()
+    yield db, document
+    db.close()
+
+
+def test_a_failing_stage_still_records_its_time(doc):
+    db, document = doc
+    tracker = status.IngestionTracker(db, document)
+    with pytest.raises(RuntimeError):
+        with tracker.stage('extract'):
+            raise RuntimeError("extractor crashed")
+    assert 'extract' in tracker.stats['stages']
+    assert tracker.progress == 0.0
+
+
+def test_extract_failing_before_tracking_marks_the_document_error(doc, monkeypatch):
+    db, document = doc
+
+    def broken_tracker(*args, **kwargs):
+        raise OSError("database went away")
+
+    monkeypatch.setattr(status, 'IngestionTracker', broken_tracker)
+    assert tasks.extract_document(document.id) == {'document_id': document.id, 'error': "database went away"}
+    db.expire_all()
+    stored = crud.get_document(db, document.id)
+    assert stored.status == 'error' and stored.ingestion_stats['error'] == "database went away"
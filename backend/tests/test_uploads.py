@@ -0,0 +1,41 @@
+import hashlib
+import os
+import pytest
+from app.config import settings
+from app.services import uploads
+
+
+@pytest.fixture(autouse=True)
+def partial_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'UPLOAD_PARTIAL_DIR', str(tmp_path))
+    monkeypatch.setattr(uploads, '_hashers', {})
+    return tmp_path
+
+
+def test_parts_are_written_piece_by_piece_and_hashed(tmp_path):
+    upload_id = uploads.create_session(1, "a.bin", 6)['upload_id']
+    assert uploads.append(upload_id, 0, iter([b"ab", b"cd"])) == 4
+    assert uploads.append(upload_id, 4, [b"ef"]) == 6
+    info, content_hash = uploads._complete(upload_id, str(tmp_path / "a.bin"))
+    assert (tmp_path / "a.bin").read_bytes() == b"abcdef"
+    assert content_hash == hashlib.sha256(b"abcdef").hexdigest()
+
+
+def test_an_oversized_part_is_discarded(monkeypatch):
+    monkeypatch.setattr(settings, 'MAX_UPLOAD_PART_BYTES', 4)
+    upload_id = uploads.create_session(1, "a.bin", 10)['upload_id']
+    uploads.append(upload_id, 0, [b"ab"])
+    with pytest.raises(uploads.UploadTooLarge):
+        uploads.append(upload_id, 2, [b"cd", b"ef", b"gh"])
+    assert uploads.session_status(upload_id)['offset'] == 2
+
+
+def test_abandoned_sessions_expire(monkeypatch):
+    upload_id = uploads.create_session(1, "a.bin", 10)['upload_id']
+    uploads.append(upload_id, 0, [b"ab"])
+    for path in uploads._paths(upload_id):
+        os.utime(path, (0, 0))
+    monkeypatch.setattr(settings, 'UPLOAD_SESSION_TTL', 0)
+    uploads.expire_sessions()
+    assert uploads.get_session(upload_id) is None
+    assert uploads._hashers == {}
@@ -0,0 +1,13 @@
+import numpy as np
+from app.config import settings
+from app.services import vectorstore
+
+
+def test_a_large_shard_with_every_row_deleted_returns_no_matches(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'LOCAL_VECTOR_EXACT_LIMIT', 4)
+    store = vectorstore.LocalVectorStore(str(tmp_path))
+    vectors = np.random.default_rng(0).normal(size=(8, 4)).tolist()
+    ids = [f"v{i}" for i in range(8)]
+    store.upsert(ids, vectors, [{"project_id": 1} for _ in ids])
+    store.delete(ids, project_id=1)
+    assert store.query(vectors[0], top_k=3, filter={"project_id": 1})["matches"] == []